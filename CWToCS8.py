@@ -1,89 +1,637 @@
 #!/usr/bin/env python
 import sys
+import math
+import argparse
+import functools
+from fractions import Fraction
+from collections import namedtuple
 import numpy
 
-def make_am_samples(amplitude, length_units, frequency=300.0):
-    sample_rate = 48000
-    unit_seconds = 0.05
-    length_samples = int(round(unit_seconds * length_units * sample_rate))
-    t = numpy.arange(length_samples, dtype=numpy.float32) / sample_rate
+import metrics
 
-    carrier = amplitude * (1 + 0.5 * numpy.sin(2 * numpy.pi * frequency * t))
-    return carrier.astype(numpy.float32)
+CHARACTER_TO_SYMBOLS_MAP = {
+    'A': '.-', 'B': '-...', 'C': '-.-.', 'D': '-..', 'E': '.',
+    'F': '..-.', 'G': '--.', 'H': '....', 'I': '..', 'J': '.---',
+    'K': '-.-', 'L': '.-..', 'M': '--', 'N': '-.', 'O': '---',
+    'P': '.--.', 'Q': '--.-', 'R': '.-.', 'S': '...', 'T': '-',
+    'U': '..-', 'V': '...-', 'W': '.--', 'X': '-..-', 'Y': '-.--',
+    'Z': '--..',
+    '1': '.----', '2': '..---', '3': '...--', '4': '....-', '5': '.....',
+    '6': '-....', '7': '--...', '8': '---..', '9': '----.', '0': '-----',
+    ' ': ' ',
+    'É': '..-..', '.': '.-.-.-', ',': '--..--', ':': '---...',
+    '?': '..--..', '!': '-.-.--', '\'': '.----.', '-': '-....-', '|': '-..-.',
+    '(': '-.--.-', ')': '-.--.-', 'À': '.--.-', '@': '.--.-.',
+    '<': '-.-.-', '>': '.-.-.', '+': '.-.-.', '/': '-..-.', '=': '-...-',
+}
 
-def make_fm_samples(amplitude, length_units, carrier_frequency=100000.0, modulation_frequency=1000.0, deviation=75000.0, sample_rate=48000):
-    unit_seconds = 0.05
-    length_samples = int(round(unit_seconds * length_units * sample_rate))
-    t = numpy.arange(length_samples, dtype=numpy.float32) / sample_rate
-    instantaneous_phase = (2 * numpy.pi * carrier_frequency * t + (deviation / modulation_frequency) * numpy.sin(2 * numpy.pi * modulation_frequency * t))
+# Inverse table for decoders. '/', '+' and '(' share their code with
+# '|', '>' and ')': prefer the Base64 characters since ciphertexts are keyed.
+SYMBOLS_TO_CHARACTER_MAP = {}
+for _character, _symbols in CHARACTER_TO_SYMBOLS_MAP.items():
+    SYMBOLS_TO_CHARACTER_MAP.setdefault(_symbols, _character)
+SYMBOLS_TO_CHARACTER_MAP.update({'-..-.': '/', '.-.-.': '+'})
+del _character, _symbols
 
-    signal_fm = amplitude * numpy.sin(instantaneous_phase)
-    return signal_fm.astype(numpy.float32)
+AMPLITUDE = 127
+CHUNK_SAMPLES = 65536
+
+RISE_SECONDS = 0.005
+ENCODER_CACHE_SIZE = 16
+
+AM_TONE_FREQUENCY = 300.0
+AM_DEPTH = 0.5
+AM_OFFSET_FREQUENCY = 1000.0
+FM_CARRIER_FREQUENCY = 100000.0
+FM_MODULATION_FREQUENCY = 1000.0
+FM_DEVIATION = 75000.0
+MAX_CARRIER_PERIOD = 1 << 16
+
+# Above these rates the message is synthesized at output_rate / L (L integer)
+# and interpolated. FM needs room for its Carson bandwidth, 2 * (75 + 1) kHz.
+AM_BASE_SAMPLE_RATE = 48000
+FM_BASE_SAMPLE_RATE = 192000
+# Output rate when none is given: the FM carrier plus its deviation must stay
+# below Nyquist, (100 + 75 + 1) kHz < 384 kS/s / 2.
+AM_DEFAULT_SAMPLE_RATE = 48000
+FM_DEFAULT_SAMPLE_RATE = 384000
+UPSAMPLE_TAPS_PER_PHASE = 16
+UPSAMPLE_KAISER_BETA = 6.0
+# The interpolated envelope rings ~0.5 % above its input on key edges, keep
+# full scale below 127.5 so the integer formats never wrap.
+UPSAMPLE_GAIN = 0.99
+
+# Interleaved I/Q sample formats. Samples are synthesized with AMPLITUDE as
+# full scale; stored = rint(sample * scale) + offset (no rounding for cf32).
+IQFormat = namedtuple("IQFormat", ["dtype", "scale", "offset"])
+IQ_FORMATS = {
+    'cs8': IQFormat(numpy.dtype(numpy.int8), 1.0, 0),        # HackRF
+    'cu8': IQFormat(numpy.dtype(numpy.uint8), 1.0, 128),     # RTL-SDR
+    'cs16': IQFormat(numpy.dtype(numpy.int16), 32767 / AMPLITUDE, 0),  # USRP, Pluto, LimeSDR
+    'cf32': IQFormat(numpy.dtype(numpy.float32), 1 / AMPLITUDE, 0),    # GNU Radio, SoapySDR
+}
+
+def format_from_path(path, default='cs8') -> str:
+    """IQ format named by the file extension (out.cu8 -> 'cu8'), else default."""
+    extension = str(path).rsplit('.', 1)[-1].lower()
+    return extension if extension in IQ_FORMATS else default
+
+def nco_phase(frequency, sample_rate, start, n):
+    """Phase in radians (float32, wrapped to [0, 2pi)) of a tone at absolute samples start..start+n-1.
+
+    The accumulator runs in float64 cycles from the absolute sample index, so
+    the carrier stays continuous across elements and chunks and does not
+    lose precision on long transmissions.
+    """
+    increment = frequency / sample_rate
+    cycles = (start * increment) % 1.0 + increment * numpy.arange(n, dtype=numpy.float64)
+    cycles -= numpy.floor(cycles)
+    return (2 * numpy.pi * cycles).astype(numpy.float32)
+
+def carrier_period(frequencies, sample_rate, max_period=MAX_CARRIER_PERIOD):
+    """Number of samples after which tones at all frequencies repeat exactly, or None if above max_period."""
+    period = 1
+    for frequency in frequencies:
+        ratio = Fraction(float(frequency)) / Fraction(float(sample_rate))
+        period = math.lcm(period, ratio.denominator)
+        if period > max_period:
+            return None
+    return period
+
+def cis(phase):
+    """complex64 exp(j * phase)."""
+    out = numpy.empty(len(phase), dtype=numpy.complex64)
+    out.real = numpy.cos(phase)
+    out.imag = numpy.sin(phase)
+    return out
+
+def raised_cosine_ramp(length):
+    k = numpy.arange(length, dtype=numpy.float64)
+    return (0.5 - 0.5 * numpy.cos(numpy.pi * (k + 0.5) / length)).astype(numpy.float32)
+
+def default_sample_rate(modulation='AM'):
+    return FM_DEFAULT_SAMPLE_RATE if modulation.upper() == 'FM' else AM_DEFAULT_SAMPLE_RATE
+
+def check_nyquist(modulation, sample_rate, offset_frequency):
+    """ValueError if the signal around offset_frequency does not fit below the Nyquist frequency of sample_rate."""
+    width = FM_DEVIATION + FM_MODULATION_FREQUENCY if modulation.upper() == 'FM' else AM_TONE_FREQUENCY
+    if abs(offset_frequency) + width > sample_rate / 2:
+        raise ValueError(f"{modulation.upper()} signal at {offset_frequency:.0f} Hz (+/- {width:.0f} Hz) does not fit"
+                         f" in {sample_rate:.0f} S/s, raise the sample rate or lower the offset")
+
+class CWEncoder:
+    """Morse encoder with the keying envelope of every character compiled once.
+
+    Each character maps to run-length keying units and to a float32 envelope
+    (symbols, inter-symbol gaps and the trailing letter gap, with optional
+    raised-cosine edges). Encoding a message gathers the envelopes with one
+    concatenate and modulates the whole carrier in a single vectorized pass.
+
+    The output is complex64 baseband: AM is the tone-modulated envelope on
+    a complex exponential at offset_frequency, FM a constant-envelope
+    exp(j phase) centred on offset_frequency (default FM_CARRIER_FREQUENCY).
+    """
 
-def convert_to_CW(message: str, modulation: str = 'AM'):
-    character_to_symbols_map = {
-        'A': '.-', 'B': '-...', 'C': '-.-.', 'D': '-..', 'E': '.',
-        'F': '..-.', 'G': '--.', 'H': '....', 'I': '..', 'J': '.---',
-        'K': '-.-', 'L': '.-..', 'M': '--', 'N': '-.', 'O': '---',
-        'P': '.--.', 'Q': '--.-', 'R': '.-.', 'S': '...', 'T': '-',
-        'U': '..-', 'V': '...-', 'W': '.--', 'X': '-..-', 'Y': '-.--',
-        'Z': '--..',
-        '1': '.----', '2': '..---', '3': '...--', '4': '....-', '5': '.....',
-        '6': '-....', '7': '--...', '8': '---..', '9': '----.', '0': '-----',
-        ' ': ' ',
-        'É': '..-..', '.': '.-.-.-', ',': '--..--', ':': '---...',
-        '?': '..--..', '!': '-.-.--', '\'': '.----.', '-': '-....-', '|': '-..-.',
-        '(': '-.--.-', ')': '-.--.-', 'À': '.--.-', '@': '.--.-.',
-        '<': '-.-.-', '>': '.-.-.', '+': '.-.-.', '/': '-..-.', '=': '-...-',
-    }
-    amplitude = 127
     dot_units = 1
-    dash_units = dot_units * 3
+    dash_units = 3
     space_internal_units = 1
     space_letters_units = 3
     space_words_units = 7
 
-    if modulation.upper() == 'AM':
-        make_samples = make_am_samples
-    elif modulation.upper() == 'FM':
-        make_samples = make_fm_samples
+    def __init__(self, modulation='AM', sample_rate=None, unit_seconds=0.05, amplitude=AMPLITUDE, rise_seconds=RISE_SECONDS,
+                 offset_frequency=None):
+        if modulation.upper() not in ('AM', 'FM'):
+            raise ValueError("Unsupported modulation type")
+
+        self.modulation = modulation.upper()
+        if offset_frequency is None:
+            offset_frequency = AM_OFFSET_FREQUENCY if self.modulation == 'AM' else FM_CARRIER_FREQUENCY
+        sample_rate = sample_rate or default_sample_rate(self.modulation)
+        check_nyquist(self.modulation, sample_rate, offset_frequency)
+        self.offset_frequency = offset_frequency
+        self.sample_rate = sample_rate
+        self.unit_seconds = unit_seconds
+        self.amplitude = amplitude
+        self.rise_samples = int(round(rise_seconds * sample_rate))
+
+        letter_gap_units = self.space_letters_units - self.space_internal_units
+        word_gap_units = self.space_words_units - self.space_letters_units - self.space_internal_units
+        symbol_to_run_map = {
+            '.': (1, self.dot_units),
+            '-': (1, self.dash_units),
+            ' ': (0, word_gap_units),
+        }
+
+        self.space_keying = (numpy.zeros(1, dtype=numpy.uint8), numpy.array([word_gap_units]))
+        self.baseband_space = self._envelope(*self.space_keying)
+
+        self.character_keying = {}
+        self.character_waveforms = {}
+        for character, symbols in CHARACTER_TO_SYMBOLS_MAP.items():
+            runs = []
+            for symbol in symbols:
+                runs.append(symbol_to_run_map[symbol])
+                runs.append((0, self.space_internal_units))
+            runs.append((0, letter_gap_units))
+            levels = numpy.array([level for level, _ in runs], dtype=numpy.uint8)
+            units = numpy.array([units for _, units in runs])
+            self.character_keying[character] = (levels, units)
+            self.character_waveforms[character] = self._envelope(levels, units)
+        self.character_lengths = {c: len(w) for c, w in self.character_waveforms.items()}
+
+        # Both carriers are periodic at the usual rates: evaluate the NCO over
+        # one period and slice it, which keeps the phase exact and continuous.
+        if self.modulation == 'AM':
+            tones = (AM_TONE_FREQUENCY, offset_frequency)
+        else:
+            tones = (offset_frequency, FM_MODULATION_FREQUENCY)
+        self.period = carrier_period(tones, sample_rate)
+        self.carrier_tile = None
+        if self.period:
+            cycle = self._carrier_nco(0, self.period)
+            self.carrier_tile = numpy.tile(cycle, -(-CHUNK_SAMPLES // self.period) + 1)
+
+    def _envelope(self, levels, units):
+        lengths = numpy.rint(self.unit_seconds * units * self.sample_rate).astype(numpy.int64)
+        envelope = numpy.repeat(levels.astype(numpy.float32), lengths)
+        if self.rise_samples:
+            ends = numpy.cumsum(lengths)
+            starts = ends - lengths
+            for start, end, level in zip(starts, ends, levels):
+                if not level:
+                    continue
+                ramp = raised_cosine_ramp(min(self.rise_samples, (end - start) // 2))
+                envelope[start:start + len(ramp)] *= ramp
+                envelope[end - len(ramp):end] *= ramp[::-1]
+        return envelope
+
+    def _check(self, text: str) -> str:
+        for character in text:
+            if character not in self.character_waveforms:
+                raise ValueError(f"Character not supported in Morse mapping: {repr(character)}")
+        return text
+
+    def _frame(self, message: str) -> str:
+        return self._check(' < ' + message.upper() + ' > ')
+
+    def keying(self, message: str):
+        """Run-length keying of the framed message as (levels, units) arrays."""
+        keying = self.character_keying
+        parts = [self.space_keying] + [keying[c] for c in self._frame(message)] + [self.space_keying]
+        return numpy.concatenate([p[0] for p in parts]), numpy.concatenate([p[1] for p in parts])
+
+    def waveforms(self, message: str):
+        """Keying envelope pieces of the framed message, one per character."""
+        full_message = self._frame(message)
+        waveforms = self.character_waveforms
+        return [self.baseband_space] + [waveforms[c] for c in full_message] + [self.baseband_space]
+
+    def iter_waveforms(self, pieces):
+        """Same as waveforms for an iterable of text pieces, keyed as words of one message.
+
+        Pieces are checked (and upper-cased) one at a time, so an invalid
+        character only raises once the previous pieces have been yielded.
+        """
+        waveforms = self.character_waveforms
+        yield self.baseband_space
+        for character in ' < ':
+            yield waveforms[character]
+        separator = ''
+        for piece in pieces:
+            for character in self._check(separator + piece.upper()):
+                yield waveforms[character]
+            separator = ' '
+        for character in ' > ':
+            yield waveforms[character]
+        yield self.baseband_space
+
+    def _carrier_nco(self, start, n):
+        offset = cis(nco_phase(self.offset_frequency, self.sample_rate, start, n))
+        if self.modulation == 'AM':
+            tone = numpy.sin(nco_phase(AM_TONE_FREQUENCY, self.sample_rate, start, n))
+            scale = numpy.float32(self.amplitude / (1 + AM_DEPTH))
+            return offset * (scale * (1 + numpy.float32(AM_DEPTH) * tone))
+
+        beta = numpy.float32(FM_DEVIATION / FM_MODULATION_FREQUENCY)
+        deviation = cis(beta * numpy.sin(nco_phase(FM_MODULATION_FREQUENCY, self.sample_rate, start, n)))
+        return numpy.float32(self.amplitude) * offset * deviation
+
+    def carrier(self, start, n):
+        """Carrier (amplitude included) for absolute samples start..start+n-1."""
+        if self.carrier_tile is None:
+            return self._carrier_nco(start, n)
+        offset = start % self.period
+        if offset + n <= len(self.carrier_tile):
+            return self.carrier_tile[offset:offset + n]
+        return numpy.resize(numpy.roll(self.carrier_tile[:self.period], -offset), n)
+
+    def modulate(self, envelope, start=0):
+        """Apply the carrier to an envelope (or a block of envelopes, one per row) whose first sample is absolute sample start."""
+        with metrics.span("cw.modulate", samples=envelope.size):
+            return envelope * self.carrier(start, envelope.shape[-1])
+
+    def encode(self, message: str):
+        with metrics.span("cw.keying") as s:
+            envelope = numpy.concatenate(self.waveforms(message))
+            s.add(samples=len(envelope))
+        return self.modulate(envelope)
+
+    def encode_many(self, messages):
+        return [self.encode(message) for message in messages]
+
+    def num_samples(self, message: str) -> int:
+        lengths = self.character_lengths
+        return 2 * len(self.baseband_space) + sum(lengths[c] for c in self._frame(message))
+
+@functools.lru_cache(maxsize=ENCODER_CACHE_SIZE)
+def _cached_encoder(modulation, sample_rate, unit_seconds, amplitude, rise_seconds, offset_frequency):
+    with metrics.span("cw.setup"):
+        return CWEncoder(modulation, sample_rate, unit_seconds, amplitude, rise_seconds, offset_frequency)
+
+def get_encoder(modulation='AM', sample_rate=None, unit_seconds=0.05, amplitude=AMPLITUDE, rise_seconds=RISE_SECONDS,
+                offset_frequency=None) -> CWEncoder:
+    """Return the shared CWEncoder for these parameters (bounded LRU cache), sample_rate None is default_sample_rate()."""
+    sample_rate = sample_rate or default_sample_rate(modulation)
+    return _cached_encoder(modulation.upper(), sample_rate, unit_seconds, amplitude, rise_seconds, offset_frequency)
+
+def encode_many(messages, modulation='AM', **params):
+    return get_encoder(modulation, **params).encode_many(messages)
+
+def convert_to_CW(message: str, modulation: str = 'AM'):
+    return get_encoder(modulation).encode(message)
+
+@functools.lru_cache(maxsize=8)
+def lowpass_prototype(factor, taps_per_phase=UPSAMPLE_TAPS_PER_PHASE, beta=UPSAMPLE_KAISER_BETA):
+    """Kaiser-windowed sinc cut at 1 / (2 * factor) of the rate, factor * taps_per_phase taps summing to factor."""
+    length = factor * taps_per_phase
+    n = numpy.arange(length) - (length - 1) / 2
+    prototype = numpy.sinc(n / factor) * numpy.kaiser(length, beta)
+    return prototype * (factor / prototype.sum())
+
+@functools.lru_cache(maxsize=8)
+def polyphase_matrix(factor, taps_per_phase=UPSAMPLE_TAPS_PER_PHASE, beta=UPSAMPLE_KAISER_BETA):
+    """Interpolation filter by factor as a (2 * taps, 2 * factor) float32 matrix.
+
+    Kaiser-windowed sinc cut at the input Nyquist frequency, split into
+    factor phases of taps_per_phase taps. A window of taps input samples
+    seen as interleaved float32 (I0 Q0 I1 Q1 ...) times this matrix gives
+    the factor interpolated samples as interleaved float32, i.e. complex64.
+    """
+    prototype = UPSAMPLE_GAIN * lowpass_prototype(factor, taps_per_phase, beta)
+    # phases[p, t] = h[p + t * factor] weights input sample k - t for output k * factor + p
+    phases = prototype.reshape(taps_per_phase, factor).T
+    matrix = numpy.zeros((2 * taps_per_phase, 2 * factor), dtype=numpy.float32)
+    # Window row 2 * j (+1 for Q) holds input sample k - (taps - 1) + j
+    weights = phases[:, ::-1].T
+    matrix[0::2, 0::2] = weights
+    matrix[1::2, 1::2] = weights
+    return matrix
+
+class Upconverter:
+    """Interpolate complex chunks by an integer factor, then shift them to offset_frequency.
+
+    The filter history is carried from chunk to chunk and the NCO runs on the
+    absolute output sample index, so chunk boundaries are seamless. The
+    interpolation is one float32 matrix product per chunk.
+    """
+
+    def __init__(self, factor, output_rate, offset_frequency=0.0, taps_per_phase=UPSAMPLE_TAPS_PER_PHASE):
+        self.factor = factor
+        self.output_rate = output_rate
+        self.offset_frequency = offset_frequency
+        self.taps = taps_per_phase
+        self.matrix = polyphase_matrix(factor, taps_per_phase)
+        self.history = numpy.zeros(taps_per_phase - 1, dtype=numpy.complex64)
+        self.position = 0
+        self.period = carrier_period((offset_frequency,), output_rate) if offset_frequency else None
+        self.mixer_tile = None
+        if self.period:
+            self.mixer_tile = cis(nco_phase(offset_frequency, output_rate, 0, self.period))
+
+    def _mixer(self, start, n):
+        if self.mixer_tile is None:
+            return cis(nco_phase(self.offset_frequency, self.output_rate, start, n))
+        offset = start % self.period
+        if offset + n > len(self.mixer_tile):
+            self.mixer_tile = numpy.tile(self.mixer_tile[:self.period], -(-(offset + n) // self.period))
+        return self.mixer_tile[offset:offset + n]
+
+    def process(self, chunk):
+        with metrics.span("cw.upsample", samples=len(chunk) * self.factor):
+            return self._process(chunk)
+
+    def _process(self, chunk):
+        buffer = numpy.concatenate((self.history, numpy.asarray(chunk, dtype=numpy.complex64)))
+        windows = numpy.lib.stride_tricks.sliding_window_view(buffer.view(numpy.float32), 2 * self.taps)[::2]
+        output = numpy.dot(windows, self.matrix).view(numpy.complex64).ravel()
+        self.history = buffer[len(buffer) - len(self.history):]
+        if self.offset_frequency:
+            output *= self._mixer(self.position, len(output))
+        self.position += len(output)
+        return output
+
+def rate_plan(modulation='AM', sample_rate=None):
+    """(synthesis rate, interpolation factor) for an output sample rate (None: default_sample_rate(), no interpolation)."""
+    if sample_rate is None:
+        return default_sample_rate(modulation), 1
+    base = FM_BASE_SAMPLE_RATE if modulation.upper() == 'FM' else AM_BASE_SAMPLE_RATE
+    factor = max(1, int(sample_rate // base))
+    return sample_rate / factor, factor
+
+def _encoder_and_upconverter(modulation, sample_rate, offset_frequency):
+    internal_rate, factor = rate_plan(modulation, sample_rate)
+    if factor == 1:
+        return get_encoder(modulation, sample_rate=internal_rate, offset_frequency=offset_frequency), None
+    encoder = get_encoder(modulation, sample_rate=internal_rate, offset_frequency=0.0)
+    if offset_frequency is None:
+        offset_frequency = AM_OFFSET_FREQUENCY if modulation.upper() == 'AM' else FM_CARRIER_FREQUENCY
+    check_nyquist(modulation, sample_rate, offset_frequency)
+    return encoder, Upconverter(factor, sample_rate, offset_frequency)
+
+def cw_num_samples(message: str, modulation: str = 'AM', sample_rate=None) -> int:
+    internal_rate, factor = rate_plan(modulation, sample_rate)
+    return get_encoder(modulation, sample_rate=internal_rate).num_samples(message) * factor
+
+def iter_CW(message, modulation: str = 'AM', chunk_samples: int = CHUNK_SAMPLES, sample_rate=None, offset_frequency=None):
+    """Yield the CW signal as complex64 chunks of at most chunk_samples samples.
+
+    message is a string, or an iterable of strings (e.g. a generator of
+    ciphertext frames) keyed as the words of one message.
+
+    With sample_rate (e.g. 2-20 MS/s for an SDR), the message is synthesized
+    at a low rate, interpolated chunk by chunk and mixed to offset_frequency
+    (default AM_OFFSET_FREQUENCY or FM_CARRIER_FREQUENCY).
+    """
+    encoder, upconverter = _encoder_and_upconverter(modulation, sample_rate, offset_frequency)
+    if upconverter is None:
+        yield from _iter_encoded(encoder, message, chunk_samples)
+        return
+    for chunk in _iter_encoded(encoder, message, max(1, chunk_samples // upconverter.factor)):
+        yield upconverter.process(chunk)
+
+def _iter_encoded(encoder, message, chunk_samples):
+    buffer = numpy.empty((chunk_samples,), dtype=numpy.float32)
+    fill = 0
+    offset = 0
+    if isinstance(message, str):
+        waveforms = encoder.waveforms(message)
+    else:
+        waveforms = encoder.iter_waveforms(message)
+    for waveform in metrics.timed_iter("cw.keying", waveforms):
+        position = 0
+        while position < len(waveform):
+            n = min(chunk_samples - fill, len(waveform) - position)
+            buffer[fill:fill + n] = waveform[position:position + n]
+            fill += n
+            position += n
+            if fill == chunk_samples:
+                yield encoder.modulate(buffer, offset)
+                offset += fill
+                fill = 0
+    if fill:
+        yield encoder.modulate(buffer[:fill], offset)
+
+def branch_fir(branches, coefficients, out=None):
+    """Filter the columns of a complex64 (L + T - 1, m) block by a (T, m) float32 FIR, one filter per column.
+
+    out[l] = sum over t of coefficients[t] * branches[l + T - 1 - t], i.e.
+    the T - 1 leading rows are the history of the previous block. Wide
+    banks go through one einsum over a float32 sliding window (I and Q
+    columns side by side), narrow ones through a loop over the taps.
+    """
+    taps = len(coefficients)
+    length = len(branches) - taps + 1
+    if branches.shape[1] >= 8:
+        windows = numpy.lib.stride_tricks.sliding_window_view(branches.view(numpy.float32), taps, axis=0)
+        weights = numpy.repeat(coefficients, 2, axis=1).T[:, ::-1]
+        result = numpy.einsum('lct,ct->lc', windows, weights, out=None if out is None else out.view(numpy.float32))
+        return result.view(numpy.complex64)
+    if out is None:
+        out = numpy.zeros((length, branches.shape[1]), dtype=numpy.complex64)
     else:
-        raise ValueError("Unsupported modulation type")
+        out[:] = 0
+    for t in range(taps):
+        first = taps - 1 - t
+        out += branches[first:first + length] * coefficients[t]
+    return out
+
+def fdm_offsets(n_channels, channel_rate):
+    """Centre frequency in Hz of each FDM channel: adjacent channel_rate wide slots around 0 Hz."""
+    return [(k - n_channels // 2) * channel_rate for k in range(n_channels)]
+
+class FDMSynthesizer:
+    """Critically sampled polyphase synthesis filter bank.
+
+    Each call takes one block of samples per channel at channel_rate, shape
+    (n_channels, L), and returns L * n_channels samples at n_channels *
+    channel_rate with channel k shifted to fdm_offsets()[k]. One FFT across
+    the channels per output block and a taps_per_phase FIR per branch, so
+    the cost per output sample barely grows with the channel count. The FFT
+    runs on a single (block, n_channels) plan whatever L is, a block of
+    rows at a time.
+    """
 
-    baseband_dot = make_samples(1, dot_units)
-    baseband_dash = make_samples(1, dash_units)
-    baseband_between_symbols = make_samples(0, space_internal_units)
-    baseband_between_letters = make_samples(0, space_letters_units - space_internal_units)
-    baseband_space = make_samples(0, space_words_units - space_letters_units - space_internal_units)
+    def __init__(self, n_channels, taps_per_phase=UPSAMPLE_TAPS_PER_PHASE, block=None):
+        import fft_service
 
-    symbol_to_baseband_map = {
-        '.': baseband_dot,
-        '-': baseband_dash,
-        ' ': baseband_space,
-    }
+        self.fft_service = fft_service
+        self.n_channels = n_channels
+        m = n_channels
+        # Channel k sits in bin b; the forward FFT read at -p is the inverse DFT
+        self.bins = [(k - m // 2) % m for k in range(m)]
+        self.reverse = (-numpy.arange(m)) % m
+        self.taps = taps_per_phase
+        self.block = block or max(1, CHUNK_SAMPLES // m)
+        prototype = UPSAMPLE_GAIN * lowpass_prototype(m, taps_per_phase)
+        self.branches = prototype.reshape(taps_per_phase, m).astype(numpy.float32)
+        self.history = numpy.zeros((taps_per_phase - 1, m), dtype=numpy.complex64)
 
-    output = [baseband_space]
-    full_message = ' < ' + message.upper() + ' > '
+    def process(self, channels):
+        with metrics.span("fdm.synthesize", samples=channels.shape[1] * self.n_channels):
+            length = channels.shape[1]
+            output = numpy.empty((length, self.n_channels), dtype=numpy.complex64)
+            plan = self.fft_service.get_plan((self.block, self.n_channels), axes=(-1,))
+            for first in range(0, length, self.block):
+                # Rows past a short last block hold stale data, their FFT is not read
+                rows = min(self.block, length - first)
+                plan.input_array[:rows, self.bins] = channels[:, first:first + rows].T
+                branches = numpy.concatenate((self.history, plan()[:rows, self.reverse]))
+                branch_fir(branches, self.branches, out=output[first:first + rows])
+                self.history = branches[rows:]
+            return output.ravel()
 
-    for character in full_message:
-        if character not in character_to_symbols_map:
-            raise ValueError(f"Character not supported in Morse mapping: {repr(character)}")
+def fdm_num_samples(messages, modulation: str = 'AM', channel_rate=None) -> int:
+    channel_rate = channel_rate or (FM_BASE_SAMPLE_RATE if modulation.upper() == 'FM' else AM_BASE_SAMPLE_RATE)
+    encoder = get_encoder(modulation, sample_rate=channel_rate, offset_frequency=0.0 if modulation.upper() == 'FM' else None)
+    return max(encoder.num_samples(message) for message in messages) * len(messages)
 
-        symbols = character_to_symbols_map[character]
-        for symbol in symbols:
-            output.append(symbol_to_baseband_map[symbol])
-            output.append(baseband_between_symbols)
-        output.append(baseband_between_letters)
+def iter_FDM(messages, modulation: str = 'AM', chunk_samples: int = CHUNK_SAMPLES, channel_rate=None):
+    """Yield N messages keyed in parallel on N adjacent channels, as complex64 chunks at N * channel_rate.
 
-    output.append(baseband_space)
-    ouput = numpy.concatenate(output).astype(numpy.float32) * amplitude
-    return output
+    Every channel is the iter_CW signal of its message at channel_rate
+    (default AM_BASE_SAMPLE_RATE or FM_BASE_SAMPLE_RATE, FM centred on its
+    channel) scaled by 1 / N so the sum never clips. Keying and modulation
+    run on an (N, L) envelope block at once, the FDMSynthesizer moves each
+    row to its channel.
+    """
+    n = len(messages)
+    modulation = modulation.upper()
+    channel_rate = channel_rate or (FM_BASE_SAMPLE_RATE if modulation == 'FM' else AM_BASE_SAMPLE_RATE)
+    encoder = get_encoder(modulation, sample_rate=channel_rate, amplitude=AMPLITUDE / n,
+                          offset_frequency=0.0 if modulation == 'FM' else None)
+    length = max(1, chunk_samples // n)
+    synthesizer = FDMSynthesizer(n, block=length)
+    total = max(encoder.num_samples(message) for message in messages)
+    pieces = [iter(encoder.waveforms(message)) for message in messages]
+    pending = [numpy.empty(0, dtype=numpy.float32)] * n
+    envelopes = numpy.empty((n, length), dtype=numpy.float32)
+    for offset in range(0, total, length):
+        size = min(length, total - offset)
+        with metrics.span("cw.keying", samples=n * size):
+            for k in range(n):
+                fill = 0
+                while fill < size:
+                    if not len(pending[k]):
+                        pending[k] = next(pieces[k], None)
+                        if pending[k] is None:
+                            pending[k] = numpy.zeros(size - fill, dtype=numpy.float32)
+                    m = min(size - fill, len(pending[k]))
+                    envelopes[k, fill:fill + m] = pending[k][:m]
+                    pending[k] = pending[k][m:]
+                    fill += m
+        yield synthesizer.process(encoder.modulate(envelopes[:, :size], offset))
+
+def quantize_iq(iq, out, fmt='cs8', scratch=None):
+    """Write samples as interleaved I/Q into out, 2 * len(iq) items of the format dtype.
+
+    A complex64 input is read through a zero-copy float32 view and rounded
+    straight into out (cu8 is cs8 with the sign bit flipped in place), so
+    out can be a reused buffer or a slice of a memmap. scratch, a float32
+    buffer of 2 * len(iq), is only used by the scaled formats (cs16).
+    """
+    iq_format = IQ_FORMATS[fmt]
+    interleaved = numpy.ascontiguousarray(iq, dtype=numpy.complex64).view(numpy.float32)
+    if iq_format.dtype.kind == 'f':
+        numpy.multiply(interleaved, iq_format.scale, out=out)
+        return out
+    if iq_format.scale != 1.0:
+        interleaved = numpy.multiply(interleaved, numpy.float32(iq_format.scale), out=scratch)
+    if iq_format.offset:
+        numpy.rint(interleaved, out=out.view(numpy.int8), casting='unsafe')
+        numpy.bitwise_xor(out, numpy.uint8(0x80), out=out)
+    else:
+        numpy.rint(interleaved, out=out, casting='unsafe')
+    return out
+
+def write_IQ(IQ, file, fmt='cs8'):
+    out = numpy.empty((2 * len(IQ),), dtype=IQ_FORMATS[fmt].dtype)
+    with metrics.span("iq.quantize", samples=len(IQ)):
+        quantize_iq(IQ, out, fmt)
+    with metrics.span("iq.write", bytes=out.nbytes):
+        out.tofile(file)
 
 def write_toCS8(IQ, file):
-    output_int = numpy.empty((len(IQ) * 2,), dtype=numpy.int8)
-    output_int[0::2] = numpy.round(IQ.real).astype(numpy.int8)
-    output_int[1::2] = 0
-    output_int.tofile(file)
+    write_IQ(IQ, file, 'cs8')
+
+def _open_output(file):
+    if file == '-':
+        return sys.stdout.buffer, False
+    if hasattr(file, 'write'):
+        return file, False
+    return open(file, 'wb'), True
+
+def write_IQ_stream(chunks, file, fmt='cs8') -> int:
+    """Write sample chunks as interleaved I/Q in fmt to a path, a binary file object or '-' (stdout).
+
+    Only one chunk-sized output buffer is kept, so memory does not grow with
+    the message length. Returns the number of IQ samples written.
+    """
+    dtype = IQ_FORMATS[fmt].dtype
+    out, owned = _open_output(file)
+    output = numpy.empty((0,), dtype=dtype)
+    scratch = numpy.empty((0,), dtype=numpy.float32)
+    total = 0
+    try:
+        for chunk in chunks:
+            n = len(chunk)
+            if n == 0:
+                continue
+            if len(output) < 2 * n:
+                output = numpy.empty((2 * n,), dtype=dtype)
+                scratch = numpy.empty((2 * n,), dtype=numpy.float32)
+            with metrics.span("iq.quantize", samples=n):
+                quantize_iq(chunk, output[:2 * n], fmt, scratch[:2 * n])
+            with metrics.span("iq.write", bytes=output[:2 * n].nbytes):
+                out.write(memoryview(output[:2 * n]))
+            total += n
+        out.flush()
+    finally:
+        if owned:
+            out.close()
+    return total
+
+def write_toCS8_stream(chunks, file) -> int:
+    return write_IQ_stream(chunks, file, 'cs8')
+
+def write_IQ_memmap(message: str, file, modulation: str = 'AM', chunk_samples: int = CHUNK_SAMPLES, fmt='cs8',
+                    sample_rate=None, offset_frequency=None) -> int:
+    """Synthesize the CW signal directly into a memory-mapped I/Q file in fmt (see iter_CW for the rates)."""
+    total = cw_num_samples(message, modulation, sample_rate)
+    output = numpy.memmap(file, dtype=IQ_FORMATS[fmt].dtype, mode='w+', shape=(2 * max(total, 1),))
+    scratch = numpy.empty((2 * chunk_samples,), dtype=numpy.float32)
+    offset = 0
+    for chunk in iter_CW(message, modulation, chunk_samples, sample_rate, offset_frequency):
+        n = len(chunk)
+        with metrics.span("iq.quantize", samples=n):
+            quantize_iq(chunk, output[2 * offset:2 * (offset + n)], fmt, scratch[:2 * n])
+        offset += n
+    with metrics.span("iq.write", bytes=output.nbytes):
+        output.flush()
+    del output
+    return total
+
+def write_toCS8_memmap(message: str, file, modulation: str = 'AM', chunk_samples: int = CHUNK_SAMPLES) -> int:
+    return write_IQ_memmap(message, file, modulation, chunk_samples, 'cs8')
 
 def usage():
     print("Usage:")
@@ -91,30 +639,69 @@ def usage():
     print("")
     print("Cipher_B64 mode: python ./CWToCS8.py CIPHER_B64 <cipher_b64> <output_file> <AM|FM>")
     print("")
+    print("Cipher_CW mode : python ./CWToCS8.py CIPHER_CW <cipher_cw> <output_file> <AM|FM>")
+    print("")
+    print("Use '-' as <output_file> to stream the CS8 samples to stdout.")
+    print("")
+    print(f"Optional 5th argument: output format ({'|'.join(IQ_FORMATS)}), default from the")
+    print("<output_file> extension, else cs8.")
+    print("")
+    print("--sample-rate <S/s> : output sample rate (default 48000 AM, 384000 FM), e.g. 10e6 for an SDR")
+    print("--offset <Hz>       : frequency of the signal in the baseband")
+    print("--channel <message> : key one more message on the next FDM channel (repeatable),")
+    print("                      output rate = channels * --channel-rate, see fdm_offsets()")
+    print("--channel-rate <S/s>: width of each FDM channel (default 48000 AM, 192000 FM)")
+    print("")
     print("E.g.:")
     print(" python ./CWToCS8.py PLAINTEXT \"Hello world\" test-hello.cs8 AM")
     print(" python ./CWToCS8.py CIPHER_B64 \"BASE64_CIPHERTEXT...\" test-cipher.cs8 FM")
+    print(" python ./CWToCS8.py PLAINTEXT \"Hello world\" - AM | hackrf_transfer -t - -s 48000")
+    print(" python ./CWToCS8.py PLAINTEXT \"Hello world\" test-hello.cf32 AM")
+    print(" python ./CWToCS8.py PLAINTEXT \"Hello world\" - AM --sample-rate 10e6 --offset 250e3 | hackrf_transfer -t - -s 10000000")
+    print(" python ./CWToCS8.py PLAINTEXT \"CQ DE F4ABC\" fdm.cs8 AM --channel \"QSL 73\" --channel \"TEST 599\"")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Text to CW I/Q samples")
+    parser.add_argument("mode", type=str.upper, choices=("PLAINTEXT", "CIPHER_B64", "CIPHER_CW"))
+    parser.add_argument("message")
+    parser.add_argument("output_file", help="Output file, '-' for stdout")
+    parser.add_argument("modulation", type=str.upper, choices=("AM", "FM"))
+    parser.add_argument("format", nargs="?", type=str.lower, default=None, choices=tuple(IQ_FORMATS),
+                        help="Output format (default: from the output file extension, else cs8)",)
+    parser.add_argument("--sample-rate", type=float, default=None,
+                        help=f"Output sample rate in S/s, e.g. 2e6 to 20e6 for an SDR (default: {AM_DEFAULT_SAMPLE_RATE} AM, {FM_DEFAULT_SAMPLE_RATE} FM)",)
+    parser.add_argument("--offset", type=float, default=None,
+                        help=f"Signal frequency offset in Hz (default: {AM_OFFSET_FREQUENCY} AM, {FM_CARRIER_FREQUENCY:.0f} FM)",)
+    parser.add_argument("--channel", action="append", default=[], metavar="MESSAGE",
+                        help="Key another message on the next FDM channel, the first one being <message> (repeatable)",)
+    parser.add_argument("--channel-rate", type=float, default=None,
+                        help=f"FDM channel width in S/s, the output rate is channels * width (default: {AM_BASE_SAMPLE_RATE} AM, {FM_BASE_SAMPLE_RATE} FM)",)
+    metrics.add_profile_argument(parser)
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    if len(sys.argv) != 5:
+    if len(sys.argv) < 5:
         usage()
         sys.exit(0)
 
-    mode = sys.argv[1].upper()
-    message = sys.argv[2]
-    output_file = sys.argv[3]
-    modulation = sys.argv[4].upper()
-
-    if mode not in ("PLAINTEXT", "CIPHER_B64"):
-        print(f"Unknown mode: {mode}")
-        usage()
-        sys.exit(1)
+    args = parse_args()
+    metrics.configure_from_args(args)
+    output_file = args.output_file
+    fmt = args.format or format_from_path(output_file)
 
+    log = sys.stderr if output_file == '-' else sys.stdout
     try:
-        IQ = convert_to_CW(message, modulation)
-        write_toCS8(IQ, output_file)
-        print(f"[OUT] CS8 file generated: {output_file}")
+        if args.channel:
+            messages = [args.message] + args.channel
+            chunks = iter_FDM(messages, args.modulation, channel_rate=args.channel_rate)
+            write_IQ_stream(chunks, output_file, fmt)
+            channel_rate = args.channel_rate or (FM_BASE_SAMPLE_RATE if args.modulation == 'FM' else AM_BASE_SAMPLE_RATE)
+            print(f"[OUT] {fmt.upper()} file generated: {output_file} ({len(messages)} channels,"
+                  f" {len(messages) * channel_rate:.0f} S/s)", file=log)
+        else:
+            chunks = iter_CW(args.message, args.modulation, sample_rate=args.sample_rate, offset_frequency=args.offset)
+            write_IQ_stream(chunks, output_file, fmt)
+            print(f"[OUT] {fmt.upper()} file generated: {output_file}", file=log)
     except Exception as e:
-        print(f"Error: {e}")
+        print(f"Error: {e}", file=log)
         sys.exit(1)
-
@@ -1,182 +1,1273 @@
 #!/usr/bin/env python
 import numpy as np
-import pyfftw
-import matplotlib.pyplot as plt
+import fft_service
+import metrics
+import cs8_index
 import sys
 import gc
 import argparse
 import os
+import re
+import csv
+import glob
+import json
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
-def read_img_real(input_file, save=False, prefix=""):
-    try:
-        data = np.memmap(input_file, dtype=np.int8, mode='r')
-        real = data[0::2]
-        imag = data[1::2]
-        step = max(1, len(real) // 2000)
-        
-        plt.figure(figsize=(10, 4))
-        plt.plot(real[::step], label="Real part (sample)", color="blue")
-        plt.title("Real part - Baseband signal")
-        plt.xlabel("Samples")
-        plt.ylabel("Amplitude")
-        plt.legend(loc="upper right")
-        plt.grid(True)
-        
-        if save:
-            out = f"{prefix}real.png"
-            plt.savefig(out, dpi=150, bbox_inches="tight")
-            print(f"[OUT] Figure saved : {out}")
-            plt.close()
+from CWToCS8 import (SYMBOLS_TO_CHARACTER_MAP, IQ_FORMATS, AMPLITUDE, UPSAMPLE_TAPS_PER_PHASE, branch_fir, format_from_path,
+                     fdm_offsets, lowpass_prototype, quantize_iq)
+
+CHUNK_SAMPLES = 1 << 20
+PLOT_BUCKETS = 4000
+
+_magnitude_luts = {}
+
+def magnitude_lut(fmt="cs8"):
+    """|I + jQ| for every 8-bit pair (cs8 or cu8), indexed by the pair read as a little-endian uint16."""
+    if fmt not in _magnitude_luts:
+        index = np.arange(1 << 16, dtype=np.uint32)
+        i = (index & 0xFF).astype(np.uint8)
+        q = (index >> 8).astype(np.uint8)
+        if fmt == "cs8":
+            i, q = i.view(np.int8), q.view(np.int8)
+        offset = IQ_FORMATS[fmt].offset
+        _magnitude_luts[fmt] = np.hypot(i.astype(np.float32) - offset, q.astype(np.float32) - offset)
+    return _magnitude_luts[fmt]
+
+def decode_iq(raw, fmt="cs8"):
+    """complex64 samples of interleaved raw I/Q, on the cs8 scale (full scale 127) whatever the format."""
+    iq_format = IQ_FORMATS[fmt]
+    if fmt == "cs8":
+        samples = raw.astype(np.float32)
+    elif iq_format.offset:
+        samples = raw.astype(np.float32)
+        samples -= iq_format.offset
+    else:
+        samples = np.multiply(raw, np.float32(1 / iq_format.scale), dtype=np.float32)
+    return samples.view(np.complex64)
+
+class Chunk:
+    """A run of interleaved IQ samples (format fmt) starting at absolute sample start.
+
+    All decoding lives here: the complex64, magnitude and I/Q views are
+    decoded on first use, on the cs8 scale, and shared by every consumer of
+    the chunk.
+    """
+
+    def __init__(self, start, raw, fmt="cs8"):
+        self.start = start
+        self.raw = raw
+        self.fmt = fmt
+        self._iq = None
+        self._magnitude = None
+
+    def __len__(self):
+        return len(self.raw) // 2
+
+    @property
+    def iq(self):
+        if self._iq is None:
+            self._iq = decode_iq(self.raw, self.fmt)
+        return self._iq
+
+    def head(self, n):
+        """complex64 view of the first n samples, decoding only those if needed."""
+        if self._iq is not None or n >= len(self):
+            return self.iq[:n]
+        return decode_iq(self.raw[:2 * n], self.fmt)
+
+    @property
+    def magnitude(self):
+        if self._magnitude is None:
+            if self.raw.dtype.itemsize == 1:
+                self._magnitude = magnitude_lut(self.fmt)[self.raw.view('<u2')]
+            else:
+                self._magnitude = np.abs(self.iq)
+        return self._magnitude
+
+    @property
+    def real(self):
+        """In-phase samples (raw int8 for cs8, no decoding needed)."""
+        return self.raw[0::2] if self.fmt == "cs8" else self.iq.real
+
+    @property
+    def imag(self):
+        return self.raw[1::2] if self.fmt == "cs8" else self.iq.imag
+
+def open_iq(input_file, fmt="cs8", start=0, stop=None):
+    """Read-only memmap of samples [start, stop) of an interleaved IQ capture (a trailing partial sample is ignored).
+
+    Only the window is mapped, so a zoom into a huge capture costs the size of the window.
+    """
+    dtype = IQ_FORMATS[fmt].dtype
+    n_samples = os.path.getsize(input_file) // dtype.itemsize // 2
+    stop = n_samples if stop is None else min(stop, n_samples)
+    start = min(max(start, 0), stop)
+    if start == stop:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(input_file, dtype=dtype, mode='r', offset=2 * start * dtype.itemsize, shape=(2 * (stop - start),))
+
+def iter_chunks(data, chunk_samples=CHUNK_SAMPLES, fmt="cs8"):
+    """Yield the IQ memmap as consecutive Chunk objects of up to chunk_samples samples."""
+    n_samples = len(data) // 2
+    for start in range(0, n_samples, chunk_samples):
+        stop = min(start + chunk_samples, n_samples)
+        yield Chunk(start, data[2 * start:2 * stop], fmt)
+
+def run_pipeline(input_file, consumers, chunk_samples=CHUNK_SAMPLES, fmt="cs8", start=0, stop=None):
+    """Read an IQ capture (CS8, CU8, CS16 or CF32) once, feeding every chunk to each consumer.
+
+    A consumer implements start(n_samples), feed(chunk) and finish(), and
+    sets its done attribute once it needs no more data; the walk stops when
+    every consumer is done. Returns the list of finish() results.
+    With start/stop only that sample window is read, and consumers see it
+    as a capture of its own (chunk.start is relative to start).
+    """
+    data = open_iq(input_file, fmt, start, stop)
+    n_samples = len(data) // 2
+    stages = [f"rx.{type(consumer).__name__}" for consumer in consumers]
+    for consumer in consumers:
+        consumer.start(n_samples)
+    chunks = metrics.timed_iter("rx.read", iter_chunks(data, chunk_samples, fmt), bytes=lambda chunk: chunk.raw.nbytes)
+    for chunk in chunks:
+        active = [(consumer, stage) for consumer, stage in zip(consumers, stages) if not consumer.done]
+        if not active:
+            break
+        for consumer, stage in active:
+            with metrics.span(stage, samples=len(chunk)):
+                consumer.feed(chunk)
+    results = []
+    for consumer, stage in zip(consumers, stages):
+        with metrics.span(stage):
+            results.append(consumer.finish())
+    del data
+    gc.collect()
+    return results
+
+EnvelopeSummary = namedtuple("EnvelopeSummary", [
+    "start", "amp_min", "amp_max", "amp_mean", "i_min", "i_max", "q_min", "q_max",
+])
+
+class EnvelopeDecimator:
+    """Per-bucket min/max/mean of |IQ| and min/max of I and Q, fed chunk by chunk.
+
+    Bucket b covers samples [ceil(b*N/B), ceil((b+1)*N/B)), so every sample
+    lands in exactly one bucket and short bursts survive decimation.
+    """
+
+    def __init__(self, n_buckets=PLOT_BUCKETS):
+        self.requested_buckets = n_buckets
+        self.done = False
+
+    def start(self, n_samples):
+        self.n_samples = n_samples
+        self.n_buckets = max(1, min(self.requested_buckets, n_samples))
+        b = np.arange(self.n_buckets + 1, dtype=np.int64)
+        self.edges = -(-b * n_samples // self.n_buckets)
+        self.amp_min = np.full(self.n_buckets, np.inf, dtype=np.float32)
+        self.amp_max = np.full(self.n_buckets, -np.inf, dtype=np.float32)
+        self.amp_sum = np.zeros(self.n_buckets, dtype=np.float64)
+        self.i_min = np.full(self.n_buckets, np.inf, dtype=np.float32)
+        self.i_max = np.full(self.n_buckets, -np.inf, dtype=np.float32)
+        self.q_min = self.i_min.copy()
+        self.q_max = self.i_max.copy()
+
+    def feed(self, chunk):
+        n = len(chunk)
+        if n == 0:
+            return
+        first = (chunk.start * self.n_buckets) // self.n_samples
+        last = ((chunk.start + n - 1) * self.n_buckets) // self.n_samples
+        ids = np.arange(first, last + 1)
+        offsets = np.maximum(self.edges[ids] - chunk.start, 0)
+
+        magnitude = chunk.magnitude
+        real = chunk.real
+        imag = chunk.imag
+
+        self.amp_min[ids] = np.minimum(self.amp_min[ids], np.minimum.reduceat(magnitude, offsets))
+        self.amp_max[ids] = np.maximum(self.amp_max[ids], np.maximum.reduceat(magnitude, offsets))
+        self.amp_sum[ids] += np.add.reduceat(magnitude, offsets, dtype=np.float64)
+        self.i_min[ids] = np.minimum(self.i_min[ids], np.minimum.reduceat(real, offsets))
+        self.i_max[ids] = np.maximum(self.i_max[ids], np.maximum.reduceat(real, offsets))
+        self.q_min[ids] = np.minimum(self.q_min[ids], np.minimum.reduceat(imag, offsets))
+        self.q_max[ids] = np.maximum(self.q_max[ids], np.maximum.reduceat(imag, offsets))
+
+    def finish(self):
+        counts = np.maximum(np.diff(self.edges), 1)
+        return EnvelopeSummary(
+            self.edges[:-1], self.amp_min, self.amp_max, (self.amp_sum / counts).astype(np.float32),
+            self.i_min, self.i_max, self.q_min, self.q_max,
+        )
+
+def decimate_envelope(data, n_buckets=PLOT_BUCKETS, chunk_samples=CHUNK_SAMPLES, fmt="cs8"):
+    """Single streaming pass over an IQ memmap returning an EnvelopeSummary."""
+    decimator = EnvelopeDecimator(n_buckets)
+    decimator.start(len(data) // 2)
+    for chunk in iter_chunks(data, chunk_samples, fmt):
+        decimator.feed(chunk)
+    return decimator.finish()
+
+SignalStats = namedtuple("SignalStats", ["n_samples", "rms", "peak", "dc"])
+
+class StatsConsumer:
+    """RMS, peak magnitude and DC offset of the whole capture."""
+
+    def __init__(self):
+        self.done = False
+
+    def start(self, n_samples):
+        self.n_samples = n_samples
+        self.power = 0.0
+        self.peak = 0.0
+        self.total = 0j
+
+    def feed(self, chunk):
+        iq = chunk.iq
+        self.power += float(np.vdot(iq, iq).real)
+        self.peak = max(self.peak, float(chunk.magnitude.max()))
+        self.total += complex(iq.sum(dtype=np.complex128))
+
+    def finish(self):
+        n = max(self.n_samples, 1)
+        return SignalStats(self.n_samples, np.sqrt(self.power / n), self.peak, self.total / n)
+
+class FFTConsumer:
+    """One power-of-two FFT over the first max_fft_samples samples (complex64)."""
+
+    def __init__(self, sampling_rate=48000, max_fft_samples=2**20, threads=None):
+        self.sampling_rate = sampling_rate
+        self.max_fft_samples = max_fft_samples
+        self.threads = threads
+        self.done = False
+
+    def start(self, n_samples):
+        self.total_samples = n_samples
+        self.n_samples = min(n_samples, self.max_fft_samples)
+        optimal_size = 2**int(np.ceil(np.log2(max(self.n_samples, 1))))
+        # Planning may overwrite the input buffer, so plan before filling it.
+        self.fft_object = fft_service.get_plan(optimal_size, threads=self.threads)
+        self.fft_in = self.fft_object.input_array
+        self.fft_in[:] = 0
+        self.fill = 0
+        self.done = self.n_samples == 0
+
+    def feed(self, chunk):
+        n = min(len(chunk), self.n_samples - self.fill)
+        self.fft_in[self.fill:self.fill + n] = chunk.head(n)
+        self.fill += n
+        self.done = self.fill >= self.n_samples
+
+    def finish(self):
+        if self.n_samples == 0:
+            raise ValueError("Empty file")
+        fft_result = self.fft_object()
+        fft_shifted = np.fft.fftshift(fft_result)
+        fft_magnitude = 20 * np.log10(np.maximum(np.abs(fft_shifted), 1e-12))
+        freqs = np.linspace(-self.sampling_rate / 2, self.sampling_rate / 2, num=len(fft_magnitude))
+        del self.fft_in, self.fft_object
+        return freqs, fft_magnitude
+
+class BlockSpectra:
+    """Overlapping Hann-windowed block spectra over the whole capture.
+
+    Blocks straddling two chunks are completed from a short carried tail.
+    A single batched FFT plan (fft_service) and its aligned buffers are
+    reused for the whole file, so memory is bounded by batch * nfft whatever the file size.
+    Subclasses receive |FFT|^2 (not fftshifted) through on_power().
+    """
+
+    def __init__(self, sampling_rate=48000, nfft=1024, overlap=0.5, batch=256, threads=None):
+        self.sampling_rate = sampling_rate
+        self.nfft = nfft
+        self.hop = max(1, int(round(nfft * (1 - overlap))))
+        self.batch = batch
+        self.threads = threads
+        self.done = False
+
+    def start(self, n_samples):
+        self.n_samples = n_samples
+        self.n_blocks = 0 if n_samples < self.nfft else 1 + (n_samples - self.nfft) // self.hop
+        self.next_block = 0
+        self.tail = np.empty(0, dtype=np.complex64)
+        self.done = self.n_blocks == 0
+        if self.done:
+            return
+        self.batch = min(self.batch, self.n_blocks)
+        self.fft_object = fft_service.get_plan((self.batch, self.nfft), axes=(-1,), threads=self.threads)
+        self.window = np.hanning(self.nfft).astype(np.float32)
+        self.power = np.empty((self.batch, self.nfft), dtype=np.float32)
+
+    def feed(self, chunk):
+        iq = np.concatenate((self.tail, chunk.iq)) if len(self.tail) else chunk.iq
+        iq_start = chunk.start - len(self.tail)
+        last = min((iq_start + len(iq) - self.nfft) // self.hop, self.n_blocks - 1)
+        if last >= self.next_block:
+            blocks = np.lib.stride_tricks.sliding_window_view(iq, self.nfft)[::self.hop]
+            offset = (self.next_block * self.hop - iq_start) // self.hop
+            fft_in, fft_out = self.fft_object.input_array, self.fft_object.output_array
+            for first in range(self.next_block, last + 1, self.batch):
+                k = min(self.batch, last + 1 - first)
+                np.multiply(blocks[offset + first - self.next_block:][:k], self.window, out=fft_in[:k])
+                if k < self.batch:
+                    fft_in[k:] = 0
+                self.fft_object()
+                np.square(fft_out.real[:k], out=self.power[:k])
+                self.power[:k] += np.square(fft_out.imag[:k])
+                self.on_power(first, self.power[:k])
+            self.next_block = last + 1
+        self.tail = iq[self.next_block * self.hop - iq_start:].copy()
+        self.done = self.next_block >= self.n_blocks
+
+    def on_power(self, first, power):
+        raise NotImplementedError
+
+    def freqs(self):
+        return np.fft.fftshift(np.fft.fftfreq(self.nfft, d=1 / self.sampling_rate))
+
+class WelchPSD(BlockSpectra):
+    """Welch-averaged power spectral density (dB/Hz) over the whole file."""
+
+    def start(self, n_samples):
+        super().start(n_samples)
+        self.acc = np.zeros(self.nfft, dtype=np.float64)
+        self.count = 0
+
+    def on_power(self, first, power):
+        self.acc += power.sum(axis=0)
+        self.count += len(power)
+
+    def finish(self):
+        if self.count == 0:
+            raise ValueError(f"File shorter than one FFT block ({self.nfft} samples)")
+        window = np.hanning(self.nfft)
+        psd = np.fft.fftshift(self.acc) / (self.count * self.sampling_rate * np.sum(window ** 2))
+        return self.freqs(), 10 * np.log10(np.maximum(psd, 1e-20)), self.count
+
+class Waterfall(BlockSpectra):
+    """Spectrogram of the whole file, blocks averaged down to at most max_rows rows."""
+
+    def __init__(self, sampling_rate=48000, nfft=1024, overlap=0.5, max_rows=1000, **kwargs):
+        super().__init__(sampling_rate, nfft, overlap, **kwargs)
+        self.max_rows = max_rows
+
+    def start(self, n_samples):
+        super().start(n_samples)
+        self.rows = max(1, min(self.n_blocks, self.max_rows))
+        self.acc = np.zeros((self.rows, self.nfft), dtype=np.float64)
+        self.counts = np.zeros(self.rows, dtype=np.int64)
+
+    def on_power(self, first, power):
+        row_index = (np.arange(first, first + len(power)) * self.rows) // self.n_blocks
+        starts = np.flatnonzero(np.r_[True, np.diff(row_index) != 0])
+        self.acc[row_index[starts]] += np.add.reduceat(power, starts, axis=0)
+        self.counts += np.bincount(row_index, minlength=self.rows)
+
+    def finish(self):
+        if self.n_blocks == 0:
+            raise ValueError(f"File shorter than one FFT block ({self.nfft} samples)")
+        spectrogram = np.fft.fftshift(self.acc / self.counts[:, None], axes=1)
+        duration = self.n_samples / self.sampling_rate
+        return self.freqs(), duration, 10 * np.log10(np.maximum(spectrogram, 1e-12))
+
+DecodeResult = namedtuple("DecodeResult", ["text", "unit_seconds", "levels", "lengths", "duration"])
+
+class MorseDecoder:
+    """Streaming CW envelope detector and Morse decoder.
+
+    |IQ| is averaged over block_seconds blocks, compared to a threshold set
+    halfway between tracked noise and mark levels (updated per chunk), and
+    the keying is run-length encoded on the fly. finish() estimates the dot
+    length from the runs and maps symbols back through
+    SYMBOLS_TO_CHARACTER_MAP.
+    """
+
+    level_smoothing = 0.3
+    min_snr = 2.0
+
+    def __init__(self, sampling_rate=48000, block_seconds=0.002):
+        self.sampling_rate = sampling_rate
+        self.block = max(1, int(round(block_seconds * sampling_rate)))
+        self.done = False
+
+    def start(self, n_samples):
+        self.n_samples = n_samples
+        self.carry = np.empty(0, dtype=np.float32)
+        self.noise = None
+        self.mark = None
+        self.run_levels = []
+        self.run_lengths = []
+        self.pending = None
+
+    def _track_levels(self, envelope):
+        low, high = np.percentile(envelope, [10, 99.5])
+        a = self.level_smoothing
+        self.noise = low if self.noise is None else (1 - a) * self.noise + a * low
+        if high > self.min_snr * self.noise + 1.0:
+            self.mark = high if self.mark is None else (1 - a) * self.mark + a * high
+
+    def _append_runs(self, keyed):
+        starts = np.flatnonzero(np.r_[True, keyed[1:] != keyed[:-1]])
+        lengths = np.diff(np.r_[starts, len(keyed)])
+        levels = keyed[starts]
+        if self.pending is not None:
+            if self.pending[0] == levels[0]:
+                lengths[0] += self.pending[1]
+            else:
+                self.run_levels.append(np.array([self.pending[0]]))
+                self.run_lengths.append(np.array([self.pending[1]]))
+        self.run_levels.append(levels[:-1])
+        self.run_lengths.append(lengths[:-1])
+        self.pending = (levels[-1], lengths[-1])
+
+    def feed(self, chunk):
+        magnitude = np.concatenate((self.carry, chunk.magnitude)) if len(self.carry) else chunk.magnitude
+        n_blocks = len(magnitude) // self.block
+        self.carry = magnitude[n_blocks * self.block:].copy()
+        if n_blocks == 0:
+            return
+        envelope = magnitude[:n_blocks * self.block].reshape(n_blocks, self.block).mean(axis=1)
+        self._track_levels(envelope)
+        if self.mark is None:
+            keyed = np.zeros(n_blocks, dtype=bool)
         else:
-            plt.show()
-            
-        plt.figure(figsize=(10, 4))
-        plt.plot(imag[::step], label="Imaginary part (sample)", color="red")
-        plt.title("Imaginary part - Baseband signal")
-        plt.xlabel("Samples")
-        plt.ylabel("Amplitude")
-        plt.legend(loc="upper right")
-        plt.grid(True)
-        
-        if save:
-            out = f"{prefix}real.png"
-            plt.savefig(out, dpi=150, bbox_inches="tight")
-            print(f"[OUT] Figure saved : {out}")
-            plt.close()
+            keyed = envelope > (self.noise + self.mark) / 2
+        self._append_runs(keyed)
+
+    def finish(self):
+        if self.pending is not None:
+            self.run_levels.append(np.array([self.pending[0]]))
+            self.run_lengths.append(np.array([self.pending[1]]))
+        levels = np.concatenate(self.run_levels) if self.run_levels else np.empty(0, dtype=bool)
+        lengths = np.concatenate(self.run_lengths) if self.run_lengths else np.empty(0, dtype=np.int64)
+        block_seconds = self.block / self.sampling_rate
+        levels, lengths = merge_glitches(levels, lengths, 1)
+        unit = estimate_unit(levels, lengths)
+        text = ""
+        if unit:
+            levels, lengths = merge_glitches(levels, lengths, 0.3 * unit)
+            text = unframe(decode_keying(levels, lengths, unit))
+        return DecodeResult(text, unit * block_seconds if unit else None, levels, lengths,
+                            self.n_samples / self.sampling_rate)
+
+def merge_glitches(levels, lengths, min_length):
+    """Fold runs shorter than min_length into their neighbours."""
+    if not len(lengths):
+        return levels, lengths
+    keep = lengths > min_length
+    if keep.all():
+        return levels, lengths
+    levels = levels[keep]
+    lengths = lengths[keep]
+    starts = np.flatnonzero(np.r_[True, levels[1:] != levels[:-1]])
+    return levels[starts], np.add.reduceat(lengths, starts)
+
+def estimate_unit(levels, lengths):
+    """Dot length, in envelope blocks, from the run lengths of the keying."""
+    marks = lengths[levels].astype(np.float64)
+    if not len(marks):
+        return None
+    short, long = marks.min(), marks.max()
+    if long < 2 * short:
+        # Only dots or only dashes: inter-symbol gaps, when clearly shorter, are one unit.
+        spaces = lengths[~levels][1:-1]
+        if len(spaces) and spaces.min() < short / 2:
+            return float(np.median(spaces[spaces < 2 * spaces.min()]))
+        return float(np.median(marks))
+    for _ in range(10):
+        split = np.sqrt(short * long)
+        short = np.median(marks[marks < split])
+        long = np.median(marks[marks >= split])
+    unit = (short + long / 3) / 2
+    # Edge shaping shortens marks and lengthens gaps by the same amount, so
+    # averaging with the inter-symbol gap removes the threshold bias.
+    spaces = lengths[~levels][1:-1]
+    gaps = spaces[spaces < 2 * unit]
+    if len(gaps):
+        unit = (unit + np.median(gaps)) / 2
+    return float(unit)
+
+def decode_keying(levels, lengths, unit):
+    units = lengths / unit
+    text = []
+    symbols = ""
+    for level, duration in zip(levels, units):
+        if level:
+            symbols += "." if duration < 2 else "-"
+            continue
+        if duration < 2:
+            continue
+        if symbols:
+            text.append(SYMBOLS_TO_CHARACTER_MAP.get(symbols, "*"))
+            symbols = ""
+        if duration >= 5 and text and text[-1] != " ":
+            text.append(" ")
+    if symbols:
+        text.append(SYMBOLS_TO_CHARACTER_MAP.get(symbols, "*"))
+    return "".join(text).strip()
+
+def unframe(text):
+    """Strip the ' < ' ... ' > ' framing added by convert_to_CW."""
+    words = text.split(" ")
+    if words and words[0] == "<":
+        words = words[1:]
+    if words and words[-1] in (">", "+"):
+        words = words[:-1]
+    return " ".join(words)
+
+Segment = namedtuple("Segment", ["start", "stop", "snr_db", "frequency"])
+
+class BurstDetector:
+    """Streaming burst detector: block power and an order-statistic CFAR.
+
+    The feed pass only keeps the mean power of block_seconds blocks. The
+    noise level of each frame_seconds frame is a low percentile of its
+    blocks, and the CFAR reference of a frame is a low percentile of those
+    frame levels over +/- window_frames, so transmissions that fill less
+    than ~80 % of the reference window do not raise their own threshold.
+    Blocks threshold_db above the reference are active; active runs closer
+    than min_gap_seconds are one segment (a CW message keeps its letter and
+    word gaps), and segments shorter than min_seconds are dropped.
+    finish() returns Segments in seconds with their SNR (frequency None,
+    see detect_segments).
+    """
+
+    noise_percentile = 20
+
+    def __init__(self, sampling_rate=48000, block_seconds=0.01, frame_seconds=1.0, window_frames=30,
+                 threshold_db=3.0, min_gap_seconds=1.0, min_seconds=0.02):
+        self.sampling_rate = sampling_rate
+        self.block = max(1, int(round(block_seconds * sampling_rate)))
+        self.frame_blocks = max(1, int(round(frame_seconds * sampling_rate / self.block)))
+        self.window_frames = window_frames
+        self.threshold_db = threshold_db
+        self.min_gap_seconds = min_gap_seconds
+        self.min_seconds = min_seconds
+        self.done = False
+
+    def start(self, n_samples):
+        self.carry = np.empty(0, dtype=np.float32)
+        self.powers = []
+
+    def feed(self, chunk):
+        power = np.square(chunk.magnitude, dtype=np.float32)
+        power = np.concatenate((self.carry, power)) if len(self.carry) else power
+        n_blocks = len(power) // self.block
+        self.carry = power[n_blocks * self.block:].copy()
+        if n_blocks:
+            self.powers.append(power[:n_blocks * self.block].reshape(n_blocks, self.block).mean(axis=1))
+
+    def noise_levels(self, powers):
+        """CFAR reference power of every block."""
+        n_frames = -(-len(powers) // self.frame_blocks)
+        padded = np.full(n_frames * self.frame_blocks, np.nan, dtype=np.float32)
+        padded[:len(powers)] = powers
+        frames = np.nanpercentile(padded.reshape(n_frames, self.frame_blocks), self.noise_percentile, axis=1)
+        w = self.window_frames
+        edges = np.pad(frames, w, mode="edge")
+        reference = np.percentile(np.lib.stride_tricks.sliding_window_view(edges, 2 * w + 1), self.noise_percentile, axis=1)
+        return np.repeat(reference, self.frame_blocks)[:len(powers)]
+
+    def finish(self):
+        if len(self.carry):
+            self.powers.append(np.array([self.carry.mean()], dtype=np.float32))
+        powers = np.concatenate(self.powers) if self.powers else np.empty(0, dtype=np.float32)
+        if not len(powers):
+            return []
+        noise = self.noise_levels(powers)
+        # A clean synthetic capture has a zero floor: stay above the quantization noise
+        threshold = np.maximum(noise * 10 ** (self.threshold_db / 10), max(1e-3 * float(powers.max()), 1.0))
+        active = np.r_[False, powers > threshold, False]
+        edges = np.flatnonzero(active[1:] != active[:-1])
+        starts, stops = edges[0::2], edges[1::2]
+        if len(starts):
+            min_gap = self.min_gap_seconds * self.sampling_rate / self.block
+            keep = np.r_[True, starts[1:] - stops[:-1] >= min_gap]
+            starts, stops = starts[keep], stops[np.r_[keep[1:], True]]
+            long_enough = (stops - starts) * self.block >= self.min_seconds * self.sampling_rate
+            starts, stops = starts[long_enough], stops[long_enough]
+        block_seconds = self.block / self.sampling_rate
+        segments = []
+        for first, last in zip(starts, stops):
+            signal = float(powers[first:last].mean())
+            reference = max(float(noise[first:last].mean()), 1e-12)
+            snr_db = 10 * np.log10(max(signal - reference, 1e-12) / reference)
+            segments.append(Segment(float(first * block_seconds), float(last * block_seconds), round(float(snr_db), 2), None))
+        return segments
+
+def occupied_bandwidth(freqs, psd_db, fraction=0.99):
+    """Width in Hz of the band holding fraction of the power, (1 - fraction) / 2 cut on each side."""
+    power = 10 ** (np.asarray(psd_db, dtype=np.float64) / 10)
+    cumulative = np.cumsum(power)
+    if cumulative[-1] <= 0:
+        return 0.0
+    cumulative /= cumulative[-1]
+    low = np.searchsorted(cumulative, (1 - fraction) / 2)
+    high = np.searchsorted(cumulative, 1 - (1 - fraction) / 2)
+    bin_width = freqs[1] - freqs[0] if len(freqs) > 1 else 0.0
+    return float(freqs[min(high, len(freqs) - 1)] - freqs[low] + bin_width)
+
+class IQWriter:
+    """Consumer writing the chunks it is fed to an IQ file in fmt."""
+
+    def __init__(self, path, fmt="cs8"):
+        self.path = path
+        self.fmt = fmt
+        self.done = False
+
+    def start(self, n_samples):
+        self.file = open(self.path, "wb")
+        self.buffer = np.empty(0, dtype=IQ_FORMATS[self.fmt].dtype)
+        self.n_samples = 0
+
+    def feed(self, chunk):
+        n = len(chunk)
+        if len(self.buffer) < 2 * n:
+            self.buffer = np.empty(2 * n, dtype=self.buffer.dtype)
+        quantize_iq(chunk.iq, self.buffer[:2 * n], self.fmt)
+        self.file.write(memoryview(self.buffer[:2 * n]))
+        self.n_samples += n
+
+    def finish(self):
+        self.file.close()
+        return self.path, self.n_samples
+
+class Channelizer:
+    """Critically sampled polyphase analysis filter bank, the mirror of CWToCS8.FDMSynthesizer.
+
+    Splits the capture into n_channels baseband channels of sampling_rate /
+    n_channels, channel k centred on fdm_offsets()[k], in one pass: a
+    taps_per_phase FIR per branch and one batched FFT (fft_service) per
+    block of n_channels input samples. The FFT runs on a single (block,
+    n_channels) plan whatever the chunk size. Each channel is fed as cf32
+    Chunks to its own list of consumers; finish() returns their results,
+    one list per channel.
+    """
+
+    def __init__(self, n_channels, channel_consumers, taps_per_phase=UPSAMPLE_TAPS_PER_PHASE, threads=None, block=None):
+        m = n_channels
+        self.n_channels = m
+        self.channel_consumers = channel_consumers
+        self.taps = taps_per_phase
+        self.threads = threads
+        self.block = block or CHUNK_SAMPLES // m + 1
+        prototype = lowpass_prototype(m, taps_per_phase) / m
+        self.branches = prototype.reshape(taps_per_phase, m).astype(np.float32)
+        # Channel k sits in bin b, read back at -b since the FFT runs forward;
+        # the rotation references the output to the first sample of each block
+        bins = np.array([(k - m // 2) % m for k in range(m)])
+        self.columns = (-bins) % m
+        self.rotation = np.exp(-2j * np.pi * bins * (m - 1) / m).astype(np.complex64)
+        self.done = False
+
+    def start(self, n_samples):
+        self.n_out = n_samples // self.n_channels
+        self.position = 0
+        self.carry = np.empty(0, dtype=np.complex64)
+        self.history = np.zeros((self.taps - 1, self.n_channels), dtype=np.complex64)
+        for consumers in self.channel_consumers:
+            for consumer in consumers:
+                consumer.start(self.n_out)
+        self.done = self.n_out == 0
+
+    def feed(self, chunk):
+        m = self.n_channels
+        iq = np.concatenate((self.carry, chunk.iq)) if len(self.carry) else chunk.iq
+        blocks = len(iq) // m
+        self.carry = iq[blocks * m:].copy()
+        if blocks == 0:
+            return
+        # Branch p takes input sample m - 1 - p of every block
+        branches = np.concatenate((self.history, iq[:blocks * m].reshape(blocks, m)[:, ::-1]))
+        self.history = branches[blocks:]
+        plan = fft_service.get_plan((self.block, m), axes=(-1,), threads=self.threads)
+        for first in range(0, blocks, self.block):
+            # Rows past a short last block hold stale data, their FFT is not read
+            rows = min(self.block, blocks - first)
+            with metrics.span("rx.channelize", samples=rows * m):
+                branch_fir(branches[first:first + rows + self.taps - 1], self.branches, out=plan.input_array[:rows])
+                channels = (plan()[:rows, self.columns] * self.rotation).T * np.float32(1 / AMPLITUDE)
+            for k, consumers in enumerate(self.channel_consumers):
+                # cf32 is stored at 1 / AMPLITUDE of the cs8 scale
+                channel = Chunk(self.position, np.ascontiguousarray(channels[k]).view(np.float32), "cf32")
+                for consumer in consumers:
+                    if not consumer.done:
+                        consumer.feed(channel)
+            self.position += rows
+
+    def finish(self):
+        return [[consumer.finish() for consumer in consumers] for consumers in self.channel_consumers]
+
+def compute_psd(input_file, sampling_rate=48000, nfft=1024, overlap=0.5, threads=None, fmt="cs8", start=0, stop=None):
+    return run_pipeline(input_file, [WelchPSD(sampling_rate, nfft, overlap, threads=threads)], fmt=fmt, start=start, stop=stop)[0]
+
+def compute_waterfall(input_file, sampling_rate=48000, nfft=1024, overlap=0.5, max_rows=1000, threads=None, fmt="cs8", start=0, stop=None):
+    return run_pipeline(input_file, [Waterfall(sampling_rate, nfft, overlap, max_rows, threads=threads)],
+                        fmt=fmt, start=start, stop=stop)[0]
+
+def detect_segments(input_file, sampling_rate=48000, fmt="cs8", start=0, stop=None, max_fft_samples=2**16, **detector):
+    """Bursts of samples [start, stop) as Segments with absolute times and their dominant frequency.
+
+    One streaming pass of block power over the window, then one short FFT
+    over the head of each segment only.
+    """
+    segments, = run_pipeline(input_file, [BurstDetector(sampling_rate, **detector)], fmt=fmt, start=start, stop=stop)
+    offset = start / sampling_rate
+    located = []
+    for segment in segments:
+        first = start + int(segment.start * sampling_rate)
+        last = start + int(segment.stop * sampling_rate)
+        (freqs, fft_magnitude), = run_pipeline(input_file, [FFTConsumer(sampling_rate, max_fft_samples)],
+                                               fmt=fmt, start=first, stop=last)
+        located.append(segment._replace(start=round(segment.start + offset, 3), stop=round(segment.stop + offset, 3),
+                                        frequency=round(float(freqs[fft_magnitude.argmax()]), 1)))
+    return located
+
+def write_segments(segments, path, input_file="", sampling_rate=48000):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"file": input_file, "sampling_rate": sampling_rate,
+                   "segments": [segment._asdict() for segment in segments]}, f, indent=2)
+
+def load_segments(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [Segment(**segment) for segment in json.load(f)["segments"]]
+
+def segment_windows(segments, sampling_rate=48000, padding=0.1, start=0, stop=None):
+    """Sample windows [first, last) of the segments widened by padding seconds, overlaps merged, clipped to [start, stop)."""
+    windows = []
+    for segment in sorted(segments):
+        first = max(start, int((segment.start - padding) * sampling_rate))
+        last = int((segment.stop + padding) * sampling_rate)
+        if stop is not None:
+            last = min(last, stop)
+        if last <= first:
+            continue
+        if windows and first <= windows[-1][1]:
+            windows[-1][1] = max(windows[-1][1], last)
         else:
-            plt.show()
-            
-        del data, real, imag
-        gc.collect()
-        
+            windows.append([first, last])
+    return [tuple(window) for window in windows]
+
+def load_envelope(input_file, fmt="cs8", start=0, stop=None, use_index=True, n_buckets=PLOT_BUCKETS):
+    """EnvelopeSummary of samples [start, stop) (absolute sample positions).
+
+    Answered from a fresh sidecar index (cs8_index) when it has at least
+    n_buckets entries over the window, otherwise by one pass over the
+    window only.
+    """
+    if use_index:
+        index = cs8_index.load_index(input_file, fmt)
+        envelope = index.envelope(start, stop, n_buckets) if index is not None else None
+        if envelope is not None:
+            print(f"[i] Overview from the index : {cs8_index.index_path(input_file)}")
+            return envelope
+    envelope, = run_pipeline(input_file, [EnvelopeDecimator(n_buckets)], fmt=fmt, start=start, stop=stop)
+    return envelope._replace(start=envelope.start + start)
+
+def _pyplot(save=False):
+    """Import matplotlib.pyplot on first plot, with the Agg backend for --save or headless runs."""
+    if "matplotlib.pyplot" not in sys.modules:
+        import matplotlib
+        if save or not (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY") or sys.platform in ("win32", "darwin")):
+            matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+def _show_or_save(save, out):
+    plt = _pyplot(save)
+    if save:
+        with metrics.span("plot.render"):
+            plt.savefig(out, dpi=150, bbox_inches="tight")
+        print(f"[OUT] Figure saved : {out}")
+        plt.close()
+    else:
+        plt.show()
+
+def plot_iq(envelope, save=False, prefix=""):
+    plt = _pyplot(save)
+    plt.figure(figsize=(10, 4))
+    plt.fill_between(envelope.start, envelope.i_min, envelope.i_max, label="Real part (min/max)", color="blue", step="post")
+    plt.title("Real part - Baseband signal")
+    plt.xlabel("Samples")
+    plt.ylabel("Amplitude")
+    plt.legend(loc="upper right")
+    plt.grid(True)
+    _show_or_save(save, f"{prefix}real.png")
+
+    plt.figure(figsize=(10, 4))
+    plt.fill_between(envelope.start, envelope.q_min, envelope.q_max, label="Imaginary part (min/max)", color="red", step="post")
+    plt.title("Imaginary part - Baseband signal")
+    plt.xlabel("Samples")
+    plt.ylabel("Amplitude")
+    plt.legend(loc="upper right")
+    plt.grid(True)
+    _show_or_save(save, f"{prefix}imag.png")
+
+def plot_amplitude(envelope, sampling_rate=48000, save=False, prefix=""):
+    plt = _pyplot(save)
+    time = envelope.start / sampling_rate
+    plt.figure(figsize=(10, 5))
+    plt.fill_between(time, envelope.amp_min, envelope.amp_max, label="Signal amplitude (min/max)",
+                     color="purple", alpha=0.3, step="post")
+    plt.plot(time, envelope.amp_mean, label="Signal amplitude (mean)", color="purple", drawstyle="steps-post")
+    plt.title("Signal amplitude from Time")
+    plt.xlabel("Time (s)")
+    plt.ylabel("Amplitude")
+    plt.legend(loc="upper right")
+    plt.grid(True)
+    _show_or_save(save, f"{prefix}amplitude.png")
+
+def plot_fft(freqs, fft_magnitude, save=False, prefix=""):
+    plt = _pyplot(save)
+    step = max(1, len(fft_magnitude) // 2000)
+    plt.figure(figsize=(10, 5))
+    plt.plot(freqs[::step], fft_magnitude[::step], label="Signal spectre (FFT)", color="green")
+    plt.title("Frequency spectre (FFT)")
+    plt.xlabel("Frequency (Hz)")
+    plt.ylabel("Amplitude (dB)")
+    plt.legend(loc="upper right")
+    plt.grid(True)
+    _show_or_save(save, f"{prefix}fft.png")
+
+def plot_psd(freqs, psd_db, save=False, prefix=""):
+    plt = _pyplot(save)
+    plt.figure(figsize=(10, 5))
+    plt.plot(freqs, psd_db, label="Welch PSD", color="green")
+    plt.title("Power spectral density (Welch)")
+    plt.xlabel("Frequency (Hz)")
+    plt.ylabel("Power (dB/Hz)")
+    plt.legend(loc="upper right")
+    plt.grid(True)
+    _show_or_save(save, f"{prefix}psd.png")
+
+def plot_waterfall(freqs, duration, spectrogram_db, save=False, prefix=""):
+    plt = _pyplot(save)
+    plt.figure(figsize=(10, 6))
+    plt.imshow(spectrogram_db, aspect="auto", cmap="viridis",
+               extent=[freqs[0], freqs[-1], duration, 0])
+    plt.colorbar(label="Power (dB)")
+    plt.title("Waterfall (spectrogram)")
+    plt.xlabel("Frequency (Hz)")
+    plt.ylabel("Time (s)")
+    _show_or_save(save, f"{prefix}waterfall.png")
+
+def print_stats(stats, sampling_rate=48000):
+    print(f"[OUT] Samples  : {stats.n_samples} ({stats.n_samples / sampling_rate:.3f} s)")
+    print(f"[OUT] RMS      : {stats.rms:.2f}")
+    print(f"[OUT] Peak     : {stats.peak:.2f}")
+    print(f"[OUT] DC       : {stats.dc.real:.3f} {stats.dc.imag:+.3f}j")
+
+def _report_fft_limit(n_samples, max_fft_samples):
+    if n_samples > max_fft_samples:
+        print(f"[OUT] FFT limited to {max_fft_samples} samples on {n_samples}")
+
+def read_img_real(input_file, save=False, prefix="", fmt="cs8", start=0, stop=None, use_index=True):
+    try:
+        envelope = load_envelope(input_file, fmt, start, stop, use_index)
+        plot_iq(envelope, save=save, prefix=prefix)
+
     except FileNotFoundError:
         print(f"[!] File {input_file} not found")
     except Exception as e:
         print(f"[!] Error (read_img_real):\n{str(e)}")
-        
-def read_fft(input_file, sampling_rate=48000, max_fft_samples=2**20, save=False, prefix=""):
+
+def read_fft(input_file, sampling_rate=48000, max_fft_samples=2**20, save=False, prefix="", fmt="cs8", start=0, stop=None):
     print("[OUT] FFT...")
     try:
-        data = np.memmap(input_file, dtype=np.int8, mode='r')
-        real = data[0::2].astype(np.float32)
-        imag = data[1::2].astype(np.float32)
-        iq_signal = real + 1j * imag
-        
-        n_samples = min(len(iq_signal), max_fft_samples)
-        if len(iq_signal) > max_fft_samples:
-            print(f"[OUT] FFT limited to {n_samples} samples on {len(iq_signal)}")
-            
-        iq_signal = iq_signal[:n_samples]
-        
-        optimal_size = 2**int(np.ceil(np.log2(n_samples)))
-        if optimal_size > n_samples:
-            iq_signal = np.pad(iq_signal, (0, optimal_size - n_samples), mode='constant')
-            
-        fft_in = pyfftw.empty_aligned(optimal_size, dtype='complex64')
-        fft_out = pyfftw.empty_aligned(optimal_size, dtype='complex64')
-        fft_in[:] = iq_signal.astype('complex64')
-        
-        fft_object = pyfftw.FFTW(fft_in, fft_out, threads=4)
-        fft_result = fft_object()
-        fft_shifted = np.fft.fftshift(fft_result)
-        fft_magnitude = 20 * np.log10(np.maximum(np.abs(fft_shifted), 1e-12))
-        
-        freqs = np.linspace(-sampling_rate / 2, sampling_rate / 2, num=len(fft_magnitude))
-        
-        step = max(1, len(fft_magnitude) // 2000)
-        
-        plt.figure(figsize=(10, 5))
-        plt.plot(freqs[::step], fft_magnitude[::step], label="Signal spectre (FFT)", color="green")
-        plt.title("Frequency spectre (FFT)")
-        plt.xlabel("Frequency (Hz)")
-        plt.ylabel("Amplitude (dB)")
-        plt.legend(loc="upper right")
-        plt.grid(True)
-        
-        if save:
-            out = f"{prefix}fft.png"
-            plt.savefig(out, dpi=150, bbox_inches="tight")
-            print(f"[OUT] Figure saved : {out}")
-            plt.close()
-        else:
-            plt.show()
-            
-        del data, real, imag, iq_signal, fft_in, fft_out, fft_result, fft_shifted, fft_magnitude, freqs
-        gc.collect()
-        
+        consumer = FFTConsumer(sampling_rate, max_fft_samples)
+        (freqs, fft_magnitude), = run_pipeline(input_file, [consumer], fmt=fmt, start=start, stop=stop)
+        _report_fft_limit(consumer.total_samples, max_fft_samples)
+        plot_fft(freqs, fft_magnitude, save=save, prefix=prefix)
+
     except FileNotFoundError:
         print(f"[!] File {input_file} not found")
     except Exception as e:
         print(f"[!] Error (read_fft):\n{str(e)}")
-        
-def read_amplitude(input_file, sampling_rate=48000, save=False, prefix=""):
+
+def read_amplitude(input_file, sampling_rate=48000, save=False, prefix="", fmt="cs8", start=0, stop=None, use_index=True):
     print("[OUT] Amplitude vs Time...")
     try:
-        data = np.memmap(input_file, dtype=np.int8, mode='r')
-        real = data[0::2].astype(np.float32)
-        imag = data[1::2].astype(np.float32)
-        iq_signal = real + 1j * imag
-        
-        amplitude = np.abs(iq_signal)
-        time = np.linspace(0, len(amplitude) / sampling_rate, num=len(amplitude))
-        step = max(1, len(amplitude) // 40000)
-        
-        plt.figure(figsize=(10, 5))
-        plt.plot(time[::step], amplitude[::step], label="Signal amplitude", color="purple")
-        plt.title("Signal amplitude from Time")
-        plt.xlabel("Time (s)")
-        plt.ylabel("Amplitude")
-        plt.legend(loc="upper right")
-        plt.grid(True)
-        
-        if save:
-            out = f"{prefix}fft.png"
-            plt.savefig(out, dpi=150, bbox_inches="tight")
-            print(f"[OUT] Figure saved : {out}")
-            plt.close()
-        else:
-            plt.show()
-        
-        del data, real, imag, iq_signal, amplitude, time
-        gc.collect()
-        
+        envelope = load_envelope(input_file, fmt, start, stop, use_index)
+        plot_amplitude(envelope, sampling_rate, save=save, prefix=prefix)
+
     except FileNotFoundError:
         print(f"[!] File {input_file} not found")
     except ValueError:
         print("[!] Error data type. Please check the file")
     except Exception as e:
         print(f"[!] Error (read_amplitude):\n{str(e)}")
-        
+
+def read_psd(input_file, sampling_rate=48000, nfft=1024, overlap=0.5, save=False, prefix="", fmt="cs8", start=0, stop=None):
+    print("[OUT] Welch PSD...")
+    try:
+        freqs, psd_db, count = compute_psd(input_file, sampling_rate, nfft, overlap, fmt=fmt, start=start, stop=stop)
+        print(f"[OUT] PSD averaged over {count} blocks of {nfft} samples")
+        plot_psd(freqs, psd_db, save=save, prefix=prefix)
+
+    except FileNotFoundError:
+        print(f"[!] File {input_file} not found")
+    except Exception as e:
+        print(f"[!] Error (read_psd):\n{str(e)}")
+
+def read_waterfall(input_file, sampling_rate=48000, nfft=1024, overlap=0.5, max_rows=1000, save=False, prefix="", fmt="cs8",
+                   start=0, stop=None):
+    print("[OUT] Waterfall...")
+    try:
+        freqs, duration, spectrogram_db = compute_waterfall(input_file, sampling_rate, nfft, overlap, max_rows, fmt=fmt,
+                                                            start=start, stop=stop)
+        plot_waterfall(freqs, duration, spectrogram_db, save=save, prefix=prefix)
+
+    except FileNotFoundError:
+        print(f"[!] File {input_file} not found")
+    except Exception as e:
+        print(f"[!] Error (read_waterfall):\n{str(e)}")
+
+def read_all(input_file, sampling_rate=48000, max_fft_samples=2**20, save=False, prefix="", fmt="cs8", start=0, stop=None):
+    """IQ, amplitude, FFT and stats from a single pass over the capture."""
+    print("[OUT] IQ + Amplitude vs Time + FFT + Stats (single pass)...")
+    try:
+        fft_consumer = FFTConsumer(sampling_rate, max_fft_samples)
+        envelope, (freqs, fft_magnitude), stats = run_pipeline(
+            input_file, [EnvelopeDecimator(), fft_consumer, StatsConsumer()], fmt=fmt, start=start, stop=stop)
+        envelope = envelope._replace(start=envelope.start + start)
+        _report_fft_limit(fft_consumer.total_samples, max_fft_samples)
+        print_stats(stats, sampling_rate)
+        plot_iq(envelope, save=save, prefix=prefix)
+        plot_amplitude(envelope, sampling_rate, save=save, prefix=prefix)
+        plot_fft(freqs, fft_magnitude, save=save, prefix=prefix)
+
+    except FileNotFoundError:
+        print(f"[!] File {input_file} not found")
+    except Exception as e:
+        print(f"[!] Error (read_all):\n{str(e)}")
+
+def read_decode(input_file, sampling_rate=48000, output=None, fmt="cs8", start=0, stop=None):
+    print("[OUT] CW decode...")
+    try:
+        t0 = time.perf_counter()
+        result, = run_pipeline(input_file, [MorseDecoder(sampling_rate)], fmt=fmt, start=start, stop=stop)
+        elapsed = time.perf_counter() - t0
+        if result.unit_seconds is None:
+            print("[!] No CW keying detected")
+            return None
+        print(f"[OUT] Dot length       : {result.unit_seconds * 1000:.1f} ms ({1.2 / result.unit_seconds:.1f} WPM)")
+        print(f"[OUT] Real-time factor : {result.duration / max(elapsed, 1e-9):.0f}x ({result.duration:.1f} s decoded in {elapsed:.3f} s)")
+        print(f"[OUT] Decoded text     : {result.text}")
+        if output:
+            with open(output, "w", encoding="utf-8") as f:
+                f.write(result.text + "\n")
+            print(f"[OUT] Text saved : {output}")
+        return result.text
+
+    except FileNotFoundError:
+        print(f"[!] File {input_file} not found")
+    except Exception as e:
+        print(f"[!] Error (read_decode):\n{str(e)}")
+
+def read_segments(input_file, sampling_rate=48000, output=None, fmt="cs8", start=0, stop=None):
+    print("[OUT] Burst segments...")
+    try:
+        t0 = time.perf_counter()
+        segments = detect_segments(input_file, sampling_rate, fmt=fmt, start=start, stop=stop)
+        elapsed = time.perf_counter() - t0
+        for segment in segments:
+            print(f"[OUT] {segment.start:10.3f} s - {segment.stop:10.3f} s : SNR {segment.snr_db:5.1f} dB, {segment.frequency:+.1f} Hz")
+        busy = sum(segment.stop - segment.start for segment in segments)
+        print(f"[OUT] {len(segments)} segment(s), {busy:.1f} s of signal, detected in {elapsed:.3f} s")
+        if output:
+            write_segments(segments, output, input_file, sampling_rate)
+            print(f"[OUT] Segments saved : {output}")
+        return segments
+
+    except FileNotFoundError:
+        print(f"[!] File {input_file} not found")
+    except Exception as e:
+        print(f"[!] Error (read_segments):\n{str(e)}")
+
+def read_channels(input_file, n_channels, sampling_rate=48000, save=False, prefix="", fmt="cs8", start=0, stop=None):
+    """Split an FDM capture into n_channels channels in one pass, with the stats and decoded text of each."""
+    print(f"[OUT] Channelizer ({n_channels} channels)...")
+    try:
+        channel_rate = sampling_rate / n_channels
+        consumers = []
+        for k in range(n_channels):
+            consumers.append([StatsConsumer(), MorseDecoder(channel_rate)])
+            if save:
+                consumers[-1].append(IQWriter(f"{prefix}ch{k:02d}.{fmt}", fmt))
+        t0 = time.perf_counter()
+        # Whole blocks per chunk, so every chunk fills the same FFT plan
+        results, = run_pipeline(input_file, [Channelizer(n_channels, consumers)], chunk_samples=CHUNK_SAMPLES // n_channels * n_channels,
+                                fmt=fmt, start=start, stop=stop)
+        elapsed = time.perf_counter() - t0
+        texts = []
+        for k, (offset, (stats, decoded, *written)) in enumerate(zip(fdm_offsets(n_channels, channel_rate), results)):
+            texts.append(decoded.text if decoded.unit_seconds is not None else None)
+            print(f"[OUT] Channel {k:2d} ({offset:+10.0f} Hz) : RMS {stats.rms:6.2f}, text: {texts[-1] or '-'}")
+            if written:
+                print(f"[OUT] Channel saved : {written[0][0]} ({channel_rate:.0f} S/s)")
+        duration = (results[0][0].n_samples * n_channels) / sampling_rate if results else 0.0
+        print(f"[OUT] Real-time factor : {duration / max(elapsed, 1e-9):.0f}x ({duration:.1f} s in {elapsed:.3f} s)")
+        return texts
+
+    except FileNotFoundError:
+        print(f"[!] File {input_file} not found")
+    except Exception as e:
+        print(f"[!] Error (read_channels):\n{str(e)}")
+
+IQ_EXTENSIONS = tuple(f".{fmt}" for fmt in IQ_FORMATS)
+SUMMARY_FIELDS = ["file", "format", "samples", "duration_s", "rms", "peak", "dc_i", "dc_q",
+                  "occupied_bandwidth_hz", "bursts", "analysis_s", "error"]
+
+def expand_inputs(patterns):
+    """Capture paths from files, directories (searched recursively for IQ extensions) and globs, sorted and unique."""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, _, files in os.walk(pattern):
+                paths.extend(os.path.join(root, f) for f in files if f.lower().endswith(IQ_EXTENSIONS))
+        elif any(c in pattern for c in "*?["):
+            paths.extend(p for p in glob.glob(pattern, recursive=True) if os.path.isfile(p))
+        else:
+            paths.append(pattern)
+    return sorted(set(paths))
+
+def figure_prefix(path, output_dir=""):
+    """Per-capture figure prefix built from the whole path, so captures with the same name never collide."""
+    name = re.sub(r"[^\w-]+", "_", os.path.relpath(path)).strip("_")
+    return os.path.join(output_dir, name + "_")
+
+def analyze_capture(input_file, sampling_rate=48000, nfft=1024, save=False, output_dir="", fmt=None):
+    """Summary stats of one capture in a single pass (and its amplitude and PSD figures if save)."""
+    t0 = time.perf_counter()
+    fmt = fmt or format_from_path(input_file)
+    row = {"file": input_file, "format": fmt}
+    try:
+        consumers = [StatsConsumer(), WelchPSD(sampling_rate, nfft), BurstDetector(sampling_rate)]
+        if save:
+            consumers.append(EnvelopeDecimator())
+        stats, psd, bursts, *envelope = run_pipeline(input_file, consumers, fmt=fmt)
+        freqs, psd_db, _ = psd
+        row.update(
+            samples=stats.n_samples,
+            duration_s=stats.n_samples / sampling_rate,
+            rms=round(float(stats.rms), 4),
+            peak=round(float(stats.peak), 4),
+            dc_i=round(stats.dc.real, 4),
+            dc_q=round(stats.dc.imag, 4),
+            occupied_bandwidth_hz=round(occupied_bandwidth(freqs, psd_db), 1),
+            bursts=len(bursts),
+        )
+        if save:
+            prefix = figure_prefix(input_file, output_dir)
+            plot_amplitude(envelope[0], sampling_rate, save=True, prefix=prefix)
+            plot_psd(freqs, psd_db, save=True, prefix=prefix)
+    except Exception as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+    row["analysis_s"] = round(time.perf_counter() - t0, 4)
+    return row
+
+def _init_batch_worker():
+    # One process per core, so one FFTW thread each; counters forked from the parent are not the worker's
+    metrics.reset()
+    fft_service.configure(threads=1)
+    _pyplot(save=True)
+
+def _analyze_job(job):
+    input_file, options = job
+    return analyze_capture(input_file, **options), metrics.take_snapshot()
+
+def run_batch(paths, workers=None, **options):
+    """Analyze captures over a process pool, yielding the summary rows in input order."""
+    workers = workers or fft_service.available_cores()
+    if workers == 1:
+        for path in paths:
+            yield analyze_capture(path, **options)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker) as pool:
+        for row, stages in pool.map(_analyze_job, [(path, options) for path in paths]):
+            if stages:
+                metrics.merge(stages)
+            yield row
+
+def write_summary(rows, path):
+    """Summary as JSON if path ends with .json, else CSV."""
+    if path.lower().endswith(".json"):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(rows, f, indent=2)
+        return
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def read_batch(patterns, sampling_rate=48000, nfft=1024, save=False, output_dir="", summary=None, workers=None, fmt=None):
+    paths = expand_inputs(patterns)
+    if not paths:
+        print("[!] No capture found")
+        return []
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    print(f"[i] Analyzing {len(paths)} captures...")
+    t0 = time.perf_counter()
+    rows = []
+    n_bytes = 0
+    for row in run_batch(paths, workers, sampling_rate=sampling_rate, nfft=nfft, save=save, output_dir=output_dir, fmt=fmt):
+        rows.append(row)
+        if row.get("error"):
+            print(f"[!] {row['file']} : {row['error']}")
+            continue
+        n_bytes += os.path.getsize(row["file"])
+        print(f"[OUT] {row['file']} : {row['duration_s']:.1f} s, RMS {row['rms']:.1f}, peak {row['peak']:.1f},"
+              f" {row['occupied_bandwidth_hz']:.0f} Hz occupied, {row['bursts']} burst(s)")
+    elapsed = time.perf_counter() - t0
+    print(f"[i] Batch has ended : {len(rows)} captures in {elapsed:.2f} s ({n_bytes / 2**20 / max(elapsed, 1e-9):.1f} MB/s)")
+    if summary:
+        write_summary(rows, summary)
+        print(f"[OUT] Summary saved : {summary}")
+    return rows
+
 def parse_args():
-    parser = argparse.ArgumentParser(description="CS8 file analyze")
-    parser.add_argument("input_file", help="CS8 file in input")
-    parser.add_argument("--mode", choices=["amplitude", "fft", "iq", "all"], default="amplitude",
-                        help="Display type: amplitude, fft, iq (real/imag), or all (default: amplitude)",)
+    parser = argparse.ArgumentParser(description="IQ file analyze (CS8, CU8, CS16, CF32)")
+    parser.add_argument("input_file", nargs="+",
+                        help="IQ file in input, or several files, directories or globs for the batch mode",)
+    parser.add_argument("--format", choices=list(IQ_FORMATS), default=None,
+                        help="Sample format (default: from the file extension, else cs8)",)
+    parser.add_argument("--mode", choices=["amplitude", "fft", "iq", "waterfall", "psd", "decode", "segments", "channels", "all"], default="amplitude",
+                        help="Display type: amplitude, fft, iq (real/imag), waterfall, psd (Welch), decode (Morse to text), segments (burst detection), channels (FDM split and decode), or all (default: amplitude)",)
     parser.add_argument("--sampling_rate", type=float, default=48000,
                         help="Sample rate in Hz (default: 48000)",)
     parser.add_argument("--max-fft-samples", type=int, default=2**20,
                         help="Max number of samples used for FFT (default: 2**20 about 1M)",)
+    parser.add_argument("--nfft", type=int, default=1024,
+                        help="Block size for waterfall and psd modes (default: 1024)",)
+    parser.add_argument("--overlap", type=float, default=0.5,
+                        help="Block overlap ratio for waterfall and psd modes (default: 0.5)",)
+    parser.add_argument("--waterfall-rows", type=int, default=1000,
+                        help="Max number of time rows in the waterfall (default: 1000)",)
+    parser.add_argument("--fft-threads", type=int, default=fft_service.available_cores(),
+                        help="FFTW threads (default: available cores)",)
+    parser.add_argument("--fft-effort", choices=sorted(fft_service.PLANNER_EFFORTS), default="measure",
+                        help="FFTW planner effort, plans are cached as wisdom across runs (default: measure)",)
+    parser.add_argument("--decode-output",
+                        help="Write the decoded text of --mode decode to this file",)
+    parser.add_argument("--channels", type=int, default=4,
+                        help="Number of FDM channels of --mode channels, each sampling_rate / channels wide (default: 4)",)
     parser.add_argument("--save", action="store_true",
-                        help="Save figures as .png instead of displaying them",)
+                        help="Save figures as .png instead of displaying them (channels mode: save each channel as <prefix>chNN.<format>)",)
+    parser.add_argument("--batch", action="store_true",
+                        help="Batch mode (implied by several inputs, a directory or a glob): summary stats of every capture, amplitude and PSD figures with --save",)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="Worker processes of the batch mode (default: available cores)",)
+    parser.add_argument("--summary", default=None,
+                        help="Write the batch summary to this file (.json, else CSV)",)
+    parser.add_argument("--output-dir", default="",
+                        help="Directory of the batch mode figures (default: current directory)",)
+    parser.add_argument("--start", type=float, default=0.0,
+                        help="Start of the analyzed window in seconds (default: 0)",)
+    parser.add_argument("--duration", type=float, default=None,
+                        help="Length of the analyzed window in seconds (default: up to the end; live mode: stop after this many seconds)",)
+    parser.add_argument("--index", action="store_true",
+                        help="Build or refresh the sidecar index (<file>.idx) before the analysis",)
+    parser.add_argument("--no-index", action="store_true",
+                        help="Ignore the sidecar index, always read the samples",)
+    parser.add_argument("--live", action="store_true",
+                        help="Live mode (implied by '-'): analyze an IQ stream from stdin ('-'), a FIFO, unix:PATH or tcp:HOST:PORT as it arrives",)
+    parser.add_argument("--refresh", type=float, default=10.0,
+                        help="Updates per second of the live mode (default: 10)",)
+    parser.add_argument("--live-plot", action="store_true",
+                        help="Live mode: refresh an amplitude and PSD figure instead of printing status lines",)
+    parser.add_argument("--segments", default=None, metavar="FILE",
+                        help="With --mode segments, write the burst segments to this JSON file; with the other modes, analyze only the segments of this file ('auto': detect them first)",)
+    parser.add_argument("--segment-padding", type=float, default=0.1,
+                        help="Seconds kept before and after each segment (default: 0.1)",)
+    metrics.add_profile_argument(parser)
     return parser.parse_args()
 
 if __name__ == "__main__":
     args = parse_args()
-    input_file = args.input_file
-    
+    metrics.configure_from_args(args)
+    inputs = args.input_file
+
+    if args.live or inputs == ["-"]:
+        import live_rx
+        fft_service.configure(threads=args.fft_threads, effort=args.fft_effort)
+        live_rx.run_live(inputs[0], sampling_rate=args.sampling_rate, fmt=args.format or format_from_path(inputs[0]),
+                         refresh_hz=args.refresh, nfft=args.nfft, duration=args.duration, plot=args.live_plot,
+                         save=args.save)
+        print("[OUT] Done")
+        sys.exit(0)
+
+    if args.batch or args.summary or len(inputs) > 1 or os.path.isdir(inputs[0]) or any(c in inputs[0] for c in "*?["):
+        rows = read_batch(inputs, sampling_rate=args.sampling_rate, nfft=args.nfft, save=args.save, output_dir=args.output_dir,
+                          summary=args.summary, workers=args.workers, fmt=args.format)
+        print("[OUT] Done")
+        sys.exit(1 if not rows or any(row.get("error") for row in rows) else 0)
+
+    input_file = inputs[0]
     if not os.path.isfile(input_file):
         print(f"[!] File {input_file} not found")
         sys.exit(1)
-        
+
     prefix = os.path.splitext(os.path.basename(input_file))[0] + "_"
-    
-    if args.mode in ("iq", "all"):
-        read_img_real(input_file, save=args.save, prefix=prefix)
-        
-    if args.mode in ("amplitude", "all"):
-        read_amplitude(input_file, sampling_rate=args.sampling_rate, save=args.save, prefix=prefix)
-    
-    if args.mode in ("fft", "all"):
-        read_fft(input_file, sampling_rate=args.sampling_rate, max_fft_samples=args.max_fft_samples, save=args.save, prefix=prefix)
-        
+    fmt = args.format or format_from_path(input_file)
+    fft_service.configure(threads=args.fft_threads, effort=args.fft_effort)
+    start = int(args.start * args.sampling_rate)
+    stop = None if args.duration is None else start + int(args.duration * args.sampling_rate)
+    window = dict(fmt=fmt, start=start, stop=stop)
+    use_index = not args.no_index
+
+    if args.index:
+        if cs8_index.load_index(input_file, fmt) is None:
+            cs8_index.build_index(input_file, fmt)
+            print(f"[OUT] Index saved : {cs8_index.index_path(input_file)}")
+        else:
+            print(f"[i] Index up to date : {cs8_index.index_path(input_file)}")
+
+    if args.mode == "segments":
+        read_segments(input_file, sampling_rate=args.sampling_rate, output=args.segments, **window)
+        print("[OUT] Done")
+        sys.exit(0)
+
+    windows = [(start, stop, prefix)]
+    if args.segments:
+        if args.segments == "auto":
+            segments = detect_segments(input_file, args.sampling_rate, **window)
+        else:
+            segments = load_segments(args.segments)
+        spans = segment_windows(segments, args.sampling_rate, args.segment_padding, start, stop)
+        busy = sum(last - first for first, last in spans)
+        print(f"[i] {len(spans)} segment(s) to analyze, {busy / args.sampling_rate:.1f} s of the capture")
+        windows = [(first, last, f"{prefix}seg{k:03d}_") for k, (first, last) in enumerate(spans)]
+
+    for start, stop, prefix in windows:
+        if args.segments:
+            print(f"[i] Segment {start / args.sampling_rate:.3f} s - {stop / args.sampling_rate:.3f} s")
+        window = dict(fmt=fmt, start=start, stop=stop)
+
+        if args.mode == "all":
+            read_all(input_file, sampling_rate=args.sampling_rate, max_fft_samples=args.max_fft_samples, save=args.save, prefix=prefix, **window)
+
+        if args.mode == "iq":
+            read_img_real(input_file, save=args.save, prefix=prefix, use_index=use_index, **window)
+
+        if args.mode == "amplitude":
+            read_amplitude(input_file, sampling_rate=args.sampling_rate, save=args.save, prefix=prefix, use_index=use_index, **window)
+
+        if args.mode == "fft":
+            read_fft(input_file, sampling_rate=args.sampling_rate, max_fft_samples=args.max_fft_samples, save=args.save, prefix=prefix, **window)
+
+        if args.mode == "waterfall":
+            read_waterfall(input_file, sampling_rate=args.sampling_rate, nfft=args.nfft, overlap=args.overlap,
+                           max_rows=args.waterfall_rows, save=args.save, prefix=prefix, **window)
+
+        if args.mode == "psd":
+            read_psd(input_file, sampling_rate=args.sampling_rate, nfft=args.nfft, overlap=args.overlap, save=args.save, prefix=prefix, **window)
+
+        if args.mode == "decode":
+            read_decode(input_file, sampling_rate=args.sampling_rate, output=args.decode_output, **window)
+
+        if args.mode == "channels":
+            read_channels(input_file, args.channels, sampling_rate=args.sampling_rate, save=args.save, prefix=prefix, **window)
+
     print("[OUT] Done")
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+"""
+Benchmark suite of the hot paths, written as JSON:
+
+* crypto     : Kyber512 keygen/encaps/decaps and pq_encrypt_compressed_b64
+               (and its decryption) ops/s across message sizes
+* modulation : convert_to_CW + write_toCS8 samples/s and peak memory for AM
+               and FM, against the streaming writer
+* read       : ReadCS8 MB/s per mode on generated synthetic captures
+
+Every metric is {"value", "unit", "better": "higher" | "lower"}. --compare
+runs the suite (or loads --input) and flags the metrics that moved the
+wrong way by more than --threshold against a stored baseline.
+
+"""
+
+import os
+import sys
+import gc
+import json
+import time
+import platform
+import argparse
+import tempfile
+import tracemalloc
+
+import numpy as np
+
+SUITES = ["crypto", "modulation", "read"]
+CRYPTO_SIZES = [32, 1024, 16384]
+MODULATION_CHARS = [16, 256]
+READ_SIZES_MB = [16, 64]
+READ_MODES = ["amplitude", "fft", "psd", "waterfall", "decode", "all"]
+QUICK = {"crypto": [32], "modulation": [16], "read": [4]}
+MESSAGE_TEXT = "CQ DE F4ABC TEST 599 73 "
+THRESHOLD = 0.15
+
+def measure(function, min_seconds=0.2, repeat=3):
+    """Best calls per second over repeat runs of at least min_seconds each."""
+    function()
+    best = 0.0
+    for _ in range(repeat):
+        calls = 0
+        start = time.perf_counter()
+        while True:
+            function()
+            calls += 1
+            elapsed = time.perf_counter() - start
+            if elapsed >= min_seconds:
+                break
+        best = max(best, calls / elapsed)
+    return best
+
+def peak_memory(function):
+    """Peak bytes allocated (numpy buffers included) while running function."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def metric(value, unit, better="higher"):
+    return {"value": value, "unit": unit, "better": better}
+
+def bench_crypto(sizes=CRYPTO_SIZES, repeat=3):
+    from kyber_py.kyber import Kyber512
+    from pq_crypto import pq_encrypt_compressed_b64, pq_decrypt_compressed_b64
+
+    pk, sk = Kyber512.keygen()
+    ct = Kyber512.encaps(pk)[1]
+    results = {
+        "crypto.kyber512.keygen": metric(measure(Kyber512.keygen, repeat=repeat), "ops/s"),
+        "crypto.kyber512.encaps": metric(measure(lambda: Kyber512.encaps(pk), repeat=repeat), "ops/s"),
+        "crypto.kyber512.decaps": metric(measure(lambda: Kyber512.decaps(sk, ct), repeat=repeat), "ops/s"),
+    }
+    for size in sizes:
+        message = (MESSAGE_TEXT * (size // len(MESSAGE_TEXT) + 1)).encode("utf-8")[:size]
+        cipher = pq_encrypt_compressed_b64(message, pk)
+        assert pq_decrypt_compressed_b64(cipher, sk) == message
+        results[f"crypto.encrypt_b64.{size}B"] = metric(
+            measure(lambda: pq_encrypt_compressed_b64(message, pk), repeat=repeat), "ops/s")
+        results[f"crypto.decrypt_b64.{size}B"] = metric(
+            measure(lambda: pq_decrypt_compressed_b64(cipher, sk), repeat=repeat), "ops/s")
+    return results
+
+def bench_modulation(n_chars=MODULATION_CHARS, repeat=3):
+    from CWToCS8 import convert_to_CW, write_toCS8, write_toCS8_stream, iter_CW, cw_num_samples
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.cs8")
+        for modulation in ("AM", "FM"):
+            for n in n_chars:
+                message = (MESSAGE_TEXT * (n // len(MESSAGE_TEXT) + 1))[:n].strip()
+                n_samples = cw_num_samples(message, modulation)
+                full = lambda: write_toCS8(convert_to_CW(message, modulation), path)
+                stream = lambda: write_toCS8_stream(iter_CW(message, modulation), path)
+                name = f"modulation.{modulation.lower()}.{n}ch"
+                results[f"{name}.full"] = metric(measure(full, repeat=repeat) * n_samples / 1e6, "MS/s")
+                results[f"{name}.full_peak"] = metric(peak_memory(full) / 2**20, "MB", "lower")
+                results[f"{name}.stream"] = metric(measure(stream, repeat=repeat) * n_samples / 1e6, "MS/s")
+                results[f"{name}.stream_peak"] = metric(peak_memory(stream) / 2**20, "MB", "lower")
+    return results
+
+def synthetic_capture(path, size_mb, modulation="AM"):
+    """A CS8 capture of about size_mb MB of keyed CW, returns its size in bytes."""
+    from CWToCS8 import write_toCS8_memmap, cw_num_samples
+
+    samples_per_char = cw_num_samples(MESSAGE_TEXT * 4, modulation) / (4 * len(MESSAGE_TEXT))
+    n_chars = max(1, int(size_mb * 2**20 / 2 / samples_per_char))
+    message = (MESSAGE_TEXT * (n_chars // len(MESSAGE_TEXT) + 1))[:n_chars].strip()
+    write_toCS8_memmap(message, path, modulation)
+    return os.path.getsize(path)
+
+def read_consumers(mode):
+    import ReadCS8
+
+    if mode in ("amplitude", "iq"):
+        return [ReadCS8.EnvelopeDecimator()]
+    if mode == "fft":
+        return [ReadCS8.FFTConsumer()]
+    if mode == "psd":
+        return [ReadCS8.WelchPSD()]
+    if mode == "waterfall":
+        return [ReadCS8.Waterfall()]
+    if mode == "decode":
+        return [ReadCS8.MorseDecoder()]
+    if mode == "all":
+        return [ReadCS8.EnvelopeDecimator(), ReadCS8.FFTConsumer(), ReadCS8.StatsConsumer()]
+    raise ValueError(f"Unknown mode: {mode}")
+
+def bench_read(sizes_mb=READ_SIZES_MB, modes=READ_MODES, repeat=3):
+    """MB/s of each ReadCS8 mode (plots excluded). The fft mode only reads its first max_fft_samples."""
+    from ReadCS8 import run_pipeline
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for size_mb in sizes_mb:
+            path = os.path.join(tmp, f"capture_{size_mb}.cs8")
+            n_bytes = synthetic_capture(path, size_mb)
+            for mode in modes:
+                rate = measure(lambda: run_pipeline(path, read_consumers(mode)), min_seconds=0, repeat=repeat)
+                results[f"read.{mode}.{size_mb}MB"] = metric(rate * n_bytes / 2**20, "MB/s")
+            os.remove(path)
+    return results
+
+def run_suite(suites=SUITES, quick=False, repeat=3):
+    runners = {
+        "crypto": lambda: bench_crypto(QUICK["crypto"] if quick else CRYPTO_SIZES, repeat),
+        "modulation": lambda: bench_modulation(QUICK["modulation"] if quick else MODULATION_CHARS, repeat),
+        "read": lambda: bench_read(QUICK["read"] if quick else READ_SIZES_MB, repeat=repeat),
+    }
+    metrics = {}
+    for suite in suites:
+        print(f"[i] Running {suite} benchmarks...", file=sys.stderr)
+        metrics.update(runners[suite]())
+    return {
+        "meta": {
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "quick": quick,
+        },
+        "metrics": metrics,
+    }
+
+def compare_results(current, baseline, threshold=THRESHOLD):
+    """(name, baseline value, current value, change, regression) for the metrics found in both."""
+    rows = []
+    for name, now in current["metrics"].items():
+        before = baseline["metrics"].get(name)
+        if before is None or not before["value"]:
+            continue
+        change = now["value"] / before["value"] - 1
+        if now["better"] == "higher":
+            regression = change < -threshold
+        else:
+            regression = change > threshold
+        rows.append((name, before["value"], now["value"], change, regression))
+    return rows
+
+def print_results(results):
+    for name, m in results["metrics"].items():
+        print(f"[OUT] {name:<36}: {m['value']:12.2f} {m['unit']}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="SecCW benchmark suite (crypto, modulation, read)")
+    parser.add_argument("suites", nargs="*", default=SUITES,
+                        help=f"Suites to run (default: {' '.join(SUITES)})",)
+    parser.add_argument("--quick", action="store_true",
+                        help="Smallest sizes only, for a quick check",)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs per measure, the best one is kept (default: 3)",)
+    parser.add_argument("--output", default=None,
+                        help="Write the results as JSON to this file",)
+    parser.add_argument("--compare", metavar="BASELINE", default=None,
+                        help="Flag regressions against a baseline JSON file (exit code 1 if any)",)
+    parser.add_argument("--input", default=None,
+                        help="With --compare, load the current results from this JSON file instead of running",)
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help=f"Relative change counted as a regression (default: {THRESHOLD})",)
+    parser.add_argument("--json", action="store_true",
+                        help="Print the results as JSON",)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.input:
+        with open(args.input, "r", encoding="utf-8") as f:
+            results = json.load(f)
+    else:
+        unknown = sorted(set(args.suites) - set(SUITES))
+        if unknown:
+            print(f"[!] Unknown suite(s): {' '.join(unknown)}, choose from {' '.join(SUITES)}")
+            sys.exit(1)
+        results = run_suite(args.suites, args.quick, args.repeat)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"[OUT] Results saved : {args.output}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        rows = compare_results(results, baseline, args.threshold)
+        for name, before, now, change, regression in rows:
+            tag = "[!]" if regression else "[OUT]"
+            print(f"{tag} {name:<36}: {before:12.2f} -> {now:12.2f} ({100 * change:+6.1f} %)")
+        regressions = [row[0] for row in rows if row[4]]
+        print(f"[OUT] {len(rows)} metrics compared, {len(regressions)} regression(s) beyond {100 * args.threshold:.0f} %")
+        sys.exit(1 if regressions else 0)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    elif not args.output:
+        print_results(results)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+"""
+Airtime benchmark: seconds on air per payload byte of the Morse-airtime
+encoding (morse_codec) against Base64, for random payloads and real PQ
+ciphertexts, plus encoder/decoder throughput.
+
+"""
+
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+
+from CWToCS8 import get_encoder
+from morse_codec import cw_encode, cw_decode
+from pq_crypto import kyber_generate_keypair, pq_encrypt_compressed, PQSession, compress_payload
+
+SIZES = [16, 64, 256, 1024, 4096]
+MESSAGE = b"Hello, post-quantum Morse world!"
+
+def airtime_seconds(text, sample_rate=48000, unit_seconds=0.05):
+    """Seconds on air of text keyed by convert_to_CW (framing included)."""
+    return get_encoder('AM', sample_rate, unit_seconds).num_samples(text) / sample_rate
+
+def throughput(function, argument, min_seconds=0.2):
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        function(argument)
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return runs / elapsed
+
+def payloads(sizes):
+    pk, _ = kyber_generate_keypair()
+    session = PQSession(pk)
+    yield "pq one-shot", pq_encrypt_compressed(MESSAGE, pk)
+    yield "pq session", session.encrypt(compress_payload(MESSAGE))
+    for size in sizes:
+        yield f"random {size}", os.urandom(size)
+
+def bench_airtime(sizes=SIZES, unit_seconds=0.05):
+    results = []
+    for name, data in payloads(sizes):
+        cw_text = cw_encode(data)
+        b64_text = base64.b64encode(data).decode("ascii")
+        assert cw_decode(cw_text) == data
+        cw_seconds = airtime_seconds(cw_text, unit_seconds=unit_seconds)
+        b64_seconds = airtime_seconds(b64_text, unit_seconds=unit_seconds)
+        results.append({
+            "payload": name,
+            "bytes": len(data),
+            "cw_chars": len(cw_text),
+            "b64_chars": len(b64_text),
+            "cw_s_per_byte": cw_seconds / len(data),
+            "b64_s_per_byte": b64_seconds / len(data),
+            "cw_seconds": cw_seconds,
+            "b64_seconds": b64_seconds,
+            "encode_mb_s": throughput(cw_encode, data) * len(data) / 1e6,
+            "decode_mb_s": throughput(cw_decode, cw_text) * len(data) / 1e6,
+        })
+    return results
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Morse airtime benchmark (Morse-airtime encoding vs Base64)")
+    parser.add_argument("sizes", nargs="*", type=int, default=SIZES,
+                        help=f"Random payload sizes in bytes (default: {' '.join(map(str, SIZES))})",)
+    parser.add_argument("--unit-seconds", type=float, default=0.05,
+                        help="Morse dot length in seconds (default: 0.05)",)
+    parser.add_argument("--json", action="store_true",
+                        help="Print the results as JSON",)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = bench_airtime(args.sizes, args.unit_seconds)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        sys.exit(0)
+    print(f"[i] Dot length {args.unit_seconds * 1000:.0f} ms, seconds on air per payload byte")
+    for r in results:
+        print(f"[OUT] {r['payload']:<12} {r['bytes']:5d} B : cw {r['cw_s_per_byte']:.3f} s/B ({r['cw_seconds']:7.1f} s)"
+              f"  b64 {r['b64_s_per_byte']:.3f} s/B ({r['b64_seconds']:7.1f} s)"
+              f"  saved {100 * (1 - r['cw_seconds'] / r['b64_seconds']):4.1f} %"
+              f"  enc {r['encode_mb_s']:.1f} MB/s dec {r['decode_mb_s']:.1f} MB/s")
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""
+Compression benchmark over a corpus of operator messages: compressed size
+and encode/decode throughput of each payload codec, of the adaptive
+compress_payload and of the legacy zlib.compress.
+
+The corpus is built in, or read from a text file (one message per line).
+--train prints a dictionary candidate from the corpus substrings.
+
+"""
+
+import sys
+import json
+import time
+import zlib
+import argparse
+from collections import Counter
+
+from payload_codecs import CODECS, DEFAULT_CODECS, compress_payload, decompress_payload
+
+CORPUS = [
+    "QSL 73",
+    "CQ CQ CQ DE F4ABC F4ABC K",
+    "F4ABC DE F5XYZ UR RST 599 599 QTH PARIS PARIS HW? BK",
+    "TU FER QSO 73 ES GL SK",
+    "QRV 14.060 MHz 20H UTC",
+    "QSY 7.030 MHz",
+    "QRM QRN PSE QRS",
+    "Hello RF world",
+    "Hello, post-quantum Morse world!",
+    "Position 48.8566 N 2.3522 E heading 270 speed 12 knots",
+    "Weather report: wind west 15 knots, rain expected this evening",
+    "Rendez-vous demain 10h UTC position habituelle",
+    "Message recu, merci. Confirme heure de passage",
+    "Bonjour, test de transmission SecCW",
+    "Meeting confirmed tomorrow at 0800 UTC, please acknowledge",
+    "Battery low, power reduced to 5 watts, QRP until tomorrow",
+    "Repeat last message please, signal report 339",
+    "All stations QRT at 2200 UTC",
+    "Test batch message 42",
+    "Antenna repaired, back on 3.560 MHz tonight",
+    "GM OM TNX FB QSO",
+    "QTH change: moving north to 49.10 N 1.90 E",
+    "No traffic, QRU, standing by on QRG",
+    "Send 12 confirmed, waiting for 13",
+]
+
+def load_corpus(path=None):
+    if path is None:
+        return [m.encode("utf-8") for m in CORPUS]
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.rstrip("\n").encode("utf-8") for line in f if line.strip()]
+
+def throughput(function, messages, min_seconds=0.2):
+    n_bytes = sum(len(m) for m in messages)
+    runs = 0
+    start = time.perf_counter()
+    while True:
+        for m in messages:
+            function(m)
+        runs += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_seconds:
+            return runs * n_bytes / elapsed / 1e6
+
+def bench_codec(name, compress, decompress, messages):
+    compressed = [compress(m) for m in messages]
+    assert [decompress(c) for c in compressed] == messages
+    return {
+        "codec": name,
+        "bytes": sum(len(c) for c in compressed),
+        "ratio": sum(len(c) for c in compressed) / sum(len(m) for m in messages),
+        "encode_mb_s": throughput(compress, messages),
+        "decode_mb_s": throughput(decompress, compressed),
+    }
+
+def bench_compression(messages):
+    results = [bench_codec("zlib (legacy)", zlib.compress, zlib.decompress, messages)]
+    for codec in DEFAULT_CODECS:
+        flag = bytes([codec.flag])
+        results.append(bench_codec(codec.name, lambda m, codec=codec: flag + codec.compress(m),
+                                   decompress_payload, messages))
+    results.append(bench_codec("adaptive", compress_payload, decompress_payload, messages))
+    return results
+
+def train_dictionary(messages, size=1024, min_len=3, max_len=12):
+    """Frequent substrings of the corpus, least useful first, at most size bytes."""
+    counts = Counter()
+    for m in messages:
+        for n in range(min_len, max_len + 1):
+            counts.update({m[i:i + n] for i in range(len(m) - n + 1)})
+    # Savings of a string ~ (occurrences - 1) * length, skip substrings of kept strings
+    kept, total = [], 0
+    for s, count in sorted(counts.items(), key=lambda kv: (kv[1] - 1) * len(kv[0]), reverse=True):
+        if count < 2 or total + len(s) > size:
+            continue
+        if any(s in k for k in kept):
+            continue
+        kept.append(s)
+        total += len(s)
+    return b"".join(reversed(kept))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Payload compression benchmark")
+    parser.add_argument("corpus", nargs="?", default=None,
+                        help="Text file, one message per line (default: built-in corpus)",)
+    parser.add_argument("--train", type=int, metavar="SIZE", default=None,
+                        help="Print a dictionary candidate of at most SIZE bytes instead",)
+    parser.add_argument("--json", action="store_true",
+                        help="Print the results as JSON",)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    messages = load_corpus(args.corpus)
+    if args.train:
+        print(train_dictionary(messages, args.train))
+        sys.exit(0)
+    results = bench_compression(messages)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        sys.exit(0)
+    raw = sum(len(m) for m in messages)
+    print(f"[i] {len(messages)} messages, {raw} bytes, {len(CODECS)} registered codecs")
+    for r in results:
+        print(f"[OUT] {r['codec']:<16}: {r['bytes']:6d} B (ratio {r['ratio']:.3f})"
+              f"  enc {r['encode_mb_s']:7.2f} MB/s  dec {r['decode_mb_s']:7.2f} MB/s")
@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+Import-time benchmark: start a fresh interpreter per sample and time
+`import <module>`, minus the cost of an empty interpreter start.
+
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+MODULES = ["pq_crypto", "CWToCS8", "ReadCS8", "fft_service", "pq_morse_demo"]
+
+def time_command(code, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def bench_imports(modules=MODULES, repeat=10):
+    interpreter = statistics.median(time_command("pass", repeat))
+    results = {"interpreter_ms": interpreter * 1000, "modules": {}}
+    for module in modules:
+        samples = time_command(f"import {module}", repeat)
+        results["modules"][module] = {
+            "median_ms": (statistics.median(samples) - interpreter) * 1000,
+            "min_ms": (min(samples) - interpreter) * 1000,
+        }
+    return results
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import-time benchmark")
+    parser.add_argument("modules", nargs="*", default=MODULES,
+                        help=f"Modules to import (default: {' '.join(MODULES)})",)
+    parser.add_argument("--repeat", type=int, default=10,
+                        help="Fresh interpreters per module (default: 10)",)
+    parser.add_argument("--json", action="store_true",
+                        help="Print the results as JSON",)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = bench_imports(args.modules, args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        sys.exit(0)
+    print(f"[OUT] Empty interpreter : {results['interpreter_ms']:.1f} ms")
+    for module, timing in results["modules"].items():
+        print(f"[OUT] import {module:<14}: median {timing['median_ms']:7.1f} ms  min {timing['min_ms']:7.1f} ms")
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+"""
+Multi-resolution sidecar index of an IQ capture
+
+<capture>.idx sits next to the capture (numpy .npz content) and holds a
+pyramid of per-block summaries: level 0 has one entry per BLOCK_SAMPLES
+samples, each next level merges LEVEL_FACTOR entries of the previous one.
+Per block: sample count, |IQ| min/max/mean, I and Q min/max/mean, mean
+power and the strongest FFT bin (offset from the centre, in bins of
+sample_rate / BLOCK_SAMPLES) with its power.
+
+The index is stamped with the capture size and mtime: a capture written
+after its index makes load_index() return None. Overview queries (plots,
+stats) read a few thousand entries of the right level instead of the raw
+samples, the raw memmap is then only opened on the zoomed time window.
+
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+import fft_service
+import metrics
+from CWToCS8 import IQ_FORMATS, format_from_path
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".idx"
+BLOCK_SAMPLES = 4096
+LEVEL_FACTOR = 16
+FIELDS = ["count", "amp_min", "amp_max", "amp_mean", "i_min", "i_max", "i_mean",
+          "q_min", "q_max", "q_mean", "power", "peak_bin", "peak_power"]
+
+def index_path(capture: str) -> str:
+    return capture + INDEX_SUFFIX
+
+def _stamp(capture):
+    st = os.stat(capture)
+    return st.st_size, st.st_mtime_ns
+
+class IndexBuilder:
+    """ReadCS8 pipeline consumer computing the level 0 block summaries."""
+
+    def __init__(self, block=BLOCK_SAMPLES):
+        self.block = block
+        self.done = False
+
+    def start(self, n_samples):
+        self.n_samples = n_samples
+        self.parts = {field: [] for field in FIELDS}
+
+    def _summarize(self, magnitude, real, imag, iq, counts):
+        parts = self.parts
+        parts["count"].append(counts)
+        parts["amp_min"].append(magnitude.min(axis=1))
+        parts["amp_max"].append(magnitude.max(axis=1))
+        parts["amp_mean"].append((magnitude.sum(axis=1, dtype=np.float64) / counts).astype(np.float32))
+        parts["power"].append((np.square(magnitude, dtype=np.float32).sum(axis=1, dtype=np.float64) / counts).astype(np.float32))
+        for name, values in (("i", real), ("q", imag)):
+            parts[f"{name}_min"].append(values.min(axis=1).astype(np.float32))
+            parts[f"{name}_max"].append(values.max(axis=1).astype(np.float32))
+            parts[f"{name}_mean"].append((values.sum(axis=1, dtype=np.float64) / counts).astype(np.float32))
+        plan = fft_service.get_plan(iq.shape, axes=(-1,))
+        plan.input_array[:] = iq
+        spectrum = plan()
+        power = np.square(spectrum.real)
+        power += np.square(spectrum.imag)
+        peak = power.argmax(axis=1)
+        # Signed bin offset from the centre frequency, power on the |IQ|^2 scale
+        parts["peak_bin"].append(((peak + self.block // 2) % self.block - self.block // 2).astype(np.int16))
+        parts["peak_power"].append((power[np.arange(len(peak)), peak] / (self.block * counts)).astype(np.float32))
+
+    def feed(self, chunk):
+        n_full = len(chunk) // self.block
+        if n_full:
+            n = n_full * self.block
+            shape = (n_full, self.block)
+            self._summarize(chunk.magnitude[:n].reshape(shape), chunk.real[:n].reshape(shape),
+                            chunk.imag[:n].reshape(shape), chunk.iq[:n].reshape(shape),
+                            np.full(n_full, self.block, dtype=np.int64))
+        rest = len(chunk) - n_full * self.block
+        if rest:
+            # Only the last chunk of the capture ends with a partial block
+            n = n_full * self.block
+            iq = np.zeros((1, self.block), dtype=np.complex64)
+            iq[0, :rest] = chunk.iq[n:]
+            self._summarize(chunk.magnitude[n:][None, :], chunk.real[n:][None, :], chunk.imag[n:][None, :],
+                            iq, np.array([rest], dtype=np.int64))
+
+    def finish(self):
+        return {field: np.concatenate(parts) if parts else np.empty(0) for field, parts in self.parts.items()}
+
+def reduce_level(level, factor=LEVEL_FACTOR):
+    """Merge every factor consecutive entries of a level (the last group may be shorter)."""
+    n = len(level["count"])
+    starts = np.arange(0, n, factor)
+    counts = np.add.reduceat(level["count"], starts)
+    merged = {"count": counts}
+    for field in ("amp_min", "i_min", "q_min"):
+        merged[field] = np.minimum.reduceat(level[field], starts)
+    for field in ("amp_max", "i_max", "q_max"):
+        merged[field] = np.maximum.reduceat(level[field], starts)
+    for field in ("amp_mean", "i_mean", "q_mean", "power"):
+        weighted = np.add.reduceat(level[field] * level["count"].astype(np.float64), starts)
+        merged[field] = (weighted / counts).astype(np.float32)
+    # The strongest block of the group gives its peak bin
+    group = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, n]))
+    order = np.lexsort((level["peak_power"], group))
+    best = order[np.r_[np.flatnonzero(np.diff(group[order])), n - 1]]
+    merged["peak_bin"] = level["peak_bin"][best]
+    merged["peak_power"] = level["peak_power"][best]
+    return merged
+
+def build_index(capture, fmt=None, block=BLOCK_SAMPLES, factor=LEVEL_FACTOR):
+    """Scan the capture once and write its sidecar index, returns the CaptureIndex."""
+    from ReadCS8 import run_pipeline, CHUNK_SAMPLES
+
+    fmt = fmt or format_from_path(capture)
+    size, mtime_ns = _stamp(capture)
+    with metrics.span("index.build", bytes=size):
+        level, = run_pipeline(capture, [IndexBuilder(block)], chunk_samples=CHUNK_SAMPLES // block * block, fmt=fmt)
+        levels = [level]
+        while len(levels[-1]["count"]) > 1:
+            levels.append(reduce_level(levels[-1], factor))
+    meta = {
+        "version": INDEX_VERSION, "size": size, "mtime_ns": mtime_ns, "format": fmt,
+        "block": block, "factor": factor, "n_samples": int(level["count"].sum()), "levels": len(levels),
+    }
+    arrays = {f"l{i}_{field}": values for i, lvl in enumerate(levels) for field, values in lvl.items()}
+    path = index_path(capture)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, meta=np.array(json.dumps(meta)), **arrays)
+    os.replace(tmp, path)
+    return CaptureIndex(meta, levels)
+
+def load_index(capture, fmt=None):
+    """The CaptureIndex of a capture, or None if the sidecar is missing, stale or of another format."""
+    path = index_path(capture)
+    fmt = fmt or format_from_path(capture)
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            if meta.get("version") != INDEX_VERSION or meta["format"] != fmt:
+                return None
+            if (meta["size"], meta["mtime_ns"]) != _stamp(capture):
+                return None
+            levels = [{field: data[f"l{i}_{field}"] for field in FIELDS} for i in range(meta["levels"])]
+    except (OSError, KeyError, ValueError):
+        return None
+    return CaptureIndex(meta, levels)
+
+def ensure_index(capture, fmt=None):
+    """Fresh index of a capture, rebuilt if missing or stale."""
+    return load_index(capture, fmt) or build_index(capture, fmt)
+
+class CaptureIndex:
+    """Queries over the pyramid. Sample ranges are [start, stop) in absolute samples."""
+
+    def __init__(self, meta, levels):
+        self.meta = meta
+        self.levels = levels
+        self.block = meta["block"]
+        self.factor = meta["factor"]
+        self.n_samples = meta["n_samples"]
+
+    def entry_samples(self, level):
+        return self.block * self.factor ** level
+
+    def select(self, start=0, stop=None, min_entries=1):
+        """(level, first, last) of the coarsest level with at least min_entries entries over the range, or None."""
+        stop = self.n_samples if stop is None else min(stop, self.n_samples)
+        for level in range(len(self.levels) - 1, -1, -1):
+            size = self.entry_samples(level)
+            first, last = start // size, -(-stop // size)
+            if last - first >= min_entries:
+                return level, first, last
+        return None
+
+    def envelope(self, start=0, stop=None, n_buckets=4000):
+        """EnvelopeSummary of the range with up to n_buckets buckets, or None if level 0 is too coarse for it.
+
+        Buckets are whole index entries, so the edges are rounded to the
+        entry size of the chosen level.
+        """
+        from ReadCS8 import EnvelopeSummary
+
+        with metrics.span("index.query"):
+            selected = self.select(start, stop, n_buckets)
+            if selected is None:
+                return None
+            level, first, last = selected
+            entries = {field: values[first:last] for field, values in self.levels[level].items()}
+            n = last - first
+            starts = (np.arange(n_buckets + 1) * n) // n_buckets
+            starts = np.unique(starts[:-1])
+            counts = np.add.reduceat(entries["count"], starts)
+            amp_sum = np.add.reduceat(entries["amp_mean"] * entries["count"].astype(np.float64), starts)
+            return EnvelopeSummary(
+                (first + starts) * self.entry_samples(level),
+                np.minimum.reduceat(entries["amp_min"], starts),
+                np.maximum.reduceat(entries["amp_max"], starts),
+                (amp_sum / np.maximum(counts, 1)).astype(np.float32),
+                np.minimum.reduceat(entries["i_min"], starts),
+                np.maximum.reduceat(entries["i_max"], starts),
+                np.minimum.reduceat(entries["q_min"], starts),
+                np.maximum.reduceat(entries["q_max"], starts),
+            )
+
+    def stats(self, start=0, stop=None):
+        """SignalStats of the range, from whole level 0 entries."""
+        from ReadCS8 import SignalStats
+
+        stop = self.n_samples if stop is None else min(stop, self.n_samples)
+        first, last = start // self.block, -(-stop // self.block)
+        entries = {field: values[first:last] for field, values in self.levels[0].items()}
+        counts = entries["count"].astype(np.float64)
+        n = int(counts.sum())
+        if n == 0:
+            return SignalStats(0, 0.0, 0.0, 0j)
+        power = float((entries["power"] * counts).sum() / n)
+        dc = complex((entries["i_mean"] * counts).sum() / n, (entries["q_mean"] * counts).sum() / n)
+        return SignalStats(n, np.sqrt(power), float(entries["amp_max"].max()), dc)
+
+    def peak_track(self, start=0, stop=None, n_points=4000, sampling_rate=48000):
+        """(times s, frequencies Hz, powers) of the strongest FFT bin over the range, one point per entry."""
+        level, first, last = self.select(start, stop, n_points) or self.select(start, stop, 1) or (0, 0, 0)
+        entries = self.levels[level]
+        size = self.entry_samples(level)
+        times = np.arange(first, last) * size / sampling_rate
+        freqs = entries["peak_bin"][first:last].astype(np.float64) * sampling_rate / self.block
+        return times, freqs, entries["peak_power"][first:last]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the multi-resolution sidecar index of IQ captures")
+    parser.add_argument("captures", nargs="+", help="IQ captures (CS8, CU8, CS16, CF32)")
+    parser.add_argument("--format", choices=list(IQ_FORMATS), default=None,
+                        help="Sample format (default: from the file extension, else cs8)",)
+    parser.add_argument("--force", action="store_true",
+                        help="Rebuild even if the index is fresh",)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    failed = False
+    for capture in args.captures:
+        if not os.path.isfile(capture):
+            print(f"[!] File {capture} not found")
+            failed = True
+            continue
+        if not args.force and load_index(capture, args.format) is not None:
+            print(f"[i] Index up to date : {index_path(capture)}")
+            continue
+        t0 = time.perf_counter()
+        index = build_index(capture, args.format)
+        elapsed = time.perf_counter() - t0
+        size = os.path.getsize(capture)
+        print(f"[OUT] Index saved : {index_path(capture)} ({len(index.levels)} levels,"
+              f" {os.path.getsize(index_path(capture)) / 2**20:.2f} MB, {size / 2**20 / max(elapsed, 1e-9):.0f} MB/s)")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+"""
+Worker side of the encoding process pools (pq_morse_demo batch, tx_service)
+
+* Recipient public keys loaded once per worker process
+* Profiling only collected in the workers: each job returns
+  metrics.take_snapshot() and the parent merges it into its report
+
+"""
+
+import metrics
+from keystore import load_recipient_key
+
+_keys = {}
+
+def recipient_key(recipient: str) -> bytes:
+    """Public key of a recipient (key file or key id), loaded once per process."""
+    if recipient not in _keys:
+        _keys[recipient] = load_recipient_key(recipient)
+    return _keys[recipient]
+
+def init_worker(default_recipient: str, profile: bool = False):
+    """Pool initializer: profiling as in the parent, default recipient key preloaded if present."""
+    metrics.configure(enabled=profile)
+    try:
+        recipient_key(default_recipient)
+    except FileNotFoundError:
+        pass
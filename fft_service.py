@@ -0,0 +1,157 @@
+import os
+import json
+import atexit
+import functools
+
+import numpy as np
+
+import metrics
+
+@functools.lru_cache(maxsize=None)
+def _load_pyfftw():
+    """pyfftw module, imported on first use (None when it is not installed)."""
+    try:
+        import pyfftw
+    except ImportError:
+        return None
+    return pyfftw
+
+PLANNER_EFFORTS = {
+    "estimate": "FFTW_ESTIMATE",
+    "measure": "FFTW_MEASURE",
+    "patient": "FFTW_PATIENT",
+    "exhaustive": "FFTW_EXHAUSTIVE",
+}
+PLAN_CACHE_SIZE = 32
+WISDOM_FILE = os.environ.get(
+    "SECCW_FFTW_WISDOM",
+    os.path.join(os.path.expanduser("~"), ".cache", "seccw", "fftw_wisdom.json"),
+)
+
+def _cgroup_cpu_limit():
+    """CPU quota of the container cgroup rounded up (v2 cpu.max, else v1 CFS quota), None when unlimited."""
+    for quota_file, period_file in (("/sys/fs/cgroup/cpu.max", None),
+                                    ("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "/sys/fs/cgroup/cpu/cpu.cfs_period_us")):
+        try:
+            with open(quota_file) as f:
+                fields = f.read().split()
+            if period_file:
+                with open(period_file) as f:
+                    fields.append(f.read().strip())
+            if fields[0] in ("max", "-1"):
+                return None
+            quota, period = int(fields[0]), int(fields[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        if quota > 0 and period > 0:
+            return max(1, -(-quota // period))
+    return None
+
+def available_cores() -> int:
+    """Cores this process may use: its CPU affinity, capped by the cgroup CPU quota of a container."""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+    limit = _cgroup_cpu_limit()
+    return min(cores, limit) if limit else cores
+
+_settings = {"threads": available_cores(), "effort": "measure", "wisdom_file": WISDOM_FILE}
+_wisdom_state = {"loaded": False, "dirty": False}
+
+def configure(threads=None, effort=None, wisdom_file=None):
+    """Set the default thread count, planner effort and wisdom file for new plans."""
+    if threads is not None:
+        _settings["threads"] = max(1, int(threads))
+    if effort is not None:
+        if effort not in PLANNER_EFFORTS:
+            raise ValueError(f"Unknown planner effort: {effort}")
+        _settings["effort"] = effort
+    if wisdom_file is not None:
+        _settings["wisdom_file"] = wisdom_file
+        _wisdom_state["loaded"] = False
+
+def backend() -> str:
+    return "pyfftw" if _load_pyfftw() is not None else "numpy"
+
+def load_wisdom(path=None) -> bool:
+    """Import FFTW wisdom from the on-disk cache, returns True if anything was imported."""
+    _wisdom_state["loaded"] = True
+    pyfftw = _load_pyfftw()
+    if pyfftw is None:
+        return False
+    path = path or _settings["wisdom_file"]
+    try:
+        with open(path, "r", encoding="ascii") as f:
+            wisdom = tuple(w.encode("ascii") for w in json.load(f))
+    except (OSError, ValueError):
+        return False
+    return any(pyfftw.import_wisdom(wisdom))
+
+def save_wisdom(path=None) -> None:
+    """Export the accumulated FFTW wisdom to the on-disk cache (atomic replace)."""
+    pyfftw = _load_pyfftw()
+    if pyfftw is None:
+        return
+    path = path or _settings["wisdom_file"]
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="ascii") as f:
+        json.dump([w.decode("ascii") for w in pyfftw.export_wisdom()], f)
+    os.replace(tmp, path)
+    _wisdom_state["dirty"] = False
+
+@atexit.register
+def _save_wisdom_at_exit():
+    if _wisdom_state["dirty"]:
+        try:
+            save_wisdom()
+        except OSError:
+            pass
+
+def empty_aligned(shape, dtype="complex64"):
+    pyfftw = _load_pyfftw()
+    if pyfftw is not None:
+        return pyfftw.empty_aligned(shape, dtype=dtype)
+    return np.empty(shape, dtype=dtype)
+
+class NumpyFFT:
+    """numpy.fft stand-in exposing the pyfftw.FFTW calling convention."""
+
+    def __init__(self, shape, dtype, axes):
+        self.input_array = np.zeros(shape, dtype=dtype)
+        self.output_array = np.empty(shape, dtype=dtype)
+        self.axes = axes
+
+    def __call__(self):
+        self.output_array[...] = np.fft.fftn(self.input_array, axes=self.axes)
+        return self.output_array
+
+@functools.lru_cache(maxsize=PLAN_CACHE_SIZE)
+def _build_plan(shape, dtype, axes, threads, effort):
+    pyfftw = _load_pyfftw()
+    if pyfftw is None:
+        return NumpyFFT(shape, dtype, axes)
+    if not _wisdom_state["loaded"]:
+        load_wisdom()
+    with metrics.span("fftw.plan"):
+        fft_in = pyfftw.empty_aligned(shape, dtype=dtype)
+        fft_out = pyfftw.empty_aligned(shape, dtype=dtype)
+        plan = pyfftw.FFTW(fft_in, fft_out, axes=axes, threads=threads, flags=(PLANNER_EFFORTS[effort],))
+    if effort != "estimate":
+        _wisdom_state["dirty"] = True
+    return plan
+
+def get_plan(shape, dtype="complex64", axes=(-1,), threads=None, effort=None):
+    """Forward FFT plan with aligned input_array/output_array, cached by size, dtype and threads.
+
+    Cached plans share their buffers: fill input_array after getting the
+    plan (planning may overwrite it) and do not use the same plan from two
+    threads at once.
+    """
+    shape = (shape,) if isinstance(shape, int) else tuple(shape)
+    threads = threads or _settings["threads"]
+    effort = effort or _settings["effort"]
+    return _build_plan(shape, np.dtype(dtype).name, tuple(axes), threads, effort)
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""
+Multi-recipient Kyber512 keystore
+
+* Many keypairs (or public keys only) in one binary file
+* Memory-mapped, records indexed by their 4-byte key id
+* Parsed keys cached in process
+
+"""
+
+import os
+import sys
+import mmap
+import struct
+import base64
+import functools
+
+from pq_crypto import (
+    KEY_ID_LEN,
+    KYBER_PK_LEN,
+    KYBER_SK_LEN,
+    kyber_generate_keypair,
+    kyber_key_id,
+    kyber_load_key,
+)
+
+# header : magic (4) || version (1) || reserved (3) || count (4, little endian)
+# record : key_id (4) || flags (1) || reserved (3) || pk (800) || sk (1632, zeros if absent)
+MAGIC = b"SCKS"
+VERSION = 1
+HEADER = struct.Struct("<4sB3xI")
+RECORD_HEADER = struct.Struct("<4sB3x")
+RECORD_LEN = RECORD_HEADER.size + KYBER_PK_LEN + KYBER_SK_LEN
+FLAG_PRIVATE = 0x01
+KEYSTORE_FILE = os.environ.get("SECCW_KEYSTORE", "seccw.keys")
+
+class KeyStore:
+    """Read view of a keystore file plus an index {key_id: record offset}."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._public = {}
+        self._private = {}
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a SecCW keystore")
+        if len(self._mm) < HEADER.size + count * RECORD_LEN:
+            raise ValueError(f"{path} is truncated")
+        self.index = {}
+        for i in range(count):
+            offset = HEADER.size + i * RECORD_LEN
+            key_id, flags = RECORD_HEADER.unpack_from(self._mm, offset)
+            self.index[key_id] = (offset, flags)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key_id):
+        return key_id in self.index
+
+    def key_ids(self):
+        return list(self.index)
+
+    def has_private_key(self, key_id: bytes) -> bool:
+        return key_id in self.index and bool(self.index[key_id][1] & FLAG_PRIVATE)
+
+    def public_key(self, key_id: bytes) -> bytes:
+        if key_id not in self._public:
+            if key_id not in self.index:
+                raise KeyError(f"Unknown key id {key_id.hex()}")
+            offset = self.index[key_id][0] + RECORD_HEADER.size
+            self._public[key_id] = bytes(self._mm[offset:offset + KYBER_PK_LEN])
+        return self._public[key_id]
+
+    def private_key(self, key_id: bytes) -> bytes:
+        if key_id not in self._private:
+            if not self.has_private_key(key_id):
+                raise KeyError(f"No private key for key id {key_id.hex()}")
+            offset = self.index[key_id][0] + RECORD_HEADER.size + KYBER_PK_LEN
+            self._private[key_id] = bytes(self._mm[offset:offset + KYBER_SK_LEN])
+        return self._private[key_id]
+
+    def close(self):
+        self._mm.close()
+
+def create_keystore(path: str) -> None:
+    with open(path, "xb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, 0))
+
+def add_key(path: str, public_key: bytes, private_key: bytes = None) -> bytes:
+    """Append a public key (and optionally its private key) to the keystore, returns its key id."""
+    if len(public_key) != KYBER_PK_LEN or (private_key is not None and len(private_key) != KYBER_SK_LEN):
+        raise ValueError("Not a Kyber512 key")
+    if not os.path.exists(path):
+        create_keystore(path)
+    key_id = kyber_key_id(public_key)
+    with open(path, "r+b") as f:
+        magic, version, count = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a SecCW keystore")
+        for i in range(count):
+            f.seek(HEADER.size + i * RECORD_LEN)
+            if f.read(KEY_ID_LEN) == key_id:
+                raise ValueError(f"Key id {key_id.hex()} already in {path}")
+        flags = FLAG_PRIVATE if private_key is not None else 0
+        f.seek(HEADER.size + count * RECORD_LEN)
+        f.write(RECORD_HEADER.pack(key_id, flags) + public_key + (private_key or bytes(KYBER_SK_LEN)))
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, VERSION, count + 1))
+    return key_id
+
+@functools.lru_cache(maxsize=8)
+def _open_cached(path, mtime_ns, size):
+    return KeyStore(path)
+
+def open_keystore(path: str) -> KeyStore:
+    """Shared KeyStore for path, reopened only when the file changes."""
+    st = os.stat(path)
+    return _open_cached(os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+def parse_key_id(text: str) -> bytes:
+    key_id = bytes.fromhex(text)
+    if len(key_id) != KEY_ID_LEN:
+        raise ValueError(f"A key id is {2 * KEY_ID_LEN} hex characters")
+    return key_id
+
+def load_recipient_key(recipient: str) -> bytes:
+    """Public key of a recipient given as a Base64 key file or as a key id of KEYSTORE_FILE."""
+    if os.path.isfile(recipient) or not os.path.isfile(KEYSTORE_FILE):
+        return kyber_load_key(recipient)
+    return open_keystore(KEYSTORE_FILE).public_key(parse_key_id(recipient))
+
+def usage():
+    print("Usage:")
+    print("  python keystore.py gen <store>                        : new keypair")
+    print("  python keystore.py import <store> <pk.b64> [sk.b64]   : import Base64 key files")
+    print("  python keystore.py export <store> <key_id> <pk.b64>   : export a public key")
+    print("  python keystore.py list <store>")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        usage()
+        sys.exit(1)
+    cmd, store = sys.argv[1].lower(), sys.argv[2]
+
+    if cmd == "gen" and len(sys.argv) == 3:
+        pk, sk = kyber_generate_keypair()
+        print(f"[OUT] Key id {add_key(store, pk, sk).hex()} added to {store}")
+    elif cmd == "import" and len(sys.argv) in (4, 5):
+        sk = kyber_load_key(sys.argv[4]) if len(sys.argv) == 5 else None
+        print(f"[OUT] Key id {add_key(store, kyber_load_key(sys.argv[3]), sk).hex()} added to {store}")
+    elif cmd == "export" and len(sys.argv) == 5:
+        pk = open_keystore(store).public_key(parse_key_id(sys.argv[3]))
+        with open(sys.argv[4], "w", encoding="utf-8") as f:
+            f.write(base64.b64encode(pk).decode("ascii"))
+        print(f"[OUT] Public key saved : {sys.argv[4]}")
+    elif cmd == "list" and len(sys.argv) == 3:
+        ks = open_keystore(store)
+        for key_id in ks.key_ids():
+            print(f"{key_id.hex()}  {'keypair' if ks.has_private_key(key_id) else 'public'}")
+    else:
+        usage()
+        sys.exit(1)
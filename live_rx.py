@@ -0,0 +1,331 @@
+"""
+Live analysis of an IQ stream (stdin, a FIFO or a local socket)
+
+    rtl_sdr -f 144.05M -s 2.4M - | python ReadCS8.py - --live --format cu8
+    hackrf_transfer -r /tmp/iq.fifo ...  ;  python ReadCS8.py /tmp/iq.fifo --live
+
+Three threads share a preallocated byte ring:
+
+* the reader thread readinto()s the source straight into the ring and
+  never waits for the analysis;
+* the analyzer thread wakes at a fixed refresh rate, takes every sample
+  received since its last update (amplitude envelope, RMS, peak) and the
+  newest psd_samples of them for a rolling Welch PSD;
+* the caller (main thread) gets the latest LiveUpdate to print or plot.
+
+Backpressure never blocks the reader. Samples overwritten before the
+analyzer got to them are dropped and counted as overflow, and an update
+replaced before the caller took it is counted as a dropped update. Every
+received sample is either analyzed or counted as overflow.
+
+"""
+
+import sys
+import time
+import socket
+import threading
+from collections import namedtuple
+
+import numpy as np
+
+import metrics
+from CWToCS8 import IQ_FORMATS
+from ReadCS8 import Chunk, EnvelopeDecimator, EnvelopeSummary, WelchPSD
+
+RING_BYTES = 32 * 2**20
+FRAME_BYTES = 256 * 2**10
+REFRESH_HZ = 10.0
+PSD_SAMPLES = 2**16
+UPDATE_BUCKETS = 100
+HISTORY_SECONDS = 10.0
+
+LiveUpdate = namedtuple("LiveUpdate", ["time", "samples", "rms", "peak", "envelope", "freqs", "psd_db", "counters"])
+
+def open_source(spec):
+    """Binary stream with readinto() for '-' (stdin), unix:PATH, tcp:HOST:PORT, or a FIFO / file path."""
+    if spec == "-":
+        return open(sys.stdin.fileno(), "rb", buffering=0, closefd=False)
+    if spec.startswith("unix:"):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(spec[len("unix:"):])
+        return sock.makefile("rb", buffering=0)
+    if spec.startswith("tcp:"):
+        host, _, port = spec[len("tcp:"):].rpartition(":")
+        return socket.create_connection((host or "localhost", int(port))).makefile("rb", buffering=0)
+    return open(spec, "rb", buffering=0)
+
+class RingBuffer:
+    """Single-writer byte ring. Positions are absolute byte counts since the start of the stream.
+
+    The writer never waits: a reader that falls more than the capacity
+    behind loses the oldest bytes. read() checks the write position again
+    after copying, so bytes overwritten during the copy are discarded too.
+    """
+
+    def __init__(self, capacity=RING_BYTES, frame=FRAME_BYTES, align=2):
+        self.frame = frame - frame % align
+        self.capacity = max(capacity - capacity % self.frame, 2 * self.frame)
+        self.align = align
+        self.buffer = np.zeros(self.capacity, dtype=np.uint8)
+        self.view = memoryview(self.buffer)
+        self.written = 0
+
+    def fill_from(self, source):
+        """One readinto() of at most one frame from source, returns the byte count (0 at end of stream)."""
+        pos = self.written % self.capacity
+        n = source.readinto(self.view[pos:min(pos + self.frame, self.capacity)])
+        if n:
+            self.written += n
+        return n or 0
+
+    def read(self, since):
+        """(first, data) of the whole samples from since on still in the ring; first > since when bytes were lost."""
+        end = self.written
+        end -= end % self.align
+        # The frame being written may already overwrite the oldest bytes
+        first = max(since, end - self.capacity + self.frame)
+        first += -first % self.align
+        data = self._copy(first, end)
+        safe = self.written - self.capacity + self.frame
+        if safe > first:
+            cut = min(safe - first + -(safe - first) % self.align, len(data))
+            first, data = first + cut, data[cut:]
+        return first, data
+
+    def _copy(self, first, end):
+        if end <= first:
+            return np.empty(0, dtype=np.uint8)
+        a, b = first % self.capacity, end % self.capacity
+        if a < b:
+            return self.buffer[a:b].copy()
+        return np.concatenate((self.buffer[a:], self.buffer[:b]))
+
+class LiveMonitor:
+    """Reader and analyzer threads over a RingBuffer. Use start(), then updates() or wait(); stop() ends early."""
+
+    def __init__(self, source, sampling_rate=48000, fmt="cs8", refresh_hz=REFRESH_HZ, nfft=1024,
+                 psd_samples=PSD_SAMPLES, psd_average=0.3, ring_bytes=RING_BYTES, frame_bytes=FRAME_BYTES,
+                 buckets=UPDATE_BUCKETS, history_seconds=HISTORY_SECONDS):
+        self.source = source
+        self.sampling_rate = sampling_rate
+        self.fmt = fmt
+        self.dtype = IQ_FORMATS[fmt].dtype
+        self.sample_bytes = 2 * self.dtype.itemsize
+        self.period = 1 / refresh_hz
+        self.nfft = nfft
+        self.psd_samples = max(psd_samples, nfft)
+        self.psd_average = psd_average
+        self.buckets = buckets
+        self.history_seconds = history_seconds
+        self.ring = RingBuffer(ring_bytes, frame_bytes, self.sample_bytes)
+        self.counters = {"received_bytes": 0, "analyzed_samples": 0, "overflow_samples": 0, "overflows": 0,
+                         "updates": 0, "late_updates": 0, "dropped_updates": 0}
+        self.history = []
+        self.psd = None
+        self.freqs = None
+        self.error = None
+        self._read_pos = 0
+        self._latest = None
+        self._ready = threading.Condition()
+        self._eof = threading.Event()
+        self._stopped = threading.Event()
+        self._finished = threading.Event()
+
+    def start(self):
+        self._reader = threading.Thread(target=self._read_loop, name="live-reader", daemon=True)
+        self._analyzer = threading.Thread(target=self._analyze_loop, name="live-analyzer", daemon=True)
+        self._reader.start()
+        self._analyzer.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+
+    def _read_loop(self):
+        try:
+            while not self._stopped.is_set():
+                n = self.ring.fill_from(self.source)
+                if not n:
+                    break
+                metrics.count("live.read", bytes=n)
+        except (OSError, ValueError) as e:
+            if not self._stopped.is_set():
+                self.error = e
+        finally:
+            self._eof.set()
+
+    def _analyze_loop(self):
+        try:
+            deadline = time.perf_counter()
+            while True:
+                deadline += self.period
+                delay = deadline - time.perf_counter()
+                if delay > 0:
+                    self._eof.wait(delay)
+                else:
+                    self.counters["late_updates"] += 1
+                    deadline = time.perf_counter()
+                final = self._eof.is_set() or self._stopped.is_set()
+                self._publish(self.analyze())
+                if final:
+                    break
+        except Exception as e:
+            self.error = e
+        finally:
+            self._finished.set()
+            with self._ready:
+                self._ready.notify_all()
+
+    def analyze(self):
+        """Consume what the reader added since the last call, returns the LiveUpdate (None if nothing new)."""
+        with metrics.span("live.update") as s:
+            first, data = self.ring.read(self._read_pos)
+            counters = self.counters
+            counters["received_bytes"] = self.ring.written
+            lost = (first - self._read_pos) // self.sample_bytes
+            if lost:
+                counters["overflow_samples"] += lost
+                counters["overflows"] += 1
+            self._read_pos = first + len(data)
+            raw = data.view(self.dtype)
+            n = len(raw) // 2
+            if n == 0:
+                return None
+            s.add(bytes=len(data), samples=n)
+            start = first // self.sample_bytes
+            chunk = Chunk(0, raw, self.fmt)
+
+            decimator = EnvelopeDecimator(self.buckets)
+            decimator.start(n)
+            decimator.feed(chunk)
+            envelope = decimator.finish()
+            envelope = envelope._replace(start=envelope.start + start)
+            self.history.append(envelope)
+            keep = start + n - int(self.history_seconds * self.sampling_rate)
+            while len(self.history) > 1 and self.history[1].start[0] <= keep:
+                self.history.pop(0)
+
+            tail = Chunk(0, raw[-2 * self.psd_samples:], self.fmt)
+            if len(tail) >= self.nfft:
+                psd = WelchPSD(self.sampling_rate, self.nfft)
+                psd.start(len(tail))
+                psd.feed(tail)
+                self.freqs, psd_db, _ = psd.finish()
+                power = 10 ** (psd_db / 10)
+                self.psd = power if self.psd is None else (1 - self.psd_average) * self.psd + self.psd_average * power
+
+            counters["analyzed_samples"] += n
+            counters["updates"] += 1
+            magnitude = chunk.magnitude
+            rms = float(np.sqrt(np.mean(np.square(magnitude, dtype=np.float32), dtype=np.float64)))
+            psd_db = None if self.psd is None else 10 * np.log10(np.maximum(self.psd, 1e-20))
+            return LiveUpdate((start + n) / self.sampling_rate, start + n, rms, float(magnitude.max()),
+                              envelope, self.freqs, psd_db, dict(counters))
+
+    def _publish(self, update):
+        if update is None:
+            return
+        with self._ready:
+            if self._latest is not None:
+                self.counters["dropped_updates"] += 1
+            self._latest = update
+            self._ready.notify_all()
+
+    def next_update(self, timeout=None):
+        """The latest update not yet taken, waiting for one; None once the stream has ended."""
+        with self._ready:
+            self._ready.wait_for(lambda: self._latest is not None or self._finished.is_set(), timeout)
+            update, self._latest = self._latest, None
+            return update
+
+    def updates(self):
+        while True:
+            update = self.next_update()
+            if update is None:
+                return
+            yield update
+
+    def wait(self, timeout=None):
+        """Wait for the end of the stream (or stop()), returns the counters."""
+        self._finished.wait(timeout)
+        return dict(self.counters)
+
+    def envelope_history(self):
+        """EnvelopeSummary of the last history_seconds, for plot_amplitude."""
+        if not self.history:
+            return None
+        return EnvelopeSummary(*(np.concatenate(parts) for parts in zip(*self.history)))
+
+def format_update(update):
+    c = update.counters
+    line = f"[i] {update.time:8.2f} s  RMS {update.rms:6.1f}  peak {update.peak:6.1f}"
+    if update.psd_db is not None:
+        line += f"  peak bin {update.freqs[update.psd_db.argmax()]:+9.1f} Hz"
+    return line + f"  overflow {c['overflow_samples']} samples ({c['overflows']}x)  dropped updates {c['dropped_updates']}"
+
+class LivePlot:
+    """Interactive figure (amplitude history and rolling PSD) refreshed from the main thread."""
+
+    def __init__(self, sampling_rate):
+        from ReadCS8 import _pyplot
+
+        self.plt = _pyplot()
+        self.sampling_rate = sampling_rate
+        self.plt.ion()
+        self.figure, (self.amp_ax, self.psd_ax) = self.plt.subplots(2, 1, figsize=(10, 7))
+        self.amp_line, = self.amp_ax.plot([], [], linewidth=0.8)
+        self.psd_line, = self.psd_ax.plot([], [], linewidth=0.8)
+        self.amp_ax.set_xlabel("Time (s)")
+        self.amp_ax.set_ylabel("Amplitude")
+        self.psd_ax.set_xlabel("Frequency (Hz)")
+        self.psd_ax.set_ylabel("PSD (dB/Hz)")
+
+    def update(self, monitor, update):
+        envelope = monitor.envelope_history()
+        self.amp_line.set_data(envelope.start / self.sampling_rate, envelope.amp_max)
+        if update.psd_db is not None:
+            self.psd_line.set_data(update.freqs, update.psd_db)
+        for ax in (self.amp_ax, self.psd_ax):
+            ax.relim()
+            ax.autoscale_view()
+        self.plt.pause(0.001)
+
+def run_live(spec, sampling_rate=48000, fmt="cs8", refresh_hz=REFRESH_HZ, nfft=1024, duration=None, plot=False,
+             save=False, prefix="live_"):
+    """Monitor a live stream until its end, duration seconds or Ctrl-C, returns the counters."""
+    from ReadCS8 import plot_amplitude, plot_psd
+
+    source = open_source(spec)
+    monitor = LiveMonitor(source, sampling_rate, fmt, refresh_hz, nfft).start()
+    live_plot = LivePlot(sampling_rate) if plot else None
+    t0 = time.perf_counter()
+    last = None
+    try:
+        for update in monitor.updates():
+            last = update
+            if live_plot:
+                live_plot.update(monitor, update)
+            else:
+                print(format_update(update), flush=True)
+            if duration is not None and time.perf_counter() - t0 >= duration:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        monitor.stop()
+        # A blocking read only returns with data or at the end of the stream
+        if spec != "-":
+            source.close()
+    counters = monitor.wait(1.0)
+    elapsed = time.perf_counter() - t0
+    received = counters["received_bytes"] // monitor.sample_bytes
+    print(f"[OUT] {received} samples received in {elapsed:.2f} s ({received / max(elapsed, 1e-9) / 1e6:.2f} MS/s),"
+          f" {counters['overflow_samples']} lost in {counters['overflows']} overflow(s),"
+          f" {counters['dropped_updates']} update(s) dropped, {counters['late_updates']} late")
+    if monitor.error:
+        print(f"[!] Error (live):\n{monitor.error}")
+    if save and last is not None:
+        plot_amplitude(monitor.envelope_history(), sampling_rate, save=True, prefix=prefix)
+        if last.psd_db is not None:
+            plot_psd(last.freqs, last.psd_db, save=True, prefix=prefix)
+    return counters
@@ -0,0 +1,271 @@
+"""
+Per-stage timing and counters for the TX and RX chains
+
+    with metrics.span("kyber.encaps"):
+        ...
+    with metrics.span("iq.write") as s:
+        s.add(bytes=len(data), samples=n)
+
+Each stage accumulates calls, seconds, bytes, samples and its peak traced
+memory (tracemalloc, numpy buffers included). Times are inclusive: a stage
+also counts the stages it calls (e.g. cw.keying of an encrypted stream
+includes its aes_gcm.encrypt).
+
+Profiling is off unless SECCW_PROFILE is set or a CLI passes --profile;
+when off, span() returns a shared no-op object and timed_iter() returns
+its iterable untouched.
+
+The report goes to SECCW_PROFILE_REPORT (or --profile-report) at exit: a
+.prom path is written as a Prometheus textfile, any other path as JSON,
+'-' prints a table on stderr.
+
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import platform
+import tracemalloc
+
+def _env_enabled():
+    return os.environ.get("SECCW_PROFILE", "").lower() not in ("", "0", "false", "no")
+
+_settings = {
+    "enabled": _env_enabled(),
+    "memory": os.environ.get("SECCW_PROFILE_MEMORY", "1") != "0",
+    "report": os.environ.get("SECCW_PROFILE_REPORT") or "-",
+}
+_stages = {}
+# Active spans as [traced bytes at entry, highest traced bytes seen], innermost last
+_memory_stack = []
+_started = time.time()
+
+def configure(enabled=None, memory=None, report=None):
+    """Turn profiling on or off, with or without memory tracing, and set the report path."""
+    if enabled is not None:
+        _settings["enabled"] = bool(enabled)
+    if memory is not None:
+        _settings["memory"] = bool(memory)
+    if report is not None:
+        _settings["report"] = report
+    tracing = _settings["enabled"] and _settings["memory"]
+    if tracing and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _settings["started_tracing"] = True
+    elif not tracing and _settings.pop("started_tracing", False):
+        tracemalloc.stop()
+
+def enabled() -> bool:
+    return _settings["enabled"]
+
+def _stage(name):
+    stage = _stages.get(name)
+    if stage is None:
+        stage = _stages[name] = {"calls": 0, "seconds": 0.0, "bytes": 0, "samples": 0, "peak_memory": 0}
+    return stage
+
+def count(name, bytes=0, samples=0, calls=1):
+    """Add to the counters of a stage without timing it."""
+    if not _settings["enabled"]:
+        return
+    stage = _stage(name)
+    stage["calls"] += calls
+    stage["bytes"] += bytes
+    stage["samples"] += samples
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add(self, bytes=0, samples=0):
+        pass
+
+_NULL_SPAN = _NullSpan()
+
+class Span:
+    """Times a stage, and its peak memory above the level at entry when tracing."""
+
+    def __init__(self, name, bytes=0, samples=0):
+        self.name = name
+        self.bytes = bytes
+        self.samples = samples
+
+    def add(self, bytes=0, samples=0):
+        self.bytes += bytes
+        self.samples += samples
+
+    def __enter__(self):
+        self.tracing = tracemalloc.is_tracing()
+        if self.tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if _memory_stack:
+                _memory_stack[-1][1] = max(_memory_stack[-1][1], peak)
+            tracemalloc.reset_peak()
+            _memory_stack.append([current, current])
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        stage = _stage(self.name)
+        stage["calls"] += 1
+        stage["seconds"] += elapsed
+        stage["bytes"] += self.bytes
+        stage["samples"] += self.samples
+        if self.tracing and _memory_stack:
+            entry, highest = _memory_stack.pop()
+            highest = max(highest, tracemalloc.get_traced_memory()[1])
+            stage["peak_memory"] = max(stage["peak_memory"], highest - entry)
+            if _memory_stack:
+                _memory_stack[-1][1] = max(_memory_stack[-1][1], highest)
+        return False
+
+def span(name, bytes=0, samples=0):
+    """Context manager timing one call of a stage (a no-op when profiling is off)."""
+    if not _settings["enabled"]:
+        return _NULL_SPAN
+    return Span(name, bytes, samples)
+
+def timed_iter(name, iterable, samples=len, bytes=None):
+    """Time each step of an iterator as a call of stage name, counting samples(item) and bytes(item)."""
+    if not _settings["enabled"]:
+        return iterable
+    return _timed_iter(name, iterable, samples, bytes)
+
+def _timed_iter(name, iterable, samples, bytes):
+    iterator = iter(iterable)
+    while True:
+        with Span(name) as s:
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            s.add(bytes=bytes(item) if bytes else 0, samples=samples(item) if samples else 0)
+        yield item
+
+def snapshot():
+    """Copy of the per-stage counters, e.g. to send them back from a worker process."""
+    return {name: dict(stage) for name, stage in _stages.items()}
+
+def reset():
+    _stages.clear()
+
+def take_snapshot():
+    """snapshot() then reset(), None when off: a worker sends each job's counters once, for merge() in the parent."""
+    if not _settings["enabled"]:
+        return None
+    stages = snapshot()
+    reset()
+    return stages
+
+def merge(stages):
+    """Add the counters of a snapshot() taken elsewhere (peak memory is a max)."""
+    for name, other in (stages or {}).items():
+        stage = _stage(name)
+        for key, value in other.items():
+            stage[key] = max(stage[key], value) if key == "peak_memory" else stage[key] + value
+
+def report():
+    return {
+        "meta": {
+            "command": " ".join(os.path.basename(a) if i == 0 else a for i, a in enumerate(sys.argv)),
+            "pid": os.getpid(),
+            "started": _started,
+            "wall_seconds": time.time() - _started,
+            "python": platform.python_version(),
+            "memory_traced": tracemalloc.is_tracing(),
+        },
+        "stages": snapshot(),
+    }
+
+_PROMETHEUS_METRICS = [
+    ("calls", "seccw_stage_calls_total", "counter", "Calls of each stage"),
+    ("seconds", "seccw_stage_seconds_total", "counter", "Time spent in each stage"),
+    ("bytes", "seccw_stage_bytes_total", "counter", "Bytes processed by each stage"),
+    ("samples", "seccw_stage_samples_total", "counter", "IQ samples processed by each stage"),
+    ("peak_memory", "seccw_stage_peak_memory_bytes", "gauge", "Peak traced memory above the stage entry level"),
+]
+
+def to_prometheus(result) -> str:
+    lines = []
+    for key, name, kind, help_text in _PROMETHEUS_METRICS:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for stage, values in sorted(result["stages"].items()):
+            lines.append(f'{name}{{stage="{stage}"}} {values[key]}')
+    lines.append("# HELP seccw_run_wall_seconds Wall time of the run")
+    lines.append("# TYPE seccw_run_wall_seconds gauge")
+    lines.append(f"seccw_run_wall_seconds {result['meta']['wall_seconds']}")
+    return "\n".join(lines) + "\n"
+
+def format_table(result) -> str:
+    lines = [f"[i] Profile ({result['meta']['wall_seconds']:.3f} s wall)"]
+    for name, s in sorted(result["stages"].items(), key=lambda kv: -kv[1]["seconds"]):
+        lines.append(f"[i] {name:<20} {s['calls']:7d} calls {s['seconds']:9.4f} s"
+                     f" {s['bytes']:12d} B {s['samples']:12d} samples {s['peak_memory'] / 2**20:8.2f} MB peak")
+    return "\n".join(lines)
+
+def write_report(path=None) -> None:
+    """Write the report to path (default: the configured one), atomically for files."""
+    path = path or _settings["report"]
+    result = report()
+    if path == "-":
+        print(format_table(result), file=sys.stderr)
+        return
+    text = to_prometheus(result) if path.endswith(".prom") else json.dumps(result, indent=2)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+@atexit.register
+def _write_report_at_exit():
+    if _settings["enabled"] and _stages:
+        try:
+            write_report()
+        except OSError as e:
+            print(f"[!] Profile report not written: {e}", file=sys.stderr)
+
+def add_profile_argument(parser) -> None:
+    parser.add_argument("--profile", action="store_true",
+                        help="Profile the stages, report on stderr unless --profile-report is given",)
+    parser.add_argument("--profile-report", default=None, metavar="REPORT",
+                        help="Write the profile to REPORT (.prom: Prometheus textfile, else JSON), implies --profile",)
+
+def configure_from_args(args) -> None:
+    if getattr(args, "profile", False) or getattr(args, "profile_report", None):
+        configure(enabled=True, report=getattr(args, "profile_report", None))
+
+def pop_profile_argument(argv) -> None:
+    """Remove --profile and --profile-report REPORT (or =REPORT) from a hand-parsed argv, enable profiling if present."""
+    enabled = False
+    report = None
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        if arg == "--profile":
+            enabled = True
+            del argv[i]
+        elif arg == "--profile-report" and i + 1 < len(argv):
+            enabled = True
+            report = argv[i + 1]
+            del argv[i:i + 2]
+        elif arg.startswith("--profile-report="):
+            enabled = True
+            report = arg.partition("=")[2]
+            del argv[i]
+        else:
+            i += 1
+    if enabled:
+        configure(enabled=True, report=report)
+
+if _settings["enabled"]:
+    configure()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+Morse-airtime binary-to-text encoding
+
+Bytes are turned into a bit stream and cut into prefix-free codewords,
+each sent as one character. Cheap Morse characters get short codewords
+(E carries 2 bits, I and T 3 bits, ... 8 bits for the most expensive
+ones). Only upper-case letters and digits are used, so the convert_to_CW
+case folding is harmless. Random data costs about 15.8 Morse units per
+byte, against 16.4 for Base64, which does not survive case folding anyway.
+
+"""
+
+import numpy as np
+
+import metrics
+from CWToCS8 import CHARACTER_TO_SYMBOLS_MAP
+
+# Characters by increasing airtime, with their codeword length in bits.
+# The lengths satisfy Kraft's equality and minimize airtime per bit.
+ALPHABET = "EITANSDHMRUBFGKLVW5COPXZ46JQY37"
+CODE_LENGTHS = (2, 3, 3, 4, 4, 4, 5, 5, 5, 5, 5, 6, 6, 6, 6, 6, 6, 7, 7,
+                8, 8, 8, 8, 8, 8, 8, 8, 8, 8, 8, 8)
+MAX_CODE_LENGTH = 8
+
+def morse_units(character: str) -> int:
+    """Airtime of one character as keyed by convert_to_CW, letter gap included."""
+    symbols = CHARACTER_TO_SYMBOLS_MAP[character]
+    return sum(1 if s == '.' else 3 for s in symbols) + len(symbols) + 2
+
+def _canonical_codes():
+    codes = []
+    code = 0
+    previous = CODE_LENGTHS[0]
+    for length in CODE_LENGTHS:
+        code <<= length - previous
+        codes.append(code)
+        code += 1
+        previous = length
+    return codes
+
+_tables = {}
+
+def _get_tables():
+    if not _tables:
+        codes = _canonical_codes()
+        # Any MAX_CODE_LENGTH-bit window starts with exactly one codeword.
+        window_letter = np.empty(1 << MAX_CODE_LENGTH, dtype=np.uint8)
+        window_length = np.empty(1 << MAX_CODE_LENGTH, dtype=np.int64)
+        # Each letter's codeword left-aligned in a byte, for decoding.
+        letter_code = np.zeros(256, dtype=np.uint8)
+        letter_length = np.zeros(256, dtype=np.int64)
+        for character, code, length in zip(ALPHABET, codes, CODE_LENGTHS):
+            shift = MAX_CODE_LENGTH - length
+            window_letter[code << shift:(code + 1) << shift] = ord(character)
+            window_length[code << shift:(code + 1) << shift] = length
+            letter_code[ord(character)] = code << shift
+            letter_length[ord(character)] = length
+            letter_length[ord(character.lower())] = length
+            letter_code[ord(character.lower())] = code << shift
+        _tables.update(window_letter=window_letter, window_length=window_length,
+                       letter_code=letter_code, letter_length=letter_length)
+    return _tables
+
+def cw_encode(data: bytes) -> str:
+    """Encode bytes as a string of cheap Morse characters."""
+    if not data:
+        return ""
+    with metrics.span("morse_text.encode", bytes=len(data)):
+        return _cw_encode(data)
+
+def _cw_encode(data: bytes) -> str:
+    tables = _get_tables()
+    bits = np.unpackbits(np.frombuffer(data, dtype=np.uint8))
+    n = len(bits)
+    padded = np.concatenate((bits, np.zeros(MAX_CODE_LENGTH, dtype=np.uint8)))
+    windows = np.packbits(np.lib.stride_tricks.sliding_window_view(padded, MAX_CODE_LENGTH)[:n], axis=1)[:, 0]
+
+    # The codeword at every bit offset is known, only the walk over the
+    # codeword starts is sequential. The last codeword may read past the
+    # end into zero padding, less than a byte that cw_decode drops.
+    lengths = tables["window_length"][windows].tolist()
+    starts = []
+    position = 0
+    while position < n:
+        starts.append(position)
+        position += lengths[position]
+    return tables["window_letter"][windows[starts]].tobytes().decode("ascii")
+
+def cw_decode(text: str) -> bytes:
+    """Decode a cw_encode string (case insensitive)."""
+    if not text:
+        return b""
+    with metrics.span("morse_text.decode", bytes=len(text)):
+        return _cw_decode(text)
+
+def _cw_decode(text: str) -> bytes:
+    tables = _get_tables()
+    try:
+        letters = np.frombuffer(text.encode("ascii"), dtype=np.uint8)
+    except UnicodeEncodeError:
+        raise ValueError("Invalid character in Morse-encoded data")
+    lengths = tables["letter_length"][letters]
+    if not lengths.all():
+        raise ValueError("Invalid character in Morse-encoded data")
+    code_bits = np.unpackbits(tables["letter_code"][letters][:, None], axis=1)
+    bits = code_bits[np.arange(MAX_CODE_LENGTH) < lengths[:, None]]
+    n_bytes = len(bits) // 8
+    return np.packbits(bits[:8 * n_bytes]).tobytes()
+
+def airtime_units(text: str) -> int:
+    """Morse units needed to key text (letter gaps included, framing excluded)."""
+    return sum(morse_units(c) for c in text.upper())
@@ -0,0 +1,110 @@
+"""
+Payload compression before encryption
+
+compressed payload : flag (1) || body
+
+* flag 0x00 : stored, body is the message
+* flag 0x01 : raw deflate primed with SECCW_DICTIONARY_V1
+* flag 0x02 : raw deflate, no dictionary
+* flag 0x78 : legacy zlib stream (decode only, the flag is the zlib header)
+
+Raw deflate has no header or checksum (AES-GCM authenticates the payload).
+The sender tries the codecs and keeps the smallest output, stored included,
+so a short message never grows by more than the flag byte.
+
+"""
+
+import zlib
+
+import metrics
+
+FLAG_STORED = 0x00
+FLAG_DEFLATE_DICT_V1 = 0x01
+FLAG_DEFLATE = 0x02
+FLAG_LEGACY_ZLIB = 0x78
+MAX_PAYLOAD_LEN = 1 << 24
+SHORT_MESSAGE_LEN = 4096
+
+# Preset dictionary built from typical operator traffic. deflate reaches
+# back 32 KB and codes near matches cheaper, so the most frequent strings
+# go last. Never edit it: a new dictionary needs a new flag.
+SECCW_DICTIONARY_V1 = (
+    b"0123456789 ABCDEFGHIJKLMNOPQRSTUVWXYZ abcdefghijklmnopqrstuvwxyz "
+    b"frequency MHz kHz antenna power watts signal report weather wind rain "
+    b"position latitude longitude north south east west heading speed altitude "
+    b"time UTC date tomorrow today tonight morning evening hour minutes "
+    b"received confirmed acknowledge repeat again please thank you "
+    b"bonjour merci message recu confirme rendez-vous demain heure position "
+    b"test batch message post-quantum Kyber512 AES-GCM Morse CW SecCW "
+    b"QRA QRG QRK QRL QRM QRN QRO QRP QRQ QRS QRT QRU QRV QRX QRZ QSB QSL QSO QSY QTH QTR "
+    b"RST 599 5NN TU FB OM YL XYL GM GA GE GN HR HW WX ANT PWR RIG ES FER UR "
+    b"BK KN SK AR AS CQ CQ CQ DE K 73 88 "
+    b"Hello, world! the and for with from to of in on at is are was "
+    b"Hello RF world CQ DE QSL 73 "
+)
+
+class PayloadCodec:
+    """One compression method, identified on the wire by its flag byte."""
+
+    def __init__(self, flag: int, name: str, compress, decompress):
+        self.flag = flag
+        self.name = name
+        self.compress = compress
+        self.decompress = decompress
+
+def _deflate(zdict=None, level=9):
+    def compress(message: bytes) -> bytes:
+        # A small memLevel makes setup 5x cheaper and costs nothing below a few KB
+        mem_level = 4 if len(message) < SHORT_MESSAGE_LEN else 9
+        c = zlib.compressobj(level, zlib.DEFLATED, -15, mem_level, zlib.Z_DEFAULT_STRATEGY, *([zdict] if zdict else []))
+        return c.compress(message) + c.flush()
+
+    def decompress(body: bytes) -> bytes:
+        d = zlib.decompressobj(-15, *([zdict] if zdict else []))
+        message = d.decompress(body, MAX_PAYLOAD_LEN)
+        if d.unconsumed_tail or not d.eof:
+            raise ValueError("Invalid or oversized compressed payload")
+        return message
+    return compress, decompress
+
+def _legacy_zlib_decompress(body: bytes) -> bytes:
+    d = zlib.decompressobj()
+    message = d.decompress(bytes([FLAG_LEGACY_ZLIB]) + body, MAX_PAYLOAD_LEN)
+    if d.unconsumed_tail or not d.eof:
+        raise ValueError("Invalid or oversized compressed payload")
+    return message
+
+CODECS = {}
+DEFAULT_CODECS = []
+
+def register_codec(codec: PayloadCodec, default: bool = True) -> None:
+    """Make a codec decodable, and tried by compress_payload if default."""
+    if codec.flag in CODECS:
+        raise ValueError(f"Payload flag 0x{codec.flag:02x} already used by {CODECS[codec.flag].name}")
+    CODECS[codec.flag] = codec
+    if default and codec.compress is not None:
+        DEFAULT_CODECS.append(codec)
+
+register_codec(PayloadCodec(FLAG_STORED, "stored", bytes, bytes), default=False)
+register_codec(PayloadCodec(FLAG_DEFLATE_DICT_V1, "deflate-dict-v1", *_deflate(SECCW_DICTIONARY_V1)))
+register_codec(PayloadCodec(FLAG_DEFLATE, "deflate", *_deflate()))
+register_codec(PayloadCodec(FLAG_LEGACY_ZLIB, "zlib", None, _legacy_zlib_decompress), default=False)
+
+def compress_payload(message: bytes, codecs=None) -> bytes:
+    """Smallest of the candidate codecs (DEFAULT_CODECS) and stored, with its flag."""
+    with metrics.span("compress", bytes=len(message)):
+        best_flag, best = FLAG_STORED, message
+        for codec in DEFAULT_CODECS if codecs is None else codecs:
+            body = codec.compress(message)
+            if len(body) < len(best):
+                best_flag, best = codec.flag, body
+        return bytes([best_flag]) + best
+
+def decompress_payload(data: bytes) -> bytes:
+    if not data:
+        raise ValueError("Empty compressed payload")
+    codec = CODECS.get(data[0])
+    if codec is None:
+        raise ValueError(f"Unknown payload flag 0x{data[0]:02x}")
+    with metrics.span("decompress", bytes=len(data)):
+        return codec.decompress(data[1:])
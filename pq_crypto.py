@@ -1,14 +1,19 @@
 import os
 import base64
-import zlib
+import hashlib
+from collections import OrderedDict
 
 from kyber_py.kyber import Kyber512
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 from cryptography.hazmat.primitives import hashes
 
+import metrics
+from payload_codecs import compress_payload, decompress_payload
+
 def kyber_generate_keypair():
-    public_key, private_key = Kyber512.keygen()
+    with metrics.span("kyber.keygen"):
+        public_key, private_key = Kyber512.keygen()
     return public_key, private_key
 
 def kyber_save_key(key: bytes, filename: str) -> None:
@@ -21,17 +26,37 @@ def kyber_load_key(filename: str) -> bytes:
     return base64.b64decode(data)
 
 def kyber_encapsulate(public_key: bytes):
-    shared_secret, ciphertext = Kyber512.encaps(public_key)
+    with metrics.span("kyber.encaps"):
+        shared_secret, ciphertext = Kyber512.encaps(public_key)
     return ciphertext, shared_secret
 
 def kyber_decapsulate(ciphertext: bytes, private_key: bytes):
-    shared_secret = Kyber512.decaps(private_key, ciphertext)
+    with metrics.span("kyber.decaps"):
+        shared_secret = Kyber512.decaps(private_key, ciphertext)
     return shared_secret
 
-_tmp_pk, _tmp_sk = Kyber512.keygen()
-_tmp_ss, _tmp_ct = Kyber512.encaps(_tmp_pk)
-KYBER_CT_LEN = len(_tmp_ct)
-del _tmp_pk, _tmp_sk, _tmp_ss, _tmp_ct
+# Kyber512 sizes (FIPS 203 ML-KEM-512), fixed by the parameter set.
+KYBER_PK_LEN = 800
+KYBER_SK_LEN = 1632
+KYBER_CT_LEN = 768
+KYBER_PK_OFFSET_IN_SK = 768
+KEY_ID_LEN = 4
+
+def kyber_key_id(public_key: bytes) -> bytes:
+    """Short fingerprint of a public key, carried in the wire format to pick the decryption key."""
+    return hashlib.sha256(public_key).digest()[:KEY_ID_LEN]
+
+def kyber_private_key_id(private_key: bytes) -> bytes:
+    # A Kyber secret key embeds its public key.
+    return kyber_key_id(private_key[KYBER_PK_OFFSET_IN_SK:KYBER_PK_OFFSET_IN_SK + KYBER_PK_LEN])
+
+def resolve_private_key(private_key, key_id: bytes) -> bytes:
+    """private_key is either a secret key (bytes) or a keystore with a private_key(key_id) lookup."""
+    if isinstance(private_key, (bytes, bytearray)):
+        if kyber_private_key_id(private_key) != key_id:
+            raise ValueError(f"Message is for key id {key_id.hex()}, not this private key")
+        return private_key
+    return private_key.private_key(key_id)
 
 def derive_aes_key(shared_secret: bytes) -> bytes:
     hkdf = HKDF(
@@ -42,41 +67,190 @@ def derive_aes_key(shared_secret: bytes) -> bytes:
     )
     return hkdf.derive(shared_secret)
 
+# wire format : key_id (4) || kyber_ct (768) || nonce (12) || AES-GCM(ct + tag)
 def pq_encrypt(message: bytes, public_key: bytes) -> bytes:
     kyber_ct, shared_secret = kyber_encapsulate(public_key)
     aes_key = derive_aes_key(shared_secret)
     aesgcm = AESGCM(aes_key)
     nonce = os.urandom(12)
-    aes_ct = aesgcm.encrypt(nonce, message, None)
+    with metrics.span("aes_gcm.encrypt", bytes=len(message)):
+        aes_ct = aesgcm.encrypt(nonce, message, None)
     
-    return kyber_ct + nonce + aes_ct
+    return kyber_key_id(public_key) + kyber_ct + nonce + aes_ct
 
-def pq_decrypt(data: bytes, private_key: bytes) -> bytes:
-    kyber_ct = data[:KYBER_CT_LEN]
-    nonce = data[KYBER_CT_LEN:KYBER_CT_LEN + 12]
-    aes_ct = data[KYBER_CT_LEN + 12:]
+def pq_decrypt(data: bytes, private_key) -> bytes:
+    key_id = data[:KEY_ID_LEN]
+    kyber_ct = data[KEY_ID_LEN:KEY_ID_LEN + KYBER_CT_LEN]
+    nonce = data[KEY_ID_LEN + KYBER_CT_LEN:KEY_ID_LEN + KYBER_CT_LEN + 12]
+    aes_ct = data[KEY_ID_LEN + KYBER_CT_LEN + 12:]
 
+    private_key = resolve_private_key(private_key, key_id)
     shared_secret = kyber_decapsulate(kyber_ct, private_key)
     aes_key = derive_aes_key(shared_secret)
     aesgcm = AESGCM(aes_key)
-    return aesgcm.decrypt(nonce, aes_ct, None)
+    with metrics.span("aes_gcm.decrypt", bytes=len(aes_ct)):
+        return aesgcm.decrypt(nonce, aes_ct, None)
 
 def pq_encrypt_compressed(message: bytes, public_key: bytes) -> bytes:
-    compressed = zlib.compress(message)
+    compressed = compress_payload(message)
     return pq_encrypt(compressed, public_key)
 
-def pq_decrypt_compressed(data: bytes, private_key: bytes) -> bytes:
+def pq_decrypt_compressed(data: bytes, private_key) -> bytes:
     compressed = pq_decrypt(data, private_key)
-    return zlib.decompress(compressed)
+    return decompress_payload(compressed)
 
 def pq_encrypt_compressed_b64(message: bytes, public_key: bytes) -> bytes:
     data = pq_encrypt_compressed(message, public_key)
-    return base64.b64encode(data).decode("ascii")
+    with metrics.span("base64.encode", bytes=len(data)):
+        return base64.b64encode(data).decode("ascii")
 
-def pq_decrypt_compressed_b64(cipher_b64: bytes, private_key: bytes) -> bytes:
-    data = base64.b64decode(cipher_b64.encode("ascii"))
+def pq_decrypt_compressed_b64(cipher_b64: bytes, private_key) -> bytes:
+    with metrics.span("base64.decode", bytes=len(cipher_b64)):
+        data = base64.b64decode(cipher_b64.encode("ascii"))
     return pq_decrypt_compressed(data, private_key)
 
+# Morse-airtime text encoding (see morse_codec), survives the upper-casing
+# of convert_to_CW and keys faster than Base64.
+def pq_encrypt_compressed_cw(message: bytes, public_key: bytes) -> str:
+    from morse_codec import cw_encode
+    return cw_encode(pq_encrypt_compressed(message, public_key))
+
+def pq_decrypt_compressed_cw(cipher_cw: str, private_key) -> bytes:
+    from morse_codec import cw_decode
+    return pq_decrypt_compressed(cw_decode(cipher_cw), private_key)
+
+# Session mode: one Kyber encapsulation, then many short messages.
+# init message    : key_id (4) || kyber_ct (768), sent once
+# session message : session_id (4) || counter (4, big endian) || AES-GCM(ct + tag)
+# The session id is the start of SHA-256(kyber_ct); the AES key and an
+# 8-byte nonce prefix come from HKDF, the nonce is prefix || counter and
+# the 8-byte header is authenticated as associated data.
+SESSION_ID_LEN = 4
+SESSION_COUNTER_LEN = 4
+SESSION_HEADER_LEN = SESSION_ID_LEN + SESSION_COUNTER_LEN
+SESSION_CACHE_SIZE = 64
+# Counters accepted out of order behind the highest one seen (RFC 4303 style)
+SESSION_REPLAY_WINDOW = 1024
+
+def session_id(kyber_ct: bytes) -> bytes:
+    return hashlib.sha256(kyber_ct).digest()[:SESSION_ID_LEN]
+
+def derive_session_keys(shared_secret: bytes):
+    hkdf = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32 + 12 - SESSION_COUNTER_LEN,
+        salt=None,
+        info=b"SecCW-Kyber-Session-AES256GCM",
+    )
+    material = hkdf.derive(shared_secret)
+    return material[:32], material[32:]
+
+class PQSession:
+    """Sender side of a session: encapsulate once, encrypt many messages."""
+
+    def __init__(self, public_key: bytes):
+        self.key_id = kyber_key_id(public_key)
+        self.kyber_ct, shared_secret = kyber_encapsulate(public_key)
+        self.session_id = session_id(self.kyber_ct)
+        aes_key, self.nonce_prefix = derive_session_keys(shared_secret)
+        self.aesgcm = AESGCM(aes_key)
+        self.counter = 0
+
+    @property
+    def init_message(self) -> bytes:
+        return self.key_id + self.kyber_ct
+
+    def encrypt(self, message: bytes) -> bytes:
+        if self.counter >= 1 << (8 * SESSION_COUNTER_LEN):
+            raise OverflowError("Session counter exhausted, open a new session")
+        header = self.session_id + self.counter.to_bytes(SESSION_COUNTER_LEN, "big")
+        nonce = self.nonce_prefix + header[SESSION_ID_LEN:]
+        self.counter += 1
+        with metrics.span("aes_gcm.encrypt", bytes=len(message)):
+            return header + self.aesgcm.encrypt(nonce, message, header)
+
+    def encrypt_compressed_b64(self, message: bytes) -> str:
+        return base64.b64encode(self.encrypt(compress_payload(message))).decode("ascii")
+
+    def encrypt_compressed_cw(self, message: bytes) -> str:
+        from morse_codec import cw_encode
+        return cw_encode(self.encrypt(compress_payload(message)))
+
+class ReplayWindow:
+    """Sliding anti-replay window: the highest counter seen and a bitmap of the size counters below it.
+
+    Memory is bounded whatever the number of messages; a counter older
+    than the window is rejected like a replay.
+    """
+
+    def __init__(self, size: int = SESSION_REPLAY_WINDOW):
+        self.size = size
+        self.highest = -1
+        self.bitmap = 0
+
+    def check(self, counter: int) -> None:
+        if counter > self.highest:
+            return
+        offset = self.highest - counter
+        if offset >= self.size:
+            raise ValueError("Session message too old, below the replay window")
+        if self.bitmap >> offset & 1:
+            raise ValueError("Replayed session message")
+
+    def update(self, counter: int) -> None:
+        """Mark an authenticated counter as seen."""
+        if counter > self.highest:
+            self.bitmap = ((self.bitmap << (counter - self.highest)) | 1) & ((1 << self.size) - 1)
+            self.highest = counter
+        else:
+            self.bitmap |= 1 << (self.highest - counter)
+
+class PQSessionCache:
+    """Receiver side: sessions opened by init messages, looked up by session id (LRU).
+
+    private_key is a secret key or a keystore (see resolve_private_key).
+    """
+
+    def __init__(self, private_key, max_sessions: int = SESSION_CACHE_SIZE, replay_window: int = SESSION_REPLAY_WINDOW):
+        self.private_key = private_key
+        self.max_sessions = max_sessions
+        self.replay_window = replay_window
+        self.sessions = OrderedDict()
+
+    def accept(self, init_message: bytes) -> bytes:
+        key_id, kyber_ct = init_message[:KEY_ID_LEN], init_message[KEY_ID_LEN:]
+        sid = session_id(kyber_ct)
+        if sid not in self.sessions:
+            private_key = resolve_private_key(self.private_key, key_id)
+            shared_secret = kyber_decapsulate(kyber_ct, private_key)
+            aes_key, nonce_prefix = derive_session_keys(shared_secret)
+            self.sessions[sid] = (AESGCM(aes_key), nonce_prefix, ReplayWindow(self.replay_window))
+            if len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+        self.sessions.move_to_end(sid)
+        return sid
+
+    def decrypt(self, data: bytes) -> bytes:
+        header = data[:SESSION_HEADER_LEN]
+        sid = header[:SESSION_ID_LEN]
+        if len(header) != SESSION_HEADER_LEN or sid not in self.sessions:
+            raise KeyError("Unknown session, the init message must be accepted first")
+        aesgcm, nonce_prefix, window = self.sessions[sid]
+        counter = header[SESSION_ID_LEN:]
+        window.check(int.from_bytes(counter, "big"))
+        with metrics.span("aes_gcm.decrypt", bytes=len(data)):
+            message = aesgcm.decrypt(nonce_prefix + counter, data[SESSION_HEADER_LEN:], header)
+        window.update(int.from_bytes(counter, "big"))
+        self.sessions.move_to_end(sid)
+        return message
+
+    def decrypt_compressed_b64(self, cipher_b64: str) -> bytes:
+        return decompress_payload(self.decrypt(base64.b64decode(cipher_b64.encode("ascii"))))
+
+    def decrypt_compressed_cw(self, cipher_cw: str) -> bytes:
+        from morse_codec import cw_decode
+        return decompress_payload(self.decrypt(cw_decode(cipher_cw)))
+
 if __name__ == "__main__":
     pk, sk = kyber_generate_keypair()
     msg = b"Hello, post-quantum Morse world!"
@@ -92,3 +266,7 @@ if __name__ == "__main__":
     print("TEST B64 cipher (start)", ct_b64[:60], "...")
     pt_b64 = pq_decrypt_compressed_b64(ct_b64, sk)
     print("TEST B64 -> clear", pt_b64.decode())
+
+    ct_cw = pq_encrypt_compressed_cw(msg, pk)
+    print("TEST CW cipher (start)", ct_cw[:60], "...")
+    print("TEST CW -> clear", pq_decrypt_compressed_cw(ct_cw.lower(), sk).decode())
@@ -1,15 +1,32 @@
 #!/usr/bin/env python
+import os
 import sys
+import csv
+import json
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+import fft_service
 from pq_crypto import(
     kyber_generate_keypair,
     kyber_save_key,
     kyber_load_key,
     pq_encrypt_compressed_b64,
+    pq_encrypt_compressed_cw,
 )
-from CWToCS8 import convert_to_CW, write_toCS8
+from CWToCS8 import iter_CW, write_toCS8_stream
+from keystore import KEYSTORE_FILE, load_recipient_key
+from encode_workers import init_worker, recipient_key
+from pq_stream import iter_file, pq_encrypt_stream_cw
 
 PUBLIC_KEY_FILE = "kyber_pk.b64"
 PRIVATE_KEY_FILE = "kyber_sk.b64"
+# Ciphertext text encodings: "b64" (default, the original wire format) or
+# "cw" (Morse airtime, see morse_codec), opt-in with --encoding cw
+TEXT_ENCODERS = {"b64": pq_encrypt_compressed_b64, "cw": pq_encrypt_compressed_cw}
+DEFAULT_ENCODING = "b64"
 
 def get_or_create_keypair():
     try:
@@ -24,29 +41,142 @@ def get_or_create_keypair():
         print(f"[OUT] Generated keys in {PUBLIC_KEY_FILE} / {PRIVATE_KEY_FILE}")
     return pk, sk
 
-def demo_enc(plaintext: str, output_file: str, modulation: str):
-    pk, sk = get_or_create_keypair()
+def demo_enc(plaintext: str, output_file: str, modulation: str, recipient: str = None, encoding: str = DEFAULT_ENCODING):
+    if recipient:
+        pk = load_recipient_key(recipient)
+        print(f"[i] Recipient key loaded : {recipient}")
+    else:
+        pk, sk = get_or_create_keypair()
     
     msg_bytes = plaintext.encode("utf-8")
-    cipher_b64 = pq_encrypt_compressed_b64(msg_bytes, pk)
-    print("[OUT] Ciphertext Base64 (start) :", cipher_b64[:80], "...")
+    cipher_text = TEXT_ENCODERS[encoding](msg_bytes, pk)
+    print(f"[OUT] Ciphertext {encoding} (start) :", cipher_text[:80], "...")
     
-    IQ = convert_to_CW(cipher_b64, modulation)
-    write_toCS8(IQ, output_file)
+    write_toCS8_stream(iter_CW(cipher_text, modulation), output_file)
     
     print(f"[OUT] CS8 file generated : {output_file}")
     print(f"[OUT] Modulation         : {modulation}")
     print("[i] Encryption chain demo has ended")
     
+def demo_encfile(input_file: str, output_file: str, modulation: str, recipient: str = None):
+    """Stream a file of any size: read, compress, encrypt, encode and modulate chunk by chunk."""
+    if recipient:
+        pk = load_recipient_key(recipient)
+        print(f"[i] Recipient key loaded : {recipient}")
+    else:
+        pk, sk = get_or_create_keypair()
+
+    t0 = time.perf_counter()
+    words = pq_encrypt_stream_cw(iter_file(input_file), pk)
+    n_samples = write_toCS8_stream(iter_CW(words, modulation), output_file)
+
+    print(f"[OUT] CS8 file generated : {output_file} ({n_samples} samples in {time.perf_counter() - t0:.2f} s)")
+    print(f"[OUT] Modulation         : {modulation}")
+    print("[i] Streaming encryption chain demo has ended")
+
+def _encode_job(index: int, job: dict):
+    try:
+        pk = recipient_key(job.get("recipient") or PUBLIC_KEY_FILE)
+        modulation = (job.get("modulation") or "AM").upper()
+        encode = TEXT_ENCODERS[(job.get("encoding") or DEFAULT_ENCODING).lower()]
+        cipher_text = encode(job["message"].encode("utf-8"), pk)
+        n_samples = write_toCS8_stream(iter_CW(cipher_text, modulation), job["output"])
+        return index, job["output"], len(cipher_text), n_samples, None, metrics.take_snapshot()
+    except Exception as e:
+        return index, job.get("output"), 0, 0, f"{type(e).__name__}: {e}", metrics.take_snapshot()
+
+def load_jobs(path: str):
+    """Yield batch jobs (message, output, optional modulation and recipient) from a JSONL or CSV file."""
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if path.lower().endswith(".csv"):
+            yield from csv.DictReader(f)
+            return
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def run_batch(jobs, workers=None, max_in_flight=None):
+    """Encode jobs over a process pool, yielding results in input order.
+
+    At most max_in_flight jobs (default: 2 per worker) are queued at once,
+    so memory stays bounded for arbitrarily long job files.
+    """
+    workers = workers or fft_service.available_cores()
+    max_in_flight = max_in_flight or 2 * workers
+    initargs = (PUBLIC_KEY_FILE, metrics.enabled())
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=initargs) as pool:
+        pending = deque()
+        for index, job in enumerate(jobs):
+            pending.append(pool.submit(_encode_job, index, job))
+            if len(pending) >= max_in_flight:
+                yield _merge_metrics(*pending.popleft().result())
+        while pending:
+            yield _merge_metrics(*pending.popleft().result())
+
+def _merge_metrics(*result):
+    metrics.merge(result[-1])
+    return result[:-1]
+
+def demo_batch(jobs_file: str, workers=None, encoding: str = DEFAULT_ENCODING):
+    get_or_create_keypair()
+    t0 = time.perf_counter()
+    done = failed = 0
+    jobs = (dict(job, encoding=job.get("encoding") or encoding) for job in load_jobs(jobs_file))
+    for index, output, cipher_len, n_samples, error in run_batch(jobs, workers):
+        if error:
+            failed += 1
+            print(f"[!] Job {index} ({output}) failed: {error}")
+            continue
+        done += 1
+        print(f"[OUT] Job {index} : {output} ({cipher_len} cipher chars, {n_samples} samples)")
+    elapsed = time.perf_counter() - t0
+    print(f"[i] Batch has ended : {done} done, {failed} failed in {elapsed:.2f} s ({done / max(elapsed, 1e-9):.1f} msg/s)")
+    return failed == 0
+
+def pop_encoding_argument(argv) -> str:
+    """Remove --encoding NAME / --encoding=NAME from a hand-parsed argv, returns the encoding."""
+    for i, arg in enumerate(argv):
+        if arg == "--encoding" and i + 1 < len(argv):
+            encoding = argv[i + 1]
+            del argv[i:i + 2]
+        elif arg.startswith("--encoding="):
+            encoding = arg.partition("=")[2]
+            del argv[i]
+        else:
+            continue
+        if encoding.lower() not in TEXT_ENCODERS:
+            raise ValueError(f"encoding must be one of {', '.join(TEXT_ENCODERS)}")
+        return encoding.lower()
+    return DEFAULT_ENCODING
+
 def usage():
     print("Usage :")
     print("  Encoding demo :")
-    print("    python pq_morse_demo.py enc \"<message_text>\" <output_file.cs8> <AM|FM>")
+    print("    python pq_morse_demo.py enc \"<message_text>\" <output_file.cs8> <AM|FM> [recipient]")
+    print(f"    (recipient : Base64 public key file, or key id from {KEYSTORE_FILE})")
+    print("  Streaming file encoding (constant memory, any file size) :")
+    print("    python pq_morse_demo.py encfile <input_file> <output_file.cs8> <AM|FM> [recipient]")
+    print("  Batch encoding (JSONL or CSV with message, output, modulation, recipient, encoding) :")
+    print("    python pq_morse_demo.py batch <jobs.jsonl|jobs.csv> [workers]")
+    print("")
+    print(f"  --encoding {'|'.join(TEXT_ENCODERS)} : ciphertext text encoding of enc and batch (default: {DEFAULT_ENCODING},")
+    print("  cw = Morse airtime code, shorter on air; a batch job field \"encoding\" overrides it)")
+    print("")
+    print("  --profile [--profile-report report.json|report.prom] : per-stage timings, bytes, samples and peak memory")
+    print("  (or SECCW_PROFILE=1 and SECCW_PROFILE_REPORT=<path>)")
     print("")
     print("E.g.:")
     print("  python pq_morse_demo.py enc \"Hello RF world\" out.cs8 AM")
+    print("  python pq_morse_demo.py enc \"Hello RF world\" out.cs8 AM --encoding cw")
+    print("  python pq_morse_demo.py batch jobs.jsonl 8")
     
 def main():
+    metrics.pop_profile_argument(sys.argv)
+    try:
+        encoding = pop_encoding_argument(sys.argv)
+    except ValueError as e:
+        print(f"[!] {e}")
+        sys.exit(1)
     if len(sys.argv) < 2:
         usage()
         sys.exit(1)
@@ -54,13 +184,29 @@ def main():
     cmd = sys.argv[1].lower()
 
     if cmd == "enc":
-        if len(sys.argv) != 5:
+        if len(sys.argv) not in (5, 6):
             usage()
             sys.exit(1)
         message_clair = sys.argv[2]
         output_file = sys.argv[3]
         modulation = sys.argv[4].upper()
-        demo_enc(message_clair, output_file, modulation)
+        recipient = sys.argv[5] if len(sys.argv) == 6 else None
+        demo_enc(message_clair, output_file, modulation, recipient, encoding)
+
+    elif cmd == "encfile":
+        if len(sys.argv) not in (5, 6):
+            usage()
+            sys.exit(1)
+        recipient = sys.argv[5] if len(sys.argv) == 6 else None
+        demo_encfile(sys.argv[2], sys.argv[3], sys.argv[4].upper(), recipient)
+
+    elif cmd == "batch":
+        if len(sys.argv) not in (3, 4):
+            usage()
+            sys.exit(1)
+        workers = int(sys.argv[3]) if len(sys.argv) == 4 else None
+        if not demo_batch(sys.argv[2], workers, encoding):
+            sys.exit(1)
 
     else:
         usage()
@@ -0,0 +1,198 @@
+"""
+Streaming Kyber512 + AES-GCM for large payloads
+
+stream : key_id (4) || kyber_ct (768) || frame || frame || ...
+frame  : length (2, big endian) || AES-GCM(chunk + tag)
+
+The plaintext stream is a payload flag (see payload_codecs) followed by
+the message, raw-deflated with SECCW_DICTIONARY_V1 or stored. It is cut
+into chunks of at most chunk_size bytes. The AES key and a 7-byte nonce
+prefix come from HKDF; each nonce is prefix || counter (4) || final (1),
+so reordered, dropped or truncated frames fail authentication.
+
+Everything is a generator: compression, encryption, text encoding and
+modulation overlap and only a few chunks are held in memory.
+
+"""
+
+import zlib
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives import hashes
+
+from pq_crypto import (
+    KEY_ID_LEN,
+    KYBER_CT_LEN,
+    kyber_key_id,
+    kyber_encapsulate,
+    kyber_decapsulate,
+    resolve_private_key,
+)
+import metrics
+from payload_codecs import FLAG_STORED, FLAG_DEFLATE_DICT_V1, FLAG_DEFLATE, SECCW_DICTIONARY_V1
+
+STREAM_HEADER_LEN = KEY_ID_LEN + KYBER_CT_LEN
+STREAM_LENGTH_LEN = 2
+STREAM_COUNTER_LEN = 4
+STREAM_TAG_LEN = 16
+STREAM_CHUNK_SIZE = 4096
+STREAM_MAX_CHUNK_SIZE = (1 << (8 * STREAM_LENGTH_LEN)) - 1 - STREAM_TAG_LEN
+FILE_READ_SIZE = 1 << 16
+
+def derive_stream_keys(shared_secret: bytes):
+    hkdf = HKDF(
+        algorithm=hashes.SHA256(),
+        length=32 + 12 - STREAM_COUNTER_LEN - 1,
+        salt=None,
+        info=b"SecCW-Kyber-Stream-AES256GCM",
+    )
+    material = hkdf.derive(shared_secret)
+    return material[:32], material[32:]
+
+def _stream_nonce(prefix: bytes, counter: int, final: bool) -> bytes:
+    if counter >= 1 << (8 * STREAM_COUNTER_LEN):
+        raise OverflowError("Stream counter exhausted")
+    return prefix + counter.to_bytes(STREAM_COUNTER_LEN, "big") + (b"\x01" if final else b"\x00")
+
+def iter_file(path: str, size: int = FILE_READ_SIZE):
+    """Read a file as bytes pieces of at most size bytes."""
+    with open(path, "rb") as f:
+        while True:
+            piece = f.read(size)
+            if not piece:
+                return
+            yield piece
+
+def _plaintext_stream(pieces, compress: bool):
+    if not compress:
+        yield bytes([FLAG_STORED])
+        yield from pieces
+        return
+    yield bytes([FLAG_DEFLATE_DICT_V1])
+    c = zlib.compressobj(9, zlib.DEFLATED, -15, 9, zlib.Z_DEFAULT_STRATEGY, SECCW_DICTIONARY_V1)
+    for piece in pieces:
+        with metrics.span("compress", bytes=len(piece)):
+            out = c.compress(piece)
+        if out:
+            yield out
+    yield c.flush()
+
+def _rechunk(pieces, chunk_size):
+    """Regroup bytes pieces into chunks of exactly chunk_size (the last one shorter)."""
+    buffer = bytearray()
+    for piece in pieces:
+        buffer += piece
+        while len(buffer) >= chunk_size:
+            yield bytes(buffer[:chunk_size])
+            del buffer[:chunk_size]
+    yield bytes(buffer)
+
+def pq_encrypt_stream(pieces, public_key: bytes, chunk_size: int = STREAM_CHUNK_SIZE, compress: bool = True):
+    """Encrypt an iterable of bytes pieces, yields the header then one frame per chunk."""
+    if not 0 < chunk_size <= STREAM_MAX_CHUNK_SIZE:
+        raise ValueError(f"chunk_size must be in 1..{STREAM_MAX_CHUNK_SIZE}")
+    kyber_ct, shared_secret = kyber_encapsulate(public_key)
+    aes_key, prefix = derive_stream_keys(shared_secret)
+    aesgcm = AESGCM(aes_key)
+    yield kyber_key_id(public_key) + kyber_ct
+
+    counter = 0
+    chunks = _rechunk(_plaintext_stream(pieces, compress), chunk_size)
+    chunk = next(chunks)
+    for following in chunks:
+        # An empty last chunk only happens when the stream is an exact multiple of chunk_size
+        final = not following
+        with metrics.span("aes_gcm.encrypt", bytes=len(chunk)):
+            ct = aesgcm.encrypt(_stream_nonce(prefix, counter, final), chunk, None)
+        yield len(ct).to_bytes(STREAM_LENGTH_LEN, "big") + ct
+        counter += 1
+        if final:
+            return
+        chunk = following
+    with metrics.span("aes_gcm.encrypt", bytes=len(chunk)):
+        ct = aesgcm.encrypt(_stream_nonce(prefix, counter, True), chunk, None)
+    yield len(ct).to_bytes(STREAM_LENGTH_LEN, "big") + ct
+
+def _decrypt_frames(pieces, private_key):
+    """Authenticated plaintext chunks of a stream given as arbitrary bytes pieces."""
+    buffer = bytearray()
+    aesgcm = None
+    counter = 0
+    final = False
+    for piece in pieces:
+        buffer += piece
+        if aesgcm is None:
+            if len(buffer) < STREAM_HEADER_LEN:
+                continue
+            key_id, kyber_ct = bytes(buffer[:KEY_ID_LEN]), bytes(buffer[KEY_ID_LEN:STREAM_HEADER_LEN])
+            shared_secret = kyber_decapsulate(kyber_ct, resolve_private_key(private_key, key_id))
+            aes_key, prefix = derive_stream_keys(shared_secret)
+            aesgcm = AESGCM(aes_key)
+            del buffer[:STREAM_HEADER_LEN]
+        while len(buffer) >= STREAM_LENGTH_LEN:
+            if final:
+                raise ValueError("Data after the final stream frame")
+            length = int.from_bytes(buffer[:STREAM_LENGTH_LEN], "big")
+            if len(buffer) < STREAM_LENGTH_LEN + length:
+                break
+            ct = bytes(buffer[STREAM_LENGTH_LEN:STREAM_LENGTH_LEN + length])
+            del buffer[:STREAM_LENGTH_LEN + length]
+            with metrics.span("aes_gcm.decrypt", bytes=len(ct)):
+                try:
+                    chunk = aesgcm.decrypt(_stream_nonce(prefix, counter, False), ct, None)
+                except InvalidTag:
+                    chunk = aesgcm.decrypt(_stream_nonce(prefix, counter, True), ct, None)
+                    final = True
+            counter += 1
+            yield chunk
+    if not final or buffer:
+        raise ValueError("Truncated stream")
+
+def pq_decrypt_stream(pieces, private_key, max_piece: int = FILE_READ_SIZE):
+    """Decrypt and decompress a stream, yields plaintext pieces of at most max_piece bytes.
+
+    private_key is a secret key or a keystore (see resolve_private_key).
+    Nothing is yielded before its frame has been authenticated, but a
+    truncated stream is only reported (ValueError) at the end.
+    """
+    d = None
+    for chunk in _decrypt_frames(pieces, private_key):
+        if d is None:
+            if not chunk:
+                continue
+            flag, chunk = chunk[0], chunk[1:]
+            if flag == FLAG_STORED:
+                d = False
+            elif flag in (FLAG_DEFLATE_DICT_V1, FLAG_DEFLATE):
+                d = zlib.decompressobj(-15, *([SECCW_DICTIONARY_V1] if flag == FLAG_DEFLATE_DICT_V1 else []))
+            else:
+                raise ValueError(f"Unknown payload flag 0x{flag:02x}")
+        if d is False:
+            for i in range(0, len(chunk), max_piece):
+                yield chunk[i:i + max_piece]
+            continue
+        while chunk:
+            with metrics.span("decompress", bytes=len(chunk)):
+                out = d.decompress(chunk, max_piece)
+            chunk = d.unconsumed_tail
+            if out:
+                yield out
+    if d is None or (d is not False and (not d.eof or d.unused_data)):
+        raise ValueError("Truncated or corrupt compressed stream")
+    if d is not False:
+        tail = d.flush()
+        if tail:
+            yield tail
+
+# Morse-airtime text (see morse_codec): one word per header or frame, so
+# frame boundaries survive the CW link as word spaces.
+def pq_encrypt_stream_cw(pieces, public_key: bytes, chunk_size: int = STREAM_CHUNK_SIZE, compress: bool = True):
+    from morse_codec import cw_encode
+    for frame in pq_encrypt_stream(pieces, public_key, chunk_size, compress):
+        yield cw_encode(frame)
+
+def pq_decrypt_stream_cw(words, private_key, max_piece: int = FILE_READ_SIZE):
+    from morse_codec import cw_decode
+    return pq_decrypt_stream((cw_decode(w) for w in words if w), private_key, max_piece)
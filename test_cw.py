@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+import io
+import os
+import tempfile
+
+# Keep the FFTW wisdom of the test runs (and of their subprocesses) out of ~/.cache
+os.environ["SECCW_FFTW_WISDOM"] = os.path.join(tempfile.gettempdir(), "seccw_test_fftw_wisdom.json")
+
+import numpy as np
+
+from CWToCS8 import (
+    convert_to_CW,
+    encode_many,
+    get_encoder,
+    cw_num_samples,
+    iter_CW,
+    write_toCS8,
+    write_toCS8_memmap,
+    write_toCS8_stream,
+    write_IQ_stream,
+    write_IQ_memmap,
+    format_from_path,
+    IQ_FORMATS,
+    UPSAMPLE_GAIN,
+    FM_CARRIER_FREQUENCY,
+    FM_DEVIATION,
+    FM_MODULATION_FREQUENCY,
+    rate_plan,
+)
+
+def test_stream_matches_full():
+    message = "CQ CQ DE F4ABC"
+    with tempfile.TemporaryDirectory() as tmp:
+        full_path = os.path.join(tmp, "full.cs8")
+        write_toCS8(convert_to_CW(message, "AM"), full_path)
+        with open(full_path, "rb") as f:
+            expected = f.read()
+
+    buffer = io.BytesIO()
+    written = write_toCS8_stream(iter_CW(message, "AM", chunk_samples=1000), buffer)
+
+    assert written == cw_num_samples(message, "AM")
+    assert buffer.getvalue() == expected
+    print("[OK] test_stream_matches_full : streamed CS8 equals in-memory CS8")
+
+def test_chunk_size_bounded():
+    chunks = list(iter_CW("SOS", "FM", chunk_samples=4096))
+    assert all(len(chunk) <= 4096 for chunk in chunks)
+    assert np.array_equal(np.concatenate(chunks), convert_to_CW("SOS", "FM"))
+    print("[OK] test_chunk_size_bounded : chunks never exceed chunk_samples")
+
+def test_memmap_matches_stream():
+    message = "HELLO RF WORLD"
+    buffer = io.BytesIO()
+    write_toCS8_stream(iter_CW(message, "FM"), buffer)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "mm.cs8")
+        write_toCS8_memmap(message, path, "FM", chunk_samples=777)
+        with open(path, "rb") as f:
+            assert f.read() == buffer.getvalue()
+    print("[OK] test_memmap_matches_stream : memory-mapped CS8 equals streamed CS8")
+
+def test_encoder_cache_and_batch():
+    assert get_encoder("am") is get_encoder("AM")
+    assert get_encoder("AM") is not get_encoder("AM", sample_rate=96000)
+
+    messages = ["ABC", "", "73 DE F4ABC"]
+    outputs = encode_many(messages, "AM")
+    assert len(outputs) == len(messages)
+    for message, output in zip(messages, outputs):
+        assert np.array_equal(output, convert_to_CW(message, "AM"))
+        assert len(output) == get_encoder("AM").num_samples(message)
+    print("[OK] test_encoder_cache_and_batch : cached encoder and encode_many")
+
+def test_phase_continuous_shaped_keying():
+    signal = convert_to_CW("PARIS", "AM")
+    assert signal.dtype == np.complex64 and np.abs(signal).max() <= 127.5
+    # Back at 0 Hz the AM signal is real, positive and free of steps
+    n = np.arange(len(signal))
+    baseband = signal * np.exp(-2j * np.pi * get_encoder("AM").offset_frequency * n / 48000)
+    assert np.abs(baseband.imag).max() < 0.05 and baseband.real.min() > -0.05
+    assert np.abs(np.diff(baseband)).max() < 5
+    encoder = get_encoder("FM")
+    assert np.allclose(encoder.carrier(12345, 5000), encoder._carrier_nco(12345, 5000), atol=1e-3)
+    print("[OK] test_phase_continuous_shaped_keying : no carrier phase or keying steps")
+
+def test_iter_pieces_match_message():
+    pieces = (p for p in ["cq", "DE", "F4ABC"])
+    full = np.concatenate(list(iter_CW("CQ DE F4ABC", "FM", chunk_samples=7000)))
+    streamed = np.concatenate(list(iter_CW(pieces, "FM", chunk_samples=7000)))
+    assert np.array_equal(full, streamed)
+    assert np.array_equal(np.concatenate(list(iter_CW(iter([])))), convert_to_CW(""))
+    print("[OK] test_iter_pieces_match_message : text pieces keyed as the words of one message")
+
+def test_iq_formats():
+    message = "CQ DE F4ABC"
+    signal = convert_to_CW(message, "FM")
+    outputs = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt, iq_format in IQ_FORMATS.items():
+            buffer = io.BytesIO()
+            write_IQ_stream(iter_CW(message, "FM", chunk_samples=3000), buffer, fmt)
+            path = os.path.join(tmp, f"mm.{fmt}")
+            write_IQ_memmap(message, path, "FM", chunk_samples=777, fmt=fmt)
+            with open(path, "rb") as f:
+                assert f.read() == buffer.getvalue()
+            outputs[fmt] = np.frombuffer(buffer.getvalue(), dtype=iq_format.dtype)
+            assert format_from_path(path) == fmt
+
+    # An empty chunk (e.g. from an empty piece) is valid anywhere in the stream
+    empty = np.empty(0, dtype=np.complex64)
+    for fmt in IQ_FORMATS:
+        buffer = io.BytesIO()
+        assert write_IQ_stream([empty, signal, empty], buffer, fmt) == len(signal)
+        assert np.array_equal(np.frombuffer(buffer.getvalue(), dtype=IQ_FORMATS[fmt].dtype), outputs[fmt])
+
+    assert np.array_equal(outputs["cu8"], outputs["cs8"].view(np.uint8) ^ 0x80)
+    assert np.abs(outputs["cs8"][1::2]).max() == 127
+    for fmt, iq_format in IQ_FORMATS.items():
+        decoded = (outputs[fmt].astype(np.float32) - iq_format.offset) / iq_format.scale
+        assert np.abs(decoded.view(np.complex64) - signal).max() <= 0.71
+    print("[OK] test_iq_formats : CS8/CU8/CS16/CF32 streams and memmaps carry the same complex IQ")
+
+def test_upsampled_output():
+    message = "CQ DE F4ABC"
+    rate, offset = 960000, 150e3
+    internal_rate, factor = rate_plan("AM", rate)
+    assert (internal_rate, factor) == (48000, 20)
+    a = np.concatenate(list(iter_CW(message, "AM", chunk_samples=5000, sample_rate=rate, offset_frequency=offset)))
+    b = np.concatenate(list(iter_CW(message, "AM", chunk_samples=77777, sample_rate=rate, offset_frequency=offset)))
+    assert len(a) == len(b) == cw_num_samples(message, "AM", rate) == factor * cw_num_samples(message, "AM")
+    assert np.abs(a - b).max() < 1e-3
+    assert np.abs(a.view(np.float32)).max() < 127.5
+
+    # Envelope of the 48 kHz synthesis, behind the filter delay (16 taps per phase)
+    base = get_encoder("AM", offset_frequency=0.0).encode(message)
+    envelope = np.abs(a[8 * factor::factor])[:len(base)]
+    assert np.abs(envelope - UPSAMPLE_GAIN * np.abs(base[:len(envelope)])).max() < 0.5
+
+    spectrum = np.abs(np.fft.fft(a[:1 << 20]))
+    frequencies = np.fft.fftfreq(1 << 20, 1 / rate)
+    assert abs(frequencies[spectrum.argmax()] - offset) < 1000
+    print("[OK] test_upsampled_output : 960 kS/s output is the 48 kHz signal shifted to its offset")
+
+def test_fm_default_rate_fits_carrier():
+    rate, factor = rate_plan("FM")
+    assert factor == 1 and rate >= 2 * (FM_CARRIER_FREQUENCY + FM_DEVIATION + FM_MODULATION_FREQUENCY)
+    signal = np.concatenate(list(iter_CW("CQ DE F4ABC", "FM")))
+    assert np.array_equal(signal, convert_to_CW("CQ DE F4ABC", "FM"))
+
+    # Wideband FM spreads over carrier +/- deviation: the spectrum is centred
+    # on the carrier, its peak and nearly all its power inside that band
+    power = np.square(np.abs(np.fft.fft(signal[:1 << 20])))
+    frequencies = np.fft.fftfreq(1 << 20, 1 / rate)
+    width = FM_DEVIATION + FM_MODULATION_FREQUENCY
+    band = np.abs(frequencies - FM_CARRIER_FREQUENCY) <= width + 1000
+    assert abs((power * frequencies).sum() / power.sum() - FM_CARRIER_FREQUENCY) < 500
+    assert band[power.argmax()] and power[band].sum() > 0.98 * power.sum()
+
+    # A carrier that would alias is refused
+    for sample_rate in (48000, 250000):
+        try:
+            next(iter_CW("E", "FM", sample_rate=sample_rate))
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(f"FM accepted at {sample_rate} S/s")
+    try:
+        next(iter_CW("E", "FM", sample_rate=2e6, offset_frequency=950e3))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("upconverted FM accepted beyond Nyquist")
+    print("[OK] test_fm_default_rate_fits_carrier : default FM output centred on its carrier, aliasing refused")
+
+def test_profile_stages():
+    import metrics
+    message = "CQ DE F4ABC"
+    metrics.reset()
+    metrics.configure(enabled=True)
+    try:
+        n = write_IQ_stream(iter_CW(message, "AM", chunk_samples=4096), io.BytesIO(), "cs8")
+        stages = metrics.snapshot()
+        text = metrics.to_prometheus(metrics.report())
+    finally:
+        metrics.configure(enabled=False)
+        metrics.reset()
+    assert stages["cw.modulate"]["samples"] == stages["iq.quantize"]["samples"] == n
+    assert stages["iq.write"]["bytes"] == 2 * n
+    assert stages["cw.modulate"]["calls"] == -(-n // 4096)
+    assert f'seccw_stage_samples_total{{stage="cw.keying"}} {n}' in text
+    assert metrics.span("off") is metrics.span("still off")
+    print("[OK] test_profile_stages : stages count samples and bytes, no-op when off")
+
+def test_profile_arguments():
+    import sys
+    import metrics
+    import ReadCS8
+    import CWToCS8
+
+    argv = sys.argv
+    try:
+        sys.argv = ["ReadCS8.py", "--profile", "capture.cs8", "--mode", "psd"]
+        args = ReadCS8.parse_args()
+        assert args.profile and args.input_file == ["capture.cs8"] and args.profile_report is None
+        sys.argv = ["CWToCS8.py", "--profile", "PLAINTEXT", "QSL", "out.cs8", "AM", "--profile-report", "p.prom"]
+        args = CWToCS8.parse_args()
+        assert args.profile and args.output_file == "out.cs8" and args.profile_report == "p.prom"
+    finally:
+        sys.argv = argv
+
+    report = metrics._settings["report"]
+    try:
+        hand = ["pq_morse_demo.py", "--profile", "enc", "QSL", "out.cs8", "--profile-report", "out.json", "AM"]
+        metrics.pop_profile_argument(hand)
+        assert hand == ["pq_morse_demo.py", "enc", "QSL", "out.cs8", "AM"]
+        assert metrics.enabled() and metrics._settings["report"] == "out.json"
+    finally:
+        metrics.configure(enabled=False, report=report)
+        metrics.reset()
+    print("[OK] test_profile_arguments : --profile never takes the next positional, report given apart")
+
+if __name__ == "__main__":
+    test_stream_matches_full()
+    test_chunk_size_bounded()
+    test_memmap_matches_stream()
+    test_encoder_cache_and_batch()
+    test_phase_continuous_shaped_keying()
+    test_iter_pieces_match_message()
+    test_iq_formats()
+    test_upsampled_output()
+    test_fm_default_rate_fits_carrier()
+    test_profile_stages()
+    test_profile_arguments()
+    print("[OUT] All the tests have been a success")
@@ -1,5 +1,14 @@
 #!/usr/bin/env python
 import os
+import zlib
+import json
+import glob
+import base64
+import tempfile
+
+# Keep the FFTW wisdom of the test runs (and of their subprocesses) out of ~/.cache
+os.environ["SECCW_FFTW_WISDOM"] = os.path.join(tempfile.gettempdir(), "seccw_test_fftw_wisdom.json")
+
 from pq_crypto import (
     kyber_generate_keypair,
     pq_encrypt,
@@ -8,7 +17,20 @@ from pq_crypto import (
     pq_decrypt_compressed,
     pq_encrypt_compressed_b64,
     pq_decrypt_compressed_b64,
+    pq_encrypt_compressed_cw,
+    pq_decrypt_compressed_cw,
+    kyber_save_key,
+    PQSession,
+    PQSessionCache,
+    SESSION_HEADER_LEN,
     )
+from pq_morse_demo import run_batch
+from keystore import add_key, open_keystore
+from pq_stream import pq_encrypt_stream, pq_decrypt_stream, pq_encrypt_stream_cw, pq_decrypt_stream_cw
+from payload_codecs import compress_payload, decompress_payload, FLAG_STORED, FLAG_DEFLATE_DICT_V1
+from morse_codec import ALPHABET, cw_encode, cw_decode, airtime_units
+from CWToCS8 import iter_CW, write_toCS8_stream
+from ReadCS8 import read_decode
 
 def test_basic():
     pk, sk = kyber_generate_keypair()
@@ -30,6 +52,23 @@ def test_compressed():
     assert decrypted == message
     print("[OK] test_compressed : compressed encrypt/decrypt")
     
+def test_payload_codecs():
+    for message in (b"", b"K", b"QSL 73", b"CQ CQ CQ DE F4ABC K", os.urandom(300), b"73 " * 2000):
+        data = compress_payload(message)
+        assert decompress_payload(data) == message
+        assert len(data) <= len(message) + 1
+        assert len(data) <= len(zlib.compress(message)) + 1
+    assert compress_payload(os.urandom(64))[0] == FLAG_STORED
+    assert compress_payload(b"Weather report: wind west 15 knots")[0] == FLAG_DEFLATE_DICT_V1
+    assert decompress_payload(zlib.compress(b"legacy zlib payload")) == b"legacy zlib payload"
+    try:
+        decompress_payload(b"\xff")
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("unknown payload flag accepted")
+    print("[OK] test_payload_codecs : flagged codecs, stored bypass and legacy zlib")
+
 def test_compressed_b64():
     pk, sk = kyber_generate_keypair()
     message = b"Test PQ crypto Kyber512 + AES-GCM (compressed + base64 mode)"
@@ -40,6 +79,53 @@ def test_compressed_b64():
     assert decrypted == message
     print("[OK] test_compressed_b64 : compressed Base64 encrypt/decrypt")
     
+def test_compressed_cw():
+    for size in (0, 1, 2, 3, 31, 32, 257, 1100):
+        data = os.urandom(size)
+        text = cw_encode(data)
+        assert set(text) <= set(ALPHABET)
+        assert cw_decode(text) == data and cw_decode(text.lower()) == data
+    data = os.urandom(1100)
+    assert airtime_units(cw_encode(data)) < airtime_units(base64.b64encode(data).decode("ascii"))
+
+    pk, sk = kyber_generate_keypair()
+    message = b"Test PQ crypto Kyber512 + AES-GCM (compressed + Morse airtime mode)"
+    assert pq_decrypt_compressed_cw(pq_encrypt_compressed_cw(message, pk), sk) == message
+
+    # Keyed, decoded from the capture (upper case) and decrypted
+    session = PQSession(pk)
+    receiver = PQSessionCache(sk)
+    receiver.accept(session.init_message)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cw.cs8")
+        write_toCS8_stream(iter_CW(session.encrypt_compressed_cw(b"QSL 73"), "AM"), path)
+        assert receiver.decrypt_compressed_cw(read_decode(path)) == b"QSL 73"
+    print("[OK] test_compressed_cw : Morse airtime encoding, case folding and over-the-air decrypt")
+
+def test_stream():
+    pk, sk = kyber_generate_keypair()
+    data = os.urandom(5000) + b"73 " * 5000
+    for compress in (True, False):
+        for chunk_size in (1, 100, 4096):
+            frames = list(pq_encrypt_stream((data[i:i + 999] for i in range(0, len(data), 999)), pk, chunk_size, compress))
+            blob = b"".join(frames)
+            pieces = list(pq_decrypt_stream((blob[i:i + 333] for i in range(0, len(blob), 333)), sk, max_piece=512))
+            assert b"".join(pieces) == data and max(len(p) for p in pieces) <= 512
+    assert b"".join(pq_decrypt_stream(pq_encrypt_stream(iter([]), pk), sk)) == b""
+
+    frames = list(pq_encrypt_stream(iter([data]), pk, 1000))
+    for broken in (frames[:-1], frames[:2] + frames[3:], frames[:1] + frames[2:3] + frames[1:2] + frames[3:]):
+        try:
+            b"".join(pq_decrypt_stream(iter(broken), sk))
+        except Exception:
+            pass
+        else:
+            raise AssertionError("truncated or reordered stream accepted")
+
+    words = list(pq_encrypt_stream_cw(iter([b"QSL 73 " * 100]), pk, 64))
+    assert b"".join(pq_decrypt_stream_cw(" ".join(words).upper().split(" "), sk)) == b"QSL 73 " * 100
+    print("[OK] test_stream : chunked AEAD stream, truncation/reorder rejection and Morse words")
+
 def test_random_messages(iterations=10):
     pk, sk = kyber_generate_keypair()
     for i in range(iterations):
@@ -56,9 +142,215 @@ def test_random_messages(iterations=10):
         
     print(f"[OK] test_random_messages : {iterations} simple and compressed random messages")
     
+def test_session():
+    pk, sk = kyber_generate_keypair()
+    session = PQSession(pk)
+    receiver = PQSessionCache(sk)
+    assert receiver.accept(session.init_message) == session.session_id
+
+    messages = [b"QSL", b"", b"73 de F4ABC", os.urandom(100)]
+    ciphertexts = [session.encrypt(m) for m in messages]
+    for message, ct in zip(messages, ciphertexts):
+        assert len(ct) == SESSION_HEADER_LEN + len(message) + 16
+        assert receiver.decrypt(ct) == message
+
+    cipher_b64 = session.encrypt_compressed_b64(b"short operator message")
+    assert receiver.decrypt_compressed_b64(cipher_b64) == b"short operator message"
+
+    for bad in (ciphertexts[0], ciphertexts[1][:-1] + bytes([ciphertexts[1][-1] ^ 1])):
+        try:
+            receiver.decrypt(bad)
+        except Exception:
+            pass
+        else:
+            raise AssertionError("replayed or tampered session message accepted")
+
+    # Out of order inside the window is fine, behind it is refused, memory stays bounded
+    receiver = PQSessionCache(sk, replay_window=8)
+    receiver.accept(session.init_message)
+    late = [session.encrypt(b"%d" % i) for i in range(12)]
+    for i in (3, 1, 2, 11, 5):
+        assert receiver.decrypt(late[i]) == b"%d" % i
+    for bad in (late[3], late[2], late[11]):
+        try:
+            receiver.decrypt(bad)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("replayed or too old session message accepted")
+    assert receiver.decrypt(late[4]) == b"4"
+    window = receiver.sessions[session.session_id][2]
+    assert window.bitmap < 1 << 8
+    try:
+        PQSessionCache(sk).decrypt(ciphertexts[2])
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("message accepted without its init message")
+    print("[OK] test_session : session encrypt/decrypt, sliding replay window and tamper rejection")
+
+def test_batch():
+    pk, sk = kyber_generate_keypair()
+    with tempfile.TemporaryDirectory() as tmp:
+        pk_file = os.path.join(tmp, "pk.b64")
+        kyber_save_key(pk, pk_file)
+        jobs = [
+            {"message": f"batch message {i}", "output": os.path.join(tmp, f"{i}.cs8"),
+             "modulation": "FM" if i % 2 else "AM", "recipient": pk_file}
+            for i in range(5)
+        ]
+        jobs.append({"message": "x", "output": os.path.join(tmp, "bad.cs8"), "modulation": "XX", "recipient": pk_file})
+        results = list(run_batch(iter(jobs), workers=2, max_in_flight=2))
+
+        assert [r[0] for r in results] == list(range(6))
+        for index, output, cipher_len, n_samples, error in results[:5]:
+            assert error is None
+            assert os.path.getsize(output) == 2 * n_samples
+        assert results[5][4] is not None
+    print("[OK] test_batch : ordered batch encoding over a process pool")
+
+def test_keystore():
+    keypairs = [kyber_generate_keypair() for _ in range(3)]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "store.keys")
+        key_ids = [add_key(path, pk, sk) for pk, sk in keypairs]
+        public_only, _ = kyber_generate_keypair()
+        add_key(path, public_only)
+        store = open_keystore(path)
+
+        assert len(store) == 4 and store.key_ids()[:3] == key_ids
+        assert not store.has_private_key(store.key_ids()[3])
+        for (pk, sk), key_id in zip(keypairs, key_ids):
+            assert store.public_key(key_id) == pk
+            ct = pq_encrypt_compressed(b"for " + key_id.hex().encode(), pk)
+            assert pq_decrypt_compressed(ct, store) == b"for " + key_id.hex().encode()
+
+        session = PQSession(keypairs[1][0])
+        receiver = PQSessionCache(store)
+        receiver.accept(session.init_message)
+        assert receiver.decrypt(session.encrypt(b"QRV")) == b"QRV"
+
+        try:
+            pq_decrypt(pq_encrypt(b"x", keypairs[0][0]), keypairs[1][1])
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("decrypted with the wrong private key")
+        try:
+            add_key(path, *keypairs[0])
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("duplicate key id accepted")
+    print("[OK] test_keystore : key id lookup, keystore decrypt and wrong-key rejection")
+
+def test_tx_service():
+    import asyncio
+    from tx_service import serve, unix_request, QueueFull
+
+    pk, sk = kyber_generate_keypair()
+    with tempfile.TemporaryDirectory() as tmp, tempfile.TemporaryDirectory() as outside:
+        pk_file = os.path.join(tmp, "pk.b64")
+        kyber_save_key(pk, pk_file)
+        sock = os.path.join(tmp, "tx.sock")
+        os.symlink(os.path.join(outside, "victim.cs8"), os.path.join(tmp, "link.cs8"))
+        os.symlink(outside, os.path.join(tmp, "linkdir"))
+
+        async def http_post(port, body, content_type):
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            head = f"POST /encode HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n"
+            if content_type:
+                head += f"Content-Type: {content_type}\r\n"
+            writer.write((head + "\r\n").encode("latin-1") + body)
+            head, _, body = (await reader.read()).partition(b"\r\n\r\n")
+            writer.close()
+            lines = head.decode("latin-1").split("\r\n")
+            headers = dict(line.lower().split(": ", 1) for line in lines[1:])
+            return int(lines[0].split()[1]), headers, body
+
+        def spools():
+            return set(glob.glob(os.path.join(tempfile.gettempdir(), "seccw_tx_*")))
+
+        async def scenario():
+            spooled = spools()
+            stop = asyncio.Event()
+            started = asyncio.get_running_loop().create_future()
+            server = asyncio.create_task(serve(sock, http_port=0, workers=1, max_queue=2, output_dir=tmp,
+                                               ready=lambda *ready: started.set_result(ready), stop=stop))
+            service, servers = await started
+            port = servers[-1].sockets[0].getsockname()[1]
+            try:
+                request = {"message": "QSL 73", "output": "qsl.cs8", "recipient": pk_file, "encoding": "cw"}
+                result = await asyncio.to_thread(unix_request, sock, request)
+                path = os.path.join(tmp, "qsl.cs8")
+                assert result["status"] == 200 and os.path.getsize(path) == 2 * result["samples"]
+                assert pq_decrypt_compressed_cw(read_decode(path), sk) == b"QSL 73"
+
+                # Outputs cannot leave the output directory
+                for output in (os.path.join(outside, "abs.cs8"), "../escape.cs8", "link.cs8", "linkdir/x.cs8"):
+                    rejected = await asyncio.to_thread(unix_request, sock, {"message": "73", "output": output})
+                    assert rejected["status"] == 400, output
+                assert os.listdir(outside) == []
+
+                # POST /encode only takes JSON, a cross-site form post gets 415
+                body = json.dumps({"message": "73", "recipient": pk_file}).encode("utf-8")
+                assert (await http_post(port, body, None))[0] == 415
+                assert (await http_post(port, body, "text/plain"))[0] == 415
+                assert (await http_post(port, body, "application/json; charset=utf-8"))[0] == 200
+                body = json.dumps({"message": "73", "recipient": pk_file, "stream": True}).encode("utf-8")
+                status, headers, data = await http_post(port, body, "application/json")
+                assert status == 200 and len(data) == int(headers["content-length"]) == 2 * int(headers["x-seccw-samples"])
+                assert spools() == spooled
+
+                streamed = await asyncio.to_thread(unix_request, sock, {"message": "73", "stream": True, "recipient": pk_file})
+                assert len(streamed["data"]) == streamed["bytes"] == 2 * streamed["samples"]
+                # Streamed into a file by the client: the worker spool is sent then deleted
+                local = os.path.join(tmp, "local.cs8")
+                with open(local, "wb") as f:
+                    request = {"message": "QSL 73", "stream": True, "recipient": pk_file, "encoding": "cw"}
+                    streamed = await asyncio.to_thread(unix_request, sock, request, None, f)
+                assert "data" not in streamed and os.path.getsize(local) == streamed["bytes"] == 2 * streamed["samples"]
+                assert pq_decrypt_compressed_cw(read_decode(local), sk) == b"QSL 73"
+                bad = await asyncio.to_thread(unix_request, sock, {"message": "73", "modulation": "XX"})
+                assert bad["status"] == 400
+
+                # One running, two queued: the urgent one overtakes, a fourth is rejected
+                first = service.submit({"message": "first", "recipient": pk_file})
+                await asyncio.sleep(0.05)
+                low = service.submit({"message": "low", "recipient": pk_file, "priority": 9})
+                high = service.submit({"message": "high", "recipient": pk_file, "priority": 0})
+                try:
+                    service.submit({"message": "late", "recipient": pk_file})
+                except QueueFull:
+                    pass
+                else:
+                    raise AssertionError("request accepted beyond the queue bound")
+                order = []
+                for future in asyncio.as_completed([first, low, high]):
+                    order.append((await future)["id"])
+                assert order.index(high.result()["id"]) < order.index(low.result()["id"])
+
+                stats = await asyncio.to_thread(unix_request, sock, {"op": "stats"})
+                assert stats["completed"] == 8 and stats["rejected"] == 1 and stats["queue_depth"] == 0
+                assert stats["latency_ms"]["p50"] <= stats["latency_ms"]["p99"]
+            finally:
+                stop.set()
+                await server
+            assert not os.path.exists(sock) and spools() == spooled
+
+        asyncio.run(scenario())
+    print("[OK] test_tx_service : queued encoding over a UNIX socket and HTTP, confined outputs, spooled streams, priorities, backpressure and latency stats")
+
 if __name__ == "__main__":
     test_basic()
     test_compressed()
+    test_payload_codecs()
     test_compressed_b64()
+    test_compressed_cw()
+    test_stream()
     test_random_messages()
+    test_session()
+    test_batch()
+    test_keystore()
+    test_tx_service()
     print("[OUT] All the tests have been a success")
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+import os
+import tempfile
+
+# Keep the FFTW wisdom of the test runs (and of their subprocesses) out of ~/.cache
+os.environ["SECCW_FFTW_WISDOM"] = os.path.join(tempfile.gettempdir(), "seccw_test_fftw_wisdom.json")
+
+import numpy as np
+
+import fft_service
+from CWToCS8 import iter_CW, write_toCS8_stream, write_IQ_stream, IQ_FORMATS
+
+from ReadCS8 import (
+    EnvelopeDecimator,
+    FFTConsumer,
+    StatsConsumer,
+    WelchPSD,
+    analyze_capture,
+    compute_psd,
+    compute_waterfall,
+    decimate_envelope,
+    detect_segments,
+    expand_inputs,
+    figure_prefix,
+    load_envelope,
+    load_segments,
+    read_decode,
+    run_batch,
+    run_pipeline,
+    segment_windows,
+    write_segments,
+)
+
+def write_tone(path, n_samples, frequency, sampling_rate=48000, amplitude=100):
+    t = np.arange(n_samples) / sampling_rate
+    tone = amplitude * np.exp(2j * np.pi * frequency * t)
+    iq = np.empty(2 * n_samples, dtype=np.int8)
+    iq[0::2] = np.round(tone.real)
+    iq[1::2] = np.round(tone.imag)
+    iq.tofile(path)
+
+def test_psd_peak():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "tone.cs8")
+        write_tone(path, 200000, 6000)
+        freqs, psd_db, count = compute_psd(path, nfft=1024, overlap=0.5)
+        assert count == 1 + (200000 - 1024) // 512
+        assert abs(freqs[np.argmax(psd_db)] - 6000) < 48000 / 1024
+    print("[OK] test_psd_peak : Welch PSD over the whole file finds the tone")
+
+def test_waterfall_rows():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "tone.cs8")
+        write_tone(path, 300000, -3000)
+        freqs, duration, spectrogram = compute_waterfall(path, nfft=512, overlap=0.5, max_rows=100)
+        assert spectrogram.shape == (100, 512)
+        assert abs(duration - 300000 / 48000) < 1e-9
+        peaks = freqs[np.argmax(spectrogram, axis=1)]
+        assert np.all(np.abs(peaks + 3000) < 48000 / 512)
+    print("[OK] test_waterfall_rows : waterfall covers the whole file in bounded rows")
+
+def test_envelope_matches_brute_force():
+    rng = np.random.default_rng(0)
+    raw = rng.integers(-128, 128, size=2 * 100003, dtype=np.int8)
+    envelope = decimate_envelope(raw, n_buckets=777, chunk_samples=4099)
+
+    magnitude = np.abs(raw.astype(np.float32).view(np.complex64))
+    edges = np.r_[envelope.start, len(magnitude)]
+    for k, (a, b) in enumerate(zip(edges[:-1], edges[1:])):
+        assert np.isclose(envelope.amp_max[k], magnitude[a:b].max())
+        assert np.isclose(envelope.amp_min[k], magnitude[a:b].min())
+        assert np.isclose(envelope.amp_mean[k], magnitude[a:b].mean(), rtol=1e-5)
+        assert envelope.i_min[k] == raw[0::2][a:b].min()
+        assert envelope.q_max[k] == raw[1::2][a:b].max()
+    print("[OK] test_envelope_matches_brute_force : chunked min/max/mean decimation")
+
+def test_envelope_keeps_short_burst():
+    raw = np.zeros(2 * 10_000_000, dtype=np.int8)
+    raw[2 * 5_000_001:2 * 5_000_004:2] = 100
+    envelope = decimate_envelope(raw, n_buckets=1000)
+    assert envelope.amp_max.max() == 100
+    assert np.count_nonzero(envelope.amp_max) == 1
+    print("[OK] test_envelope_keeps_short_burst : 3-sample burst survives decimation")
+
+def test_single_pass_pipeline():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "tone.cs8")
+        write_tone(path, 100000, 1500)
+        envelope, (freqs, fft_magnitude), stats, (_, psd_db, count) = run_pipeline(
+            path, [EnvelopeDecimator(), FFTConsumer(max_fft_samples=5000), StatsConsumer(), WelchPSD()],
+            chunk_samples=3001)
+        _, reference_psd, reference_count = compute_psd(path)
+        data = np.fromfile(path, dtype=np.int8)
+
+    assert np.array_equal(envelope.amp_max, decimate_envelope(data).amp_max)
+    assert len(fft_magnitude) == 8192
+    assert abs(freqs[np.argmax(fft_magnitude)] - 1500) < 48000 / 8192 * 2
+    assert stats.n_samples == 100000 and abs(stats.rms - 100) < 1 and stats.peak <= 100.5
+    assert count == reference_count and np.allclose(psd_db, reference_psd, atol=1e-3)
+    print("[OK] test_single_pass_pipeline : one read feeds every consumer")
+
+def test_fft_service_plans():
+    plan = fft_service.get_plan(256, threads=1, effort="estimate")
+    assert fft_service.get_plan(256, threads=1, effort="estimate") is plan
+    assert fft_service.get_plan(256, threads=2, effort="estimate") is not plan
+
+    rng = np.random.default_rng(2)
+    x = (rng.standard_normal(256) + 1j * rng.standard_normal(256)).astype(np.complex64)
+    plan.input_array[:] = x
+    fallback = fft_service.NumpyFFT((256,), "complex64", (-1,))
+    fallback.input_array[:] = x
+    assert np.allclose(plan(), np.fft.fft(x), atol=1e-3)
+    assert np.allclose(fallback(), np.fft.fft(x), atol=1e-3)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "wisdom.json")
+        fft_service.save_wisdom(path)
+        assert os.path.isfile(path) or fft_service.backend() == "numpy"
+    print("[OK] test_fft_service_plans : cached plans, numpy fallback and wisdom export")
+
+def test_formats_read_alike():
+    message = "QRV 73"
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        for fmt in IQ_FORMATS:
+            path = os.path.join(tmp, f"cw.{fmt}")
+            write_IQ_stream(iter_CW(message, "AM"), path, fmt)
+            envelope, stats = run_pipeline(path, [EnvelopeDecimator(500), StatsConsumer()], chunk_samples=10007, fmt=fmt)
+            assert read_decode(path, fmt=fmt) == message
+            results[fmt] = (envelope, stats)
+    ref_envelope, ref_stats = results["cs8"]
+    for envelope, stats in results.values():
+        assert stats.n_samples == ref_stats.n_samples and abs(stats.rms - ref_stats.rms) < 0.5
+        assert np.allclose(envelope.amp_max, ref_envelope.amp_max, atol=1.0)
+        assert np.allclose(envelope.q_min, ref_envelope.q_min, atol=1.0)
+    print("[OK] test_formats_read_alike : every IQ format reads back on the same scale")
+
+def test_decode_roundtrip():
+    message = "CQ DE F4ABC +/= 73"
+    rng = np.random.default_rng(3)
+    with tempfile.TemporaryDirectory() as tmp:
+        for modulation in ("AM", "FM"):
+            path = os.path.join(tmp, f"cw_{modulation}.cs8")
+            write_toCS8_stream(iter_CW(message, modulation), path)
+            raw = np.fromfile(path, dtype=np.int8).astype(np.float32)
+            noisy = np.clip(raw + rng.normal(0, 20, raw.shape), -128, 127).astype(np.int8)
+            noisy.tofile(path)
+            assert read_decode(path) == message
+    print("[OK] test_decode_roundtrip : noisy AM/FM captures decode back to text")
+
+def test_batch_summary():
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = []
+        for name in ("a", "b"):
+            os.makedirs(os.path.join(tmp, name))
+            paths.append(os.path.join(tmp, name, "capture.cs8"))
+            write_toCS8_stream(iter_CW(f"CQ {name}", "AM"), paths[-1])
+        # Two bursts a few seconds apart
+        silence = np.zeros(3 * 48000, dtype=np.complex64)
+        burst = np.concatenate(list(iter_CW("E", "AM")))
+        paths.append(os.path.join(tmp, "two.cs8"))
+        write_IQ_stream([burst, silence, burst], paths[-1])
+        with open(os.path.join(tmp, "notes.txt"), "w") as f:
+            f.write("not a capture")
+
+        assert expand_inputs([tmp]) == sorted(paths)
+        assert expand_inputs([os.path.join(tmp, "*", "*.cs8")]) == sorted(paths[:2])
+        assert figure_prefix(paths[0]) != figure_prefix(paths[1])
+
+        rows = list(run_batch(sorted(paths), workers=2))
+        assert [row["file"] for row in rows] == sorted(paths)
+        by_file = {row["file"]: row for row in rows}
+        for path in paths[:2]:
+            row = by_file[path]
+            assert "error" not in row and row["bursts"] == 1
+            assert abs(row["duration_s"] - row["samples"] / 48000) < 1e-9
+            assert 0 < row["occupied_bandwidth_hz"] < 5000
+        assert by_file[paths[2]]["bursts"] == 2
+
+        # Profiled, the parent adds up each job's counters exactly once
+        import metrics
+        metrics.reset()
+        metrics.configure(enabled=True, memory=False)
+        try:
+            metrics.count("parent.stage")
+            list(run_batch(paths[:2], workers=2))
+            stages = metrics.snapshot()
+        finally:
+            metrics.configure(enabled=False, memory=True)
+            metrics.reset()
+        assert stages["rx.read"]["bytes"] == sum(os.path.getsize(path) for path in paths[:2])
+        assert stages["parent.stage"]["calls"] == 1
+        assert "error" in analyze_capture(os.path.join(tmp, "missing.cs8"))
+    print("[OK] test_batch_summary : directories and globs analyzed in workers, bursts and bandwidth reported")
+
+def test_index_overview():
+    import cs8_index
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "long.cs8")
+        write_toCS8_stream(iter_CW("CQ DE F4ABC " * 30, "AM"), path)
+        assert cs8_index.load_index(path) is None
+        index = cs8_index.build_index(path)
+        assert cs8_index.load_index(path) is not None
+        assert index.n_samples == os.path.getsize(path) // 2
+
+        raw = load_envelope(path, use_index=False, n_buckets=500)
+        fast = index.envelope(n_buckets=500)
+        assert fast.amp_max.max() == raw.amp_max.max() and fast.i_min.min() == raw.i_min.min()
+        assert abs(fast.amp_mean.mean() - raw.amp_mean.mean()) < 1.0
+        stats, = run_pipeline(path, [StatsConsumer()])
+        assert abs(index.stats().rms - stats.rms) < 0.01 * stats.rms
+        times, freqs, powers = index.peak_track()
+        assert abs(np.median(freqs[powers > powers.max() / 2]) - 1000) < 48000 / cs8_index.BLOCK_SAMPLES
+
+        # A window maps only its samples, chunk positions stay absolute in the envelope
+        start, stop = 96000, 144000
+        window = load_envelope(path, start=start, stop=stop, n_buckets=100)
+        assert window.start[0] == start and window.start[-1] < stop
+        data = np.fromfile(path, dtype=np.int8)[2 * start:2 * stop]
+        assert window.i_max.max() == data[0::2].max()
+
+        with open(path, "ab") as f:
+            f.write(b"\x00\x00")
+        assert cs8_index.load_index(path) is None
+    print("[OK] test_index_overview : sidecar pyramid answers overviews, windows map only their samples")
+
+def test_burst_segments():
+    sampling_rate = 48000
+    n = 40 * sampling_rate
+    rng = np.random.default_rng(3)
+    iq = (rng.normal(0, 4, n) + 1j * rng.normal(0, 4, n)).astype(np.complex64)
+    message = np.concatenate(list(iter_CW("CQ CQ", "AM"))) * 0.3
+    for t in (5, 25):
+        iq[t * sampling_rate:t * sampling_rate + len(message)] += message
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sparse.cs8")
+        write_IQ_stream([iq], path)
+        segments = detect_segments(path, sampling_rate)
+        assert len(segments) == 2
+        for segment, t in zip(segments, (5, 25)):
+            assert t <= segment.start < t + 1 and segment.stop < t + len(message) / sampling_rate + 0.1
+            assert segment.snr_db > 6 and abs(segment.frequency - 1000) < 5
+
+        # A window keeps absolute times
+        late, = detect_segments(path, sampling_rate, start=20 * sampling_rate + 100)
+        assert abs(late.start - segments[1].start) < 0.02 and late.frequency == segments[1].frequency
+
+        json_path = os.path.join(tmp, "segments.json")
+        write_segments(segments, json_path, path, sampling_rate)
+        assert load_segments(json_path) == segments
+        windows = segment_windows(segments, sampling_rate, padding=0.1)
+        assert len(windows) == 2 and windows[0][0] == int((segments[0].start - 0.1) * sampling_rate)
+        assert sum(last - first for first, last in windows) < n / 3
+    print("[OK] test_burst_segments : CFAR segments of a sparse capture, JSON roundtrip and padded windows")
+
+def test_live_monitor():
+    import io
+    import subprocess
+    import sys
+    from live_rx import LiveMonitor, RingBuffer
+
+    # A writer lapping the ring loses the oldest bytes, the rest reads back intact
+    stream = (np.arange(10000) % 251).astype(np.uint8)
+    ring = RingBuffer(capacity=4096, frame=1024)
+    source = io.BytesIO(stream.tobytes())
+    while ring.fill_from(source):
+        pass
+    first, data = ring.read(0)
+    assert first == 10000 - 4096 + 1024 and np.array_equal(data, stream[first:])
+    assert len(ring.read(10000)[1]) == 0
+
+    # A generator process as the SDR stand-in
+    code = "from CWToCS8 import iter_CW, write_IQ_stream; write_IQ_stream(iter_CW('CQ DE F4ABC', 'AM'), '-')"
+    root = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.PIPE, cwd=root)
+    monitor = LiveMonitor(proc.stdout, refresh_hz=50).start()
+    updates = list(monitor.updates())
+    counters = monitor.wait()
+    proc.wait()
+    assert monitor.error is None and updates
+    n_samples = counters["received_bytes"] // 2
+    assert counters["analyzed_samples"] + counters["overflow_samples"] == n_samples
+    assert updates[-1].samples == n_samples
+    assert abs(updates[-1].freqs[updates[-1].psd_db.argmax()] - 1000) < 48000 / 1024
+    history = monitor.envelope_history()
+    assert history.amp_max.max() > 100
+    print("[OK] test_live_monitor : ring overflow accounted, generator stream analyzed live")
+
+def test_fdm_channels():
+    from CWToCS8 import AMPLITUDE, FDMSynthesizer, iter_FDM
+    from ReadCS8 import Channelizer, IQWriter, read_channels, run_pipeline
+
+    # One tone on channel 1 only: back at unity gain there, nothing on the others
+    n_channels, length = 4, 48000
+    tone = AMPLITUDE * 0.5 * np.exp(2j * np.pi * 5000 * np.arange(length) / 48000)
+    block = np.zeros((n_channels, length), dtype=np.complex64)
+    block[1] = tone
+    synthesizer = FDMSynthesizer(n_channels, block=1000)
+    fdm = np.concatenate([synthesizer.process(block[:, i:i + 4096]) for i in range(0, length, 4096)])
+    assert np.allclose(fdm, FDMSynthesizer(n_channels).process(block), atol=1e-3)
+
+    messages = ["CQ DE F4ABC", "QSL 73", "TEST 599"]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "tone.cf32")
+        write_IQ_stream([fdm], path, "cf32")
+        results, = run_pipeline(path, [Channelizer(n_channels, [[StatsConsumer()] for _ in range(n_channels)])], fmt="cf32")
+        rms = [stats.rms for stats, in results]
+        assert abs(rms[1] - 0.5 * AMPLITUDE) < 1.5
+        assert max(rms[0], rms[2], rms[3]) < 1e-3 * rms[1]
+
+        # Any chunk size gives the same channels through one FFT plan shape
+        plans = fft_service._build_plan.cache_info().currsize
+        outputs = []
+        for chunk_samples in (10007, 4099):
+            writers = [[IQWriter(os.path.join(tmp, f"{chunk_samples}_{k}.cf32"), "cf32")] for k in range(n_channels)]
+            run_pipeline(path, [Channelizer(n_channels, writers, block=999)], chunk_samples=chunk_samples, fmt="cf32")
+            outputs.append(np.fromfile(os.path.join(tmp, f"{chunk_samples}_1.cf32"), dtype=np.complex64))
+        assert fft_service._build_plan.cache_info().currsize <= plans + 1
+        assert len(outputs[0]) == length and np.allclose(outputs[0], outputs[1], atol=1e-3)
+
+        # Keyed messages on adjacent channels, each one decoded alone
+        path = os.path.join(tmp, "fdm.cs8")
+        write_IQ_stream(iter_FDM(messages, "AM"), path)
+        texts = read_channels(path, len(messages), sampling_rate=len(messages) * 48000, save=True,
+                              prefix=os.path.join(tmp, "fdm_"))
+        assert texts == messages
+        assert os.path.getsize(os.path.join(tmp, "fdm_ch02.cs8")) == os.path.getsize(path) // len(messages)
+    print("[OK] test_fdm_channels : FDM synthesis and channelizer roundtrip, adjacent channels isolated")
+
+if __name__ == "__main__":
+    test_psd_peak()
+    test_waterfall_rows()
+    test_envelope_matches_brute_force()
+    test_envelope_keeps_short_burst()
+    test_single_pass_pipeline()
+    test_fft_service_plans()
+    test_formats_read_alike()
+    test_decode_roundtrip()
+    test_batch_summary()
+    test_index_overview()
+    test_burst_segments()
+    test_live_monitor()
+    test_fdm_channels()
+    print("[OUT] All the tests have been a success")
@@ -0,0 +1,451 @@
+#!/usr/bin/env python
+"""
+Local transmit queue service around the pq_morse_demo encode chain
+
+A long-running process keeps Kyber keys and CW symbol waveforms warm in
+its worker processes, so a message costs its encryption and modulation
+only (no interpreter start, imports or key file loads).
+
+Requests are JSON objects with the batch job fields (message, output,
+modulation, recipient, encoding) plus:
+
+* priority : lower runs first (default 5), FIFO within a priority
+* stream   : true to get the CS8 bytes back instead of writing output
+             (spooled to a temporary file by the worker, then sent in
+             bounded chunks: memory does not grow with the message)
+* format   : cs8 (default: from the output extension), cu8, cs16, cf32
+
+Outputs are paths relative to --output-dir: absolute paths, ".." and
+symlinks leading out of it are rejected (HTTP 400). Without output or
+stream, the file goes to --output-dir as tx_<id>.<fmt>.
+The queue is bounded: a request that finds it full is rejected at once
+(HTTP 503) instead of piling up latency.
+
+UNIX socket : one JSON request per line, one JSON response per line; a
+              streamed response line has "bytes": N and is followed by N
+              raw bytes. {"op": "stats"} returns the statistics.
+HTTP        : POST /encode (Content-Type: application/json body, JSON or
+              application/octet-stream response), GET /stats, GET /health
+              (localhost only).
+
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import tempfile
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import metrics
+import fft_service
+from pq_morse_demo import PUBLIC_KEY_FILE, TEXT_ENCODERS, DEFAULT_ENCODING, get_or_create_keypair
+from encode_workers import init_worker, recipient_key
+from CWToCS8 import IQ_FORMATS, format_from_path, get_encoder, iter_CW, write_IQ_stream
+
+DEFAULT_PRIORITY = 5
+MAX_QUEUE = 64
+LATENCY_WINDOW = 1000
+MAX_REQUEST_BYTES = 1 << 20
+STREAM_CHUNK = 1 << 20
+MODULATIONS = ("AM", "FM")
+
+class QueueFull(Exception):
+    pass
+
+def _init_service_worker(default_recipient: str, profile: bool = False):
+    init_worker(default_recipient, profile)
+    for modulation in MODULATIONS:
+        get_encoder(modulation)
+
+def encode_request(job: dict):
+    """Worker side: (cipher chars, samples, spool file if streamed, metrics)."""
+    pk = recipient_key(job.get("recipient") or PUBLIC_KEY_FILE)
+    cipher_text = TEXT_ENCODERS[job["encoding"]](job["message"].encode("utf-8"), pk)
+    if job["stream"]:
+        # Spooled to disk chunk by chunk, the parent sends it in bounded pieces then deletes it
+        fd, spool = tempfile.mkstemp(prefix="seccw_tx_", suffix=f".{job['format']}")
+    else:
+        # O_NOFOLLOW: a symlink planted after validate() must not redirect the write
+        fd = os.open(job["output"], os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_NOFOLLOW", 0), 0o644)
+        spool = None
+    try:
+        with os.fdopen(fd, "wb") as f:
+            n_samples = write_IQ_stream(iter_CW(cipher_text, job["modulation"]), f, job["format"])
+    except BaseException:
+        if spool is not None:
+            os.remove(spool)
+        raise
+    return len(cipher_text), n_samples, spool, metrics.take_snapshot()
+
+def percentiles(values, points=(50, 90, 99)):
+    if not values:
+        return {f"p{p}": None for p in points}
+    found = np.percentile(np.fromiter(values, dtype=np.float64), points)
+    return {f"p{p}": round(float(v), 2) for p, v in zip(points, found)}
+
+class TxService:
+    """Bounded priority queue drained by as many tasks as executor workers."""
+
+    def __init__(self, workers=None, max_queue=MAX_QUEUE, output_dir=".", default_recipient=PUBLIC_KEY_FILE):
+        self.workers = workers or fft_service.available_cores()
+        self.max_queue = max_queue
+        self.output_dir = output_dir
+        self.default_recipient = default_recipient
+        self.ids = itertools.count(1)
+        self.in_flight = 0
+        self.counters = {"accepted": 0, "completed": 0, "failed": 0, "rejected": 0}
+        self.latency_ms = deque(maxlen=LATENCY_WINDOW)
+        self.wait_ms = deque(maxlen=LATENCY_WINDOW)
+        self.started = time.time()
+
+    async def start(self):
+        self.queue = asyncio.PriorityQueue(self.max_queue)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_service_worker,
+                                            initargs=(self.default_recipient, metrics.enabled()))
+        self.tasks = [asyncio.create_task(self._drain()) for _ in range(self.workers)]
+        return self
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.executor.shutdown(cancel_futures=True)
+
+    def validate(self, request: dict) -> dict:
+        """The job of a request with its defaults filled in, ValueError if malformed."""
+        message = request.get("message")
+        if not isinstance(message, str):
+            raise ValueError("message must be a string")
+        modulation = str(request.get("modulation") or "AM").upper()
+        if modulation not in MODULATIONS:
+            raise ValueError(f"modulation must be one of {', '.join(MODULATIONS)}")
+        encoding = str(request.get("encoding") or DEFAULT_ENCODING).lower()
+        if encoding not in TEXT_ENCODERS:
+            raise ValueError(f"encoding must be one of {', '.join(TEXT_ENCODERS)}")
+        priority = request.get("priority", DEFAULT_PRIORITY)
+        if not isinstance(priority, int):
+            raise ValueError("priority must be an integer")
+        job_id = next(self.ids)
+        stream = bool(request.get("stream"))
+        output = None if stream else request.get("output")
+        if output is not None and not isinstance(output, str):
+            raise ValueError("output must be a string")
+        fmt = str(request.get("format") or (format_from_path(output) if output else "cs8")).lower()
+        if fmt not in IQ_FORMATS:
+            raise ValueError(f"format must be one of {', '.join(IQ_FORMATS)}")
+        if not stream:
+            output = self.resolve_output(output or f"tx_{job_id}.{fmt}")
+        return {"id": job_id, "message": message, "modulation": modulation, "encoding": encoding,
+                "recipient": request.get("recipient"), "priority": priority, "stream": stream,
+                "output": output, "format": fmt}
+
+    def resolve_output(self, output) -> str:
+        """Real path of an output given relative to output_dir, ValueError if it leads out of it."""
+        if os.path.isabs(output) or ".." in output.replace("\\", "/").split("/"):
+            raise ValueError("output must be a relative path without '..' (files go to the output directory)")
+        root = os.path.realpath(self.output_dir)
+        path = os.path.realpath(os.path.join(root, output))
+        if path == root or os.path.commonpath([root, path]) != root:
+            raise ValueError("output leads out of the output directory")
+        return path
+
+    def submit(self, request: dict) -> asyncio.Future:
+        """Queue a request, the future gets its result dict; ValueError if malformed, QueueFull if no room."""
+        job = self.validate(request)
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((job["priority"], job["id"], time.perf_counter(), job, future))
+        except asyncio.QueueFull:
+            self.counters["rejected"] += 1
+            raise QueueFull(f"Queue full ({self.max_queue} requests)") from None
+        self.counters["accepted"] += 1
+        return future
+
+    async def encode(self, request: dict) -> dict:
+        return await self.submit(request)
+
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            _, _, queued, job, future = await self.queue.get()
+            if future.cancelled():
+                continue
+            started = time.perf_counter()
+            self.in_flight += 1
+            try:
+                cipher_len, n_samples, spool, stages = await loop.run_in_executor(self.executor, encode_request, job)
+            except Exception as e:
+                self.counters["failed"] += 1
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            finally:
+                self.in_flight -= 1
+            metrics.merge(stages)
+            done = time.perf_counter()
+            self.counters["completed"] += 1
+            self.wait_ms.append(1000 * (started - queued))
+            self.latency_ms.append(1000 * (done - queued))
+            result = {"id": job["id"], "output": job["output"], "format": job["format"], "cipher_chars": cipher_len,
+                      "samples": n_samples, "queued_ms": round(1000 * (started - queued), 2),
+                      "latency_ms": round(1000 * (done - queued), 2)}
+            if future.done():
+                _remove(spool)
+                continue
+            if spool is not None:
+                result["spool"] = spool
+            future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "uptime_s": round(time.time() - self.started, 1),
+            "workers": self.workers,
+            "queue_depth": self.queue.qsize(),
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            **self.counters,
+            "latency_ms": percentiles(self.latency_ms),
+            "wait_ms": percentiles(self.wait_ms),
+        }
+
+def _remove(spool):
+    if spool is not None and os.path.exists(spool):
+        os.remove(spool)
+
+async def _send_spool(spool, writer):
+    """Send a spool file after what writer has buffered, without reading it in memory at once."""
+    await writer.drain()
+    with open(spool, "rb") as f:
+        # os.sendfile when the transport allows it, else chunked reads paced by the socket
+        await asyncio.get_running_loop().sendfile(writer.transport, f, fallback=True)
+
+async def _answer(service, request):
+    """(status, response dict) of a request; a streamed result is in the file response["spool"]."""
+    if request.get("op", "encode") == "stats":
+        return 200, service.stats()
+    try:
+        return 200, await service.encode(request)
+    except ValueError as e:
+        return 400, {"error": str(e)}
+    except QueueFull as e:
+        return 503, {"error": str(e)}
+    except Exception as e:
+        return 500, {"error": f"{type(e).__name__}: {e}"}
+
+async def handle_unix(service, reader, writer):
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+            except ValueError:
+                status, response = 400, {"error": "Invalid JSON"}
+            else:
+                status, response = await _answer(service, request)
+            spool = response.pop("spool", None)
+            try:
+                response["status"] = status
+                if spool is not None:
+                    response["bytes"] = os.path.getsize(spool)
+                writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                if spool is not None:
+                    await _send_spool(spool, writer)
+                await writer.drain()
+            finally:
+                _remove(spool)
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large", 415: "Unsupported Media Type",
+            503: "Service Unavailable", 500: "Internal Server Error"}
+
+def _is_json(content_type) -> bool:
+    return (content_type or "").split(";")[0].strip().lower() == "application/json"
+
+async def handle_http(service, reader, writer):
+    spool = None
+    try:
+        request_line = (await reader.readline()).decode("latin-1").split()
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        method, path = (request_line + ["", ""])[:2]
+        length = int(headers.get("content-length") or 0)
+        if length > MAX_REQUEST_BYTES:
+            status, response = 413, {"error": "Request too large"}
+        elif method == "GET" and path == "/stats":
+            status, response = 200, service.stats()
+        elif method == "GET" and path == "/health":
+            status, response = 200, {"status": "ok"}
+        elif method == "POST" and path == "/encode" and not _is_json(headers.get("content-type")):
+            # Also keeps browsers off: a cross-site form or fetch without CORS preflight cannot send JSON
+            status, response = 415, {"error": "POST /encode needs Content-Type: application/json"}
+        elif method == "POST" and path == "/encode":
+            try:
+                request = json.loads(await reader.readexactly(length))
+            except ValueError:
+                status, response = 400, {"error": "Invalid JSON"}
+            else:
+                status, response = await _answer(service, request)
+        else:
+            status, response = 404, {"error": f"No route for {method} {path}"}
+
+        spool = response.pop("spool", None)
+        if spool is not None:
+            body, size = b"", os.path.getsize(spool)
+            extra = {"Content-Type": "application/octet-stream", "X-SecCW-Samples": response["samples"],
+                     "X-SecCW-Latency-Ms": response["latency_ms"], "X-SecCW-Format": response["format"]}
+        else:
+            body = json.dumps(response).encode("utf-8")
+            size = len(body)
+            extra = {"Content-Type": "application/json"}
+        if status == 503:
+            extra["Retry-After"] = 1
+        head = [f"HTTP/1.1 {status} {_REASONS[status]}", f"Content-Length: {size}", "Connection: close"]
+        head += [f"{name}: {value}" for name, value in extra.items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body)
+        if spool is not None:
+            await _send_spool(spool, writer)
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        _remove(spool)
+        writer.close()
+
+async def serve(unix_path=None, http_port=None, workers=None, max_queue=MAX_QUEUE, output_dir=".", ready=None, stop=None):
+    """Run the service until stop (an asyncio.Event) is set or the process is signalled."""
+    import signal
+
+    service = await TxService(workers, max_queue, output_dir).start()
+    stop = stop or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (ValueError, RuntimeError):
+            # Not the main thread (tests): stop is set by the caller
+            pass
+    servers = []
+    if unix_path:
+        if os.path.exists(unix_path):
+            os.remove(unix_path)
+        servers.append(await asyncio.start_unix_server(lambda r, w: handle_unix(service, r, w), path=unix_path))
+        print(f"[i] Listening on unix:{unix_path}")
+    if http_port is not None:
+        servers.append(await asyncio.start_server(lambda r, w: handle_http(service, r, w), "127.0.0.1", http_port))
+        print(f"[i] Listening on http://127.0.0.1:{servers[-1].sockets[0].getsockname()[1]}")
+    if ready is not None:
+        ready(service, servers)
+    try:
+        await stop.wait()
+    finally:
+        for server in servers:
+            server.close()
+            await server.wait_closed()
+        await service.close()
+        if unix_path and os.path.exists(unix_path):
+            os.remove(unix_path)
+    return service
+
+def unix_request(path: str, request: dict, timeout=None, sink=None) -> dict:
+    """Client side: send one request to the UNIX socket.
+
+    Streamed bytes are written to sink (a binary file object) STREAM_CHUNK
+    at a time, or returned in response["data"] without a sink.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        with sock.makefile("rwb") as f:
+            f.write(json.dumps(request).encode("utf-8") + b"\n")
+            f.flush()
+            response = json.loads(f.readline())
+            if "bytes" in response and sink is None:
+                response["data"] = f.read(response["bytes"])
+            elif "bytes" in response:
+                remaining = response["bytes"]
+                while remaining:
+                    chunk = f.read(min(remaining, STREAM_CHUNK))
+                    if not chunk:
+                        raise ConnectionError(f"Stream ended {remaining} bytes early")
+                    sink.write(chunk)
+                    remaining -= len(chunk)
+    return response
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Local transmit queue service (Kyber512 + AES-GCM + CW)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    srv = sub.add_parser("serve", help="Run the service")
+    srv.add_argument("--unix", default=None, help="UNIX socket path",)
+    srv.add_argument("--http", type=int, default=None, help="localhost HTTP port (0: any free port)",)
+    srv.add_argument("--workers", type=int, default=None, help="Encoder processes (default: available cores)",)
+    srv.add_argument("--max-queue", type=int, default=MAX_QUEUE,
+                     help=f"Queued requests before new ones are rejected (default: {MAX_QUEUE})",)
+    srv.add_argument("--output-dir", default=".", help="Directory of all the output files (request outputs are relative to it)",)
+    metrics.add_profile_argument(srv)
+    send = sub.add_parser("send", help="Send one encode request to a running service")
+    send.add_argument("--unix", required=True, help="UNIX socket path of the service",)
+    send.add_argument("message", help="Plaintext message",)
+    send.add_argument("output", help="Output file relative to the service --output-dir (with --stream, a local file written by this client)",)
+    send.add_argument("modulation", nargs="?", default="AM", type=str.upper, choices=MODULATIONS,)
+    send.add_argument("--recipient", default=None, help="Public key file or key id",)
+    send.add_argument("--encoding", default=DEFAULT_ENCODING, choices=list(TEXT_ENCODERS),
+                      help=f"Ciphertext text encoding (default: {DEFAULT_ENCODING}, cw: Morse airtime code)",)
+    send.add_argument("--priority", type=int, default=DEFAULT_PRIORITY, help="Lower runs first",)
+    send.add_argument("--stream", action="store_true", help="Get the CS8 bytes back instead of a server-side file",)
+    stats = sub.add_parser("stats", help="Print the statistics of a running service")
+    stats.add_argument("--unix", required=True, help="UNIX socket path of the service",)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.command == "serve":
+        if args.unix is None and args.http is None:
+            print("[!] Give --unix PATH and/or --http PORT")
+            sys.exit(1)
+        metrics.configure_from_args(args)
+        get_or_create_keypair()
+        service = asyncio.run(serve(args.unix, args.http, args.workers, args.max_queue, args.output_dir))
+        print(f"[i] Service has ended : {json.dumps(service.stats())}")
+        sys.exit(0)
+
+    if args.command == "stats":
+        print(json.dumps(unix_request(args.unix, {"op": "stats"}), indent=2))
+        sys.exit(0)
+
+    request = {"message": args.message, "modulation": args.modulation, "recipient": args.recipient,
+               "encoding": args.encoding, "priority": args.priority}
+    if args.stream:
+        request["stream"] = True
+        request["format"] = format_from_path(args.output)
+        with open(args.output, "wb") as f:
+            response = unix_request(args.unix, request, sink=f)
+        if response["status"] != 200:
+            os.remove(args.output)
+    else:
+        request["output"] = args.output
+        response = unix_request(args.unix, request)
+    if response["status"] != 200:
+        print(f"[!] Error ({response['status']}): {response['error']}")
+        sys.exit(1)
+    output = args.output if args.stream else response["output"]
+    print(f"[OUT] {output} : {response['samples']} samples, {response['cipher_chars']} cipher chars,"
+          f" {response['latency_ms']:.1f} ms ({response['queued_ms']:.1f} ms queued)")